@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""A local stand-in of the reporting-auth service.
+
+   It answers GET /auth?secret=TOKEN like the real service: 200 with a list
+   of endpoints (packages) the token can access, 403 otherwise. Point an
+   application to it by setting ERSA_AUTH_URL = "http://localhost:8001/auth"
+   and leaving ERSA_AUTH_TOKEN unset.
+"""
+
+import json
+import time
+import threading
+
+from argparse import ArgumentParser
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(tokens, delay=0.0):
+    """Create a handler class which grants tokens access to packages.
+
+       tokens: a dict of token: list of package names
+       delay: seconds to sleep before answering, to mimic a remote service
+    """
+    class AuthHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Send headers and body in one segment to avoid delayed ACK stalls
+        wbufsize = 65536
+        requests_served = 0
+
+        def do_GET(self):
+            AuthHandler.requests_served += 1
+            if delay:
+                time.sleep(delay)
+            url = urlparse(self.path)
+            secret = parse_qs(url.query).get("secret", [""])[0].lower()
+            if url.path == "/auth" and secret in tokens:
+                status = 200
+                body = json.dumps({"endpoints": [{"name": name} for name in tokens[secret]]})
+            else:
+                status, body = 403, ""
+            body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return AuthHandler
+
+
+def serve(tokens, host="localhost", port=8001, delay=0.0):
+    """Start the stand-in server in a daemon thread, return the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(tokens, delay))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Stand-in reporting-auth service")
+    parser.add_argument("-p", "--port", type=int, default=8001)
+    parser.add_argument("-d", "--delay", type=float, default=0.0,
+                        help="Seconds to delay each answer. Default = 0")
+    parser.add_argument("grants", nargs="+",
+                        help="TOKEN=package1,package2 pairs")
+    args = parser.parse_args()
+
+    tokens = {}
+    for grant in args.grants:
+        token, packages = grant.split("=", 1)
+        tokens[token.lower()] = packages.split(",")
+
+    server = ThreadingHTTPServer(("localhost", args.port),
+                                 make_handler(tokens, args.delay))
+    print("Serving stand-in auth on http://localhost:%d/auth" % args.port)
+    server.serve_forever()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Benchmark require_auth against the stand-in auth service.
+
+   It runs a workload of repeated and unknown tokens through allowed_packages
+   with the verdict cache on and off, and reports hit/miss rates and latency.
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/bench_auth.py -n 2000 -d 0.02
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+
+from argparse import ArgumentParser
+
+sys.path.extend(('.', '..', os.path.dirname(__file__)))
+
+from auth_server import serve  # noqa: E402
+from benchmark import percentile  # noqa: E402
+
+
+def run(apis, tokens, count):
+    latencies = []
+    for _ in range(count):
+        token = random.choice(tokens)
+        start = time.perf_counter()
+        apis.allowed_packages(token)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(title, latencies, stats):
+    print("%-10s total %.3fs, p50 %.3fms, p99 %.3fms, hits %d, misses %d" %
+          (title, sum(latencies), percentile(latencies, 50) * 1000,
+           percentile(latencies, 99) * 1000, stats["hits"], stats["misses"]))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark auth verdict cache")
+    parser.add_argument("-n", "--count", type=int, default=1000)
+    parser.add_argument("-t", "--tokens", type=int, default=20,
+                        help="Number of distinct valid tokens. Default = 20")
+    parser.add_argument("-b", "--bad", type=int, default=5,
+                        help="Number of distinct rejected tokens. Default = 5")
+    parser.add_argument("-d", "--delay", type=float, default=0.0,
+                        help="Seconds the stand-in service takes to answer")
+    parser.add_argument("-p", "--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    import unified.apis as apis
+
+    good = [str(uuid.uuid4()) for _ in range(args.tokens)]
+    bad = [str(uuid.uuid4()) for _ in range(args.bad)]
+    server = serve(dict((token, [apis.PACKAGE]) for token in good),
+                   port=args.port, delay=args.delay)
+    apis.AUTH_URL = "http://localhost:%d/auth" % args.port
+
+    ttl, negative_ttl = apis.AUTH_CACHE.ttl, apis.AUTH_CACHE_NEGATIVE_TTL
+    apis.AUTH_CACHE.ttl = apis.AUTH_CACHE_NEGATIVE_TTL = 0
+    apis.AUTH_CACHE.clear()
+    report("no cache", run(apis, good + bad, args.count), apis.AUTH_CACHE.stats())
+
+    apis.AUTH_CACHE.ttl, apis.AUTH_CACHE_NEGATIVE_TTL = ttl, negative_ttl
+    apis.AUTH_CACHE.clear()
+    report("cached", run(apis, good + bad, args.count), apis.AUTH_CACHE.stats())
+
+    server.shutdown()
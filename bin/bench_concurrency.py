@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""Compare throughput of gunicorn worker profiles with concurrent clients.
+
+   Each profile is started with gunicorn on a local port, then for every
+   number of clients, that many threads send GET requests over keep-alive
+   connections for a number of seconds. The default profiles are sync
+   workers (workers = 2, the generated configuration) and the same workers
+   with threads.
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/bench_concurrency.py xfs /usage?count=10 -t TOKEN
+
+   Requests mostly wait for the database and the auth service. To include
+   the latter, point ERSA_AUTH_URL of the configuration to bin/auth_server.py
+   started with a delay and leave ERSA_AUTH_TOKEN unset, and set
+   ERSA_AUTH_CACHE_TTL = 0 for every request to wait for it. TOKEN is a UUID:
+
+   python bin/auth_server.py -d 0.02 TOKEN=xfs &
+   python bin/bench_concurrency.py xfs /usage?count=10 -t TOKEN -c 2 8 32
+
+   Results depend on the cores of the machine and the database, so compare
+   profiles within one run rather than with numbers of other machines.
+"""
+
+import os
+import sys
+import time
+import shlex
+import threading
+import subprocess
+import http.client
+
+from argparse import ArgumentParser
+
+sys.path.extend(('.', '..', os.path.dirname(__file__)))
+
+from benchmark import percentile  # noqa: E402
+
+PROFILES = {
+    "sync": "--workers 2",
+    "gthread": "--workers 2 --worker-class gthread --threads 8",
+}
+
+
+def start_gunicorn(package, options, port):
+    command = ["gunicorn", "--bind", "127.0.0.1:%d" % port, "--timeout", "7200"] + \
+        shlex.split(options) + ["unified.apis.%s:app" % package]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(300):
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/ping")
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.1)
+    server.terminate()
+    sys.exit("gunicorn did not start: %s" % " ".join(command))
+
+
+def run_clients(port, path, headers, clients, seconds):
+    """Return the number of requests, errors and sorted latencies."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        own = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            own.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), errors[0], sorted(latencies)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark gunicorn worker profiles")
+    parser.add_argument("package", help="e.g. xfs")
+    parser.add_argument("path", help="e.g. /usage?count=10")
+    parser.add_argument("-t", "--token", default=os.environ.get("auth_token", ""),
+                        help="Value of x-ersa-auth-token. Default = $auth_token")
+    parser.add_argument("-c", "--clients", type=int, nargs="+", default=[2, 8, 32])
+    parser.add_argument("-d", "--duration", type=float, default=10,
+                        help="Seconds of each run. Default = 10")
+    parser.add_argument("-p", "--port", type=int, default=8100)
+    parser.add_argument("--profile", action="append",
+                        help="NAME=gunicorn options, repeat for more. "
+                        "Default = sync and gthread with 8 threads")
+    args = parser.parse_args()
+
+    profiles = PROFILES
+    if args.profile:
+        profiles = dict(profile.split("=", 1) for profile in args.profile)
+    headers = {"x-ersa-auth-token": args.token}
+
+    print("%-10s %8s %10s %9s %9s %7s" % ("profile", "clients", "req/sec", "p50 ms", "p95 ms", "errors"))
+    for name, options in profiles.items():
+        server = start_gunicorn(args.package, options, args.port)
+        try:
+            # Warm up connections and caches of all workers
+            run_clients(args.port, args.path, headers, 4, 1)
+            for clients in args.clients:
+                count, errors, latencies = run_clients(
+                    args.port, args.path, headers, clients, args.duration)
+                print("%-10s %8d %10.1f %9.1f %9.1f %7d" % (
+                    name, clients, count / args.duration,
+                    percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+                    errors))
+        finally:
+            server.terminate()
+            server.wait()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""Compare range summaries through snapshot ids with the ts column of facts.
+
+   Temporary tables shaped like xfs snapshot and usage are filled in the
+   database of APP_SETTINGS, then the maximal usage by owner of a range is
+   queried both ways. Nothing is left in the database.
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/bench_fact_ts.py --snapshots 2920 --rows 1000 --days 30
+"""
+
+import sys
+import time
+
+from argparse import ArgumentParser
+
+from sqlalchemy import text
+
+sys.path.extend(('.', '..'))
+
+# A snapshot every 3 hours
+INTERVAL = 3 * 3600
+
+SETUP = """
+CREATE TEMPORARY TABLE bench_snapshot (id uuid PRIMARY KEY, ts integer NOT NULL);
+INSERT INTO bench_snapshot
+    SELECT uuid_generate_v4(), :first + s * :interval FROM generate_series(0, :snapshots - 1) AS s;
+CREATE INDEX ON bench_snapshot (ts);
+CREATE TEMPORARY TABLE bench_usage (
+    id uuid PRIMARY KEY, usage bigint NOT NULL, owner integer NOT NULL,
+    snapshot_id uuid NOT NULL, ts integer NOT NULL);
+INSERT INTO bench_usage
+    SELECT uuid_generate_v4(), (random() * 1e12)::bigint, o, s.id, s.ts
+    FROM bench_snapshot AS s, generate_series(1, :rows) AS o
+    ORDER BY s.ts;
+CREATE INDEX ON bench_usage (snapshot_id);
+CREATE INDEX ON bench_usage USING {method} (ts);
+ANALYZE bench_snapshot;
+ANALYZE bench_usage;
+"""
+
+BY_IDS = """
+SELECT owner, max(usage) FROM bench_usage
+WHERE snapshot_id IN (SELECT id FROM bench_snapshot WHERE ts >= :start AND ts < :end)
+GROUP BY owner
+"""
+
+BY_TS = """
+SELECT owner, max(usage) FROM bench_usage
+WHERE ts >= :start AND ts < :end
+GROUP BY owner
+"""
+
+
+def best_of(connection, statement, params, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        connection.execute(text(statement), params).fetchall()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark ts of fact tables")
+    parser.add_argument("--snapshots", type=int, default=2920,
+                        help="Snapshots, 3 hours apart. Default = 2920 (a year)")
+    parser.add_argument("--rows", type=int, default=1000,
+                        help="Facts per snapshot. Default = 1000")
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7, 30],
+                        help="Lengths of ranges ending at the last snapshot")
+    parser.add_argument("--brin", action="store_true", help="Index ts with BRIN")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    from unified import db
+
+    first = 1451606400  # 2016-01-01
+    last = first + (args.snapshots - 1) * INTERVAL
+    with db.engine.connect() as connection:
+        start = time.perf_counter()
+        for statement in SETUP.format(method="brin" if args.brin else "btree").split(";"):
+            if statement.strip():
+                connection.execute(text(statement), first=first, interval=INTERVAL,
+                                   snapshots=args.snapshots, rows=args.rows)
+        print("%d facts created in %.1fs" % (args.snapshots * args.rows, time.perf_counter() - start))
+
+        print("%6s %14s %14s" % ("days", "snapshot ids", "ts"))
+        for days in args.days:
+            params = {"start": last - days * 86400, "end": last + 1}
+            by_ids = best_of(connection, BY_IDS, params, args.repeat)
+            by_ts = best_of(connection, BY_TS, params, args.repeat)
+            print("%6d %12.1fms %12.1fms" % (days, by_ids * 1000, by_ts * 1000))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""Measure request overhead of logging.
+
+   Requests are sent through the test client of the package with logging
+   off (WARNING), with DEBUG written to a file in the request thread and
+   with DEBUG written by the background thread. Records go to
+   bench_logging.log in LOG_DIR.
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/bench_logging.py xfs /usage?count=10 -n 2000
+"""
+
+import os
+import sys
+import time
+import logging
+import importlib
+
+from argparse import ArgumentParser
+
+sys.path.extend(('.', '..', os.path.dirname(__file__)))
+
+from benchmark import percentile  # noqa: E402
+
+
+def run(client, path, headers, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = client.get(path, headers=headers)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            sys.exit("%s responded %d" % (path, response.status_code))
+    return latencies
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark logging overhead of requests")
+    parser.add_argument("package", help="e.g. xfs")
+    parser.add_argument("path", help="e.g. /usage?count=10")
+    parser.add_argument("-n", "--count", type=int, default=1000)
+    args = parser.parse_args()
+
+    module = importlib.import_module("unified.apis.%s" % args.package)
+    import unified.apis as apis
+    from unified.logs import BackgroundHandler
+
+    client = module.app.test_client()
+    headers = {"x-ersa-auth-token": apis.AUTH_TOKEN or os.environ.get("auth_token", "")}
+    logger = apis.top_logger
+    file_handler = apis.rotating_file_handler("bench_logging")
+
+    modes = [("off", logging.WARNING, file_handler),
+             ("file", logging.DEBUG, file_handler),
+             ("background", logging.DEBUG, BackgroundHandler(file_handler))]
+
+    # Warm up caches and connections
+    run(client, args.path, headers, 10)
+    for name, level, handler in modes:
+        logger.handlers = [handler]
+        logger.setLevel(level)
+        latencies = run(client, args.path, headers, args.count)
+        print("%-10s %8.0f requests/sec, p50 %.3fms, p99 %.3fms" %
+              (name, len(latencies) / sum(latencies), percentile(latencies, 50) * 1000,
+               percentile(latencies, 99) * 1000))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""Compare rows/sec of json() on ORM instances with precompiled serializers.
+
+   Without --db, rows are generated in memory so only serialisation is
+   measured. With --db, rows are read from the usage table of the database
+   in APP_SETTINGS, which includes loading ORM instances for json().
+
+   export APP_SETTINGS=config-hnas.py
+   python bin/bench_serializers.py hnas VirtualVolumeUsage -n 100000
+"""
+
+import sys
+import time
+import uuid
+import importlib
+
+from argparse import ArgumentParser
+
+sys.path.extend(('.', '..'))
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else float("inf")
+
+
+def fake_values(serializer, count):
+    """Tuples in the column order of a serializer, with plausible types."""
+    rows = []
+    for i in range(count):
+        row = []
+        for column in serializer.columns:
+            try:
+                python_type = column.type.python_type
+            except NotImplementedError:
+                python_type = str
+            if python_type is int:
+                row.append(i)
+            elif column.key == "id" or column.key.endswith("_id"):
+                row.append(str(uuid.uuid4()))
+            else:
+                row.append("value%d" % i)
+        rows.append(tuple(row))
+    return rows
+
+
+def in_memory(model, serializer, count):
+    rows = fake_values(serializer, count)
+    instances = [model(**dict(zip(serializer.attributes, row))) for row in rows]
+
+    start = time.perf_counter()
+    for item in instances:
+        item.json()
+    json_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for row in rows:
+        serializer(row)
+    compiled_seconds = time.perf_counter() - start
+    return count, json_seconds, compiled_seconds
+
+
+def from_db(model, serializer, count):
+    start = time.perf_counter()
+    items = model.query.limit(count).all()
+    for item in items:
+        item.json()
+    json_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for row in model.query.with_entities(*serializer.columns).limit(count).all():
+        serializer(row)
+    compiled_seconds = time.perf_counter() - start
+    return len(items), json_seconds, compiled_seconds
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark row serializers")
+    parser.add_argument("package", help="e.g. hnas")
+    parser.add_argument("model", help="e.g. VirtualVolumeUsage")
+    parser.add_argument("-n", "--count", type=int, default=100000)
+    parser.add_argument("--db", action="store_true", help="Read rows from database")
+    args = parser.parse_args()
+
+    module = importlib.import_module("unified.models.%s" % args.package)
+    from unified.models import row_serializer
+
+    model = getattr(module, args.model)
+    serializer = row_serializer(model)
+    if serializer is None:
+        sys.exit("%s has no precompiled serializer" % args.model)
+
+    if args.db:
+        count, json_seconds, compiled_seconds = from_db(model, serializer, args.count)
+    else:
+        count, json_seconds, compiled_seconds = in_memory(model, serializer, args.count)
+
+    print("%d rows" % count)
+    print("json():     %10.0f rows/sec" % rate(count, json_seconds))
+    print("serializer: %10.0f rows/sec" % rate(count, compiled_seconds))
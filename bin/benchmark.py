@@ -0,0 +1,9 @@
+"""Helpers of the bin/bench_*.py scripts."""
+
+
+def percentile(values, pct):
+    """The pct percentile of values by the nearest rank, 0 of none."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
@@ -10,13 +10,17 @@ if [ $UID -ne 0 ]; then
     exit 1
 fi
 
-if [[ $# -ne 1 ]]; then
+if [[ $# -lt 1 || $# -gt 2 ]]; then
     echo "error: missing name of package gunicorn to serve"
+    echo "usage: $0 PACKAGE [THREADS]"
     exit 1
 fi
 
 PDIR=/usr/lib/ersa_reporting
 package=$1
+# Requests mostly wait for the database and the auth service. With THREADS,
+# each worker serves that many requests at a time in threads.
+threads=${2:-1}
 echo "Will create $PDIR/$package.conf"
 cat > $PDIR/$package.conf <<EOF
 timeout = 7200
@@ -28,6 +32,12 @@ accesslog = "/var/log/gunicorn/${package}_access.log"
 errorlog = "/var/log/gunicorn/${package}_error.log"
 loglevel = "info"
 EOF
+if [[ $threads -gt 1 ]]; then
+    cat >> $PDIR/$package.conf <<EOF
+worker_class = "gthread"
+threads = $threads
+EOF
+fi
 
 echo "Running: systemctl start gunicorn.$package.socket"
 systemctl enable gunicorn.$package.socket
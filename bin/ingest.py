@@ -98,6 +98,10 @@ class Ingester:
         if rst.status_code == 204:
             # ingested successfully will receive 204 not 200
             return True
+        elif rst.status_code == 202:
+            # queued by asynchronous ingest, status is at /ingest/<job>
+            logger.debug("Ingest job %s queued" % rst.json()["id"])
+            return True
         elif rst.status_code == 200:
             return len(rst.json()) > 0
         else:
@@ -128,7 +132,7 @@ class Ingester:
         names = []
 
         while True:
-            url = "%s/input?count=5000&page=%s" % (self.endpoint, page)
+            url = "%s/input?count=5000&fields=name&page=%s" % (self.endpoint, page)
             batch = requests.get(url, headers={"x-ersa-auth-token": self.token})
             # This is for back compatibility
             if batch.status_code == 404:
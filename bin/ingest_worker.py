@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+"""Drain the spool of asynchronous ingests in a separate process.
+
+   With INGEST_ASYNC = True in the configuration, API workers only spool
+   payloads of /ingest and this process ingests them, so queries are not
+   slowed down by ingests. Run one per spool: on start, it queues again jobs
+   running longer than INGEST_JOB_TIMEOUT, which it takes as stopped.
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/ingest_worker.py xfs
+"""
+
+import sys
+import importlib
+
+from argparse import ArgumentParser
+
+sys.path.extend(('.', '..'))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Drain spooled ingest jobs")
+    parser.add_argument("package", help="e.g. xfs")
+    parser.add_argument("--once", action="store_true",
+                        help="Exit when the spool is empty")
+    args = parser.parse_args()
+
+    # Importing the package registers its ingest resource
+    importlib.import_module("unified.apis.%s" % args.package)
+    import unified.apis as apis
+
+    if apis.SPOOL is None:
+        sys.exit("INGEST_ASYNC is not set in APP_SETTINGS")
+
+    apis.SPOOL.requeue(apis.INGEST_JOB_TIMEOUT)
+    apis.drain_spool(forever=not args.once)
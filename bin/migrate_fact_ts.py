@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""Add ts of snapshots to fact tables of a package and index it.
+
+   Fact tables created before ts was added to them need this once:
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/migrate_fact_ts.py xfs
+
+   The column is added as nullable, filled for a batch of snapshots per
+   transaction so ingests are not blocked for long, then set NOT NULL and
+   indexed concurrently. It can be run again after a failure. Stop ingests
+   while the last step runs or run it again after them, as facts ingested
+   by an older version have no ts.
+"""
+
+import sys
+import time
+
+from argparse import ArgumentParser
+
+from sqlalchemy import text
+
+sys.path.extend(('.', '..'))
+
+
+def fact_tables(module):
+    """Tables of models of a module which have a ts column and a snapshot."""
+    tables = []
+    for model in vars(module).values():
+        table = getattr(model, "__table__", None)
+        if table is not None and "ts" in table.c and "snapshot_id" in table.c and \
+                model.__module__ == module.__name__ and model.__tablename__ != "snapshot":
+            tables.append(table.name)
+    return sorted(tables)
+
+
+def add_column(connection, table):
+    connection.execute(text('ALTER TABLE "%s" ADD COLUMN IF NOT EXISTS ts INTEGER' % table))
+
+
+def backfill(engine, table, batch_size):
+    """Fill ts of facts without it, batch_size snapshots per transaction."""
+    filled = 0
+    with engine.connect() as connection:
+        snapshot_ids = [row[0] for row in connection.execute(text(
+            'SELECT DISTINCT snapshot_id FROM "%s" WHERE ts IS NULL' % table))]
+    for start in range(0, len(snapshot_ids), batch_size):
+        batch = snapshot_ids[start:start + batch_size]
+        with engine.begin() as connection:
+            result = connection.execute(text(
+                'UPDATE "%s" AS fact SET ts = snapshot.ts FROM snapshot '
+                'WHERE fact.snapshot_id = snapshot.id AND fact.ts IS NULL '
+                'AND fact.snapshot_id = ANY(CAST(:ids AS uuid[]))' % table),
+                ids=[str(snapshot_id) for snapshot_id in batch])
+            filled += result.rowcount
+    return filled
+
+
+def index(engine, table, method):
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text('ALTER TABLE "%s" ALTER COLUMN ts SET NOT NULL' % table))
+        connection.execute(text('CREATE INDEX CONCURRENTLY IF NOT EXISTS "ix_%s_ts" ON "%s" USING %s (ts)' %
+                                (table, table, method)))
+        connection.execute(text('ANALYZE "%s"' % table))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Add ts of snapshots to fact tables")
+    parser.add_argument("package", help="e.g. xfs")
+    parser.add_argument("-b", "--batch", type=int, default=100,
+                        help="Snapshots per transaction. Default = 100")
+    parser.add_argument("--brin", action="store_true",
+                        help="Create a BRIN index, much smaller when facts are ingested in ts order")
+    args = parser.parse_args()
+
+    import importlib
+    module = importlib.import_module("unified.models.%s" % args.package)
+    from unified import db
+
+    tables = fact_tables(module)
+    if not tables:
+        sys.exit("%s has no fact tables with ts" % args.package)
+
+    for table in tables:
+        start = time.time()
+        with db.engine.begin() as connection:
+            add_column(connection, table)
+        filled = backfill(db.engine, table, args.batch)
+        index(db.engine, table, "brin" if args.brin else "btree")
+        print("%s: %d rows filled in %.1fs" % (table, filled, time.time() - start))
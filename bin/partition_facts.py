@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+"""Partition fact tables of a package by month of ts and maintain partitions.
+
+   Convert the tables once, with ingests stopped, then restart the
+   application so ingests create partitions of new months:
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/partition_facts.py xfs migrate
+
+   Each table is converted in one transaction, which blocks queries of it
+   until done: the table is renamed to <table>_unpartitioned, a partitioned
+   table of the same columns, indexes and foreign keys replaces it and facts
+   are copied a month at a time. Use --drop to remove the old table after
+   the copy, otherwise drop it when satisfied. Tables need ts, see
+   bin/migrate_fact_ts.py, and PostgreSQL 11 or later.
+
+   Partitions of coming months can also be created ahead, e.g. by cron:
+
+   python bin/partition_facts.py xfs create --months 2
+
+   Detaching old months is cheap and leaves their facts in standalone tables,
+   while summaries of their whole days are still served from daily rollups:
+
+   python bin/partition_facts.py xfs detach --before 1483228800 [--drop]
+"""
+
+import sys
+import time
+
+from argparse import ArgumentParser
+
+from sqlalchemy import text
+from sqlalchemy.schema import AddConstraint
+
+sys.path.extend(('.', '..'))
+
+
+def migrate(connection, partitions, drop):
+    """Replace the table of partitions by a partitioned one, return rows copied."""
+    from unified.models import month_range
+
+    table = partitions.fact.__table__
+    old = table.name + "_unpartitioned"
+    connection.execute(text('LOCK TABLE "%s" IN ACCESS EXCLUSIVE MODE' % table.name))
+    indexes = [row[0] for row in connection.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE tablename = :table"), table=table.name)]
+    for index in indexes:
+        connection.execute(text('ALTER INDEX "%s" RENAME TO "%s_unpartitioned"' % (index, index)))
+    constraints = [row[0] for row in connection.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) AND contype = 'f'"),
+        table=table.name)]
+    for constraint in constraints:
+        connection.execute(text('ALTER TABLE "%s" RENAME CONSTRAINT "%s" TO "%s_unpartitioned"' %
+                                (table.name, constraint, constraint)))
+    connection.execute(text('ALTER TABLE "%s" RENAME TO "%s"' % (table.name, old)))
+
+    # The partition key has to be part of the primary key
+    connection.execute(text(
+        'CREATE TABLE "%s" (LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        'PARTITION BY RANGE (ts)' % (table.name, old)))
+    connection.execute(text('ALTER TABLE "%s" ADD PRIMARY KEY (id, ts)' % table.name))
+    for index in table.indexes:
+        index.create(connection)
+    for constraint in table.foreign_key_constraints:
+        connection.execute(AddConstraint(constraint))
+
+    first, last = connection.execute(text('SELECT min(ts), max(ts) FROM "%s"' % old)).first()
+    month = month_range(first if first is not None else time.time())[0]
+    last = max(last or 0, int(time.time()))
+    copied = 0
+    while month <= last:
+        end = month_range(month)[1]
+        partitions.create(month, connection)
+        copied += connection.execute(text(
+            'INSERT INTO "%s" SELECT * FROM "%s" WHERE ts >= :start AND ts < :end' %
+            (table.name, old)), start=month, end=end).rowcount
+        month = end
+    partitions.create(month, connection)
+
+    if drop:
+        connection.execute(text('DROP TABLE "%s"' % old))
+    connection.execute(text('ANALYZE "%s"' % table.name))
+    return copied
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Partition fact tables by month")
+    parser.add_argument("package", help="e.g. xfs")
+    commands = parser.add_subparsers(dest="command")
+    migrate_parser = commands.add_parser("migrate", help="Partition existing tables")
+    migrate_parser.add_argument("--drop", action="store_true", help="Drop the old tables")
+    create_parser = commands.add_parser("create", help="Create partitions of coming months")
+    create_parser.add_argument("-m", "--months", type=int, default=1,
+                               help="Months after the current one. Default = 1")
+    detach_parser = commands.add_parser("detach", help="Detach partitions of old months")
+    detach_parser.add_argument("-b", "--before", type=int, required=True,
+                               help="Detach months which end by this ts")
+    detach_parser.add_argument("--drop", action="store_true", help="Drop the detached partitions")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("a command is required")
+
+    import importlib
+    importlib.import_module("unified.models.%s" % args.package)
+    from unified import db
+    from unified.models import PARTITIONS, month_range
+
+    if not PARTITIONS:
+        sys.exit("%s has no partitioned fact tables" % args.package)
+
+    for partitions in PARTITIONS.values():
+        start = time.time()
+        with db.engine.begin() as connection:
+            partitioned = partitions.is_partitioned(connection)
+            if args.command == "migrate":
+                if partitioned:
+                    print("%s: partitioned already" % partitions.table)
+                else:
+                    copied = migrate(connection, partitions, args.drop)
+                    print("%s: %d rows copied in %.1fs" % (partitions.table, copied, time.time() - start))
+            elif not partitioned:
+                print("%s: not partitioned, run migrate first" % partitions.table)
+            elif args.command == "create":
+                month = month_range(time.time())[0]
+                for _ in range(args.months + 1):
+                    print(partitions.create(month, connection))
+                    month = month_range(month)[1]
+            else:
+                for name in partitions.detach(args.before, args.drop, connection):
+                    print("%s: %s" % (name, "dropped" if args.drop else "detached"))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+"""Create daily rollups of a package and compute them from facts.
+
+   Ingests keep rollups of the days of their snapshots up to date. Run this
+   once after upgrading, when rollup tables are empty, or to correct days
+   whose facts have been changed or removed by other means:
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/rebuild_rollups.py xfs --start 1483228800 --end 1485907200
+
+   start and end are rounded down to days, 0 means unbounded. Each rollup is
+   rebuilt in its own transaction.
+"""
+
+import sys
+import time
+
+from argparse import ArgumentParser
+
+sys.path.extend(('.', '..'))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Rebuild daily rollups of a package")
+    parser.add_argument("package", help="e.g. xfs")
+    parser.add_argument("-s", "--start", type=int, default=0, help="Default = 0")
+    parser.add_argument("-e", "--end", type=int, default=0, help="Default = 0")
+    args = parser.parse_args()
+
+    import importlib
+    importlib.import_module("unified.models.%s" % args.package)
+    from unified import db
+    from unified.models import ROLLUPS
+
+    if not ROLLUPS:
+        sys.exit("%s has no rollups" % args.package)
+
+    db.metadata.create_all(db.engine, tables=[rollup.model.__table__ for rollup in ROLLUPS.values()])
+
+    for rollup in ROLLUPS.values():
+        start = time.time()
+        rows = rollup.rebuild(args.start, args.end)
+        db.session.commit()
+        print("%s: %d rows in %.1fs" % (rollup.model.__tablename__, rows, time.time() - start))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""Downsample old snapshots of a package and delete the rest of their facts.
+
+   Snapshots older than --hourly-after days are reduced to one per hour and
+   those older than --daily-after days to one per day, by default
+   RETENTION_HOURLY_AFTER_DAYS and RETENTION_DAILY_AFTER_DAYS of the
+   configuration, 0 means never:
+
+   export APP_SETTINGS=config-xfs.py
+   python bin/retention.py xfs --hourly-after 90 --daily-after 365 --dry-run
+
+   The latest snapshot of an hour or day is kept and the latest fact of each
+   entity of it takes the maxima of the hour or day, which summaries and
+   daily rollups rely on. Days are processed in order, --batch days per
+   transaction, so ingests and queries are not blocked for long. With --every,
+   it runs again after that many hours, e.g. as a service. Deleted rows are
+   reclaimed by autovacuum. Each batch records an input, which changes the
+   data version of the API, and the API caches summaries of ranges ending
+   within the configured days only until then, so set the configuration
+   rather than passing larger ages here.
+"""
+
+import sys
+import time
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+sys.path.extend(('.', '..'))
+
+
+def downsample(retention, before_ts, resolution, batch, dry_run):
+    """Downsample snapshots before before_ts, return deleted rows by table."""
+    from unified import db
+    from unified.models import DAY
+
+    before_ts -= before_ts % resolution
+    days = retention.days(before_ts, resolution)
+    db.session.rollback()
+    total = OrderedDict()
+    for start in range(0, len(days), batch):
+        end = min(days[min(start + batch, len(days)) - 1] + DAY, before_ts)
+        reclaimed = retention.downsample(days[start], end, resolution)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        for table, rows in reclaimed.items():
+            total[table] = total.get(table, 0) + rows
+    return total
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Downsample old snapshots of a package")
+    parser.add_argument("package", help="e.g. xfs")
+    parser.add_argument("--hourly-after", type=float,
+                        help="Keep a snapshot per hour older than days. "
+                        "Default = RETENTION_HOURLY_AFTER_DAYS or 0")
+    parser.add_argument("--daily-after", type=float,
+                        help="Keep a snapshot per day older than days. "
+                        "Default = RETENTION_DAILY_AFTER_DAYS or 0")
+    parser.add_argument("-b", "--batch", type=int, default=1,
+                        help="Days per transaction. Default = 1")
+    parser.add_argument("--every", type=float, help="Run again after hours")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report rows to delete and roll back")
+    args = parser.parse_args()
+
+    import importlib
+    importlib.import_module("unified.models.%s" % args.package)
+    from unified import app
+    from unified.models import RETENTIONS, RESOLUTIONS, DAY
+
+    if not RETENTIONS:
+        sys.exit("%s has no snapshot retention" % args.package)
+
+    # Older snapshots first, so hours are not merged of days merged already
+    ages = OrderedDict([
+        ("day", args.daily_after if args.daily_after is not None
+         else app.config.get("RETENTION_DAILY_AFTER_DAYS", 0)),
+        ("hour", args.hourly_after if args.hourly_after is not None
+         else app.config.get("RETENTION_HOURLY_AFTER_DAYS", 0))])
+    if not any(ages.values()):
+        sys.exit("Neither --hourly-after nor --daily-after is set")
+
+    while True:
+        for retention in RETENTIONS.values():
+            for resolution, age in ages.items():
+                if not age:
+                    continue
+                start = time.time()
+                reclaimed = downsample(retention, int(start - age * DAY), RESOLUTIONS[resolution],
+                                       max(args.batch, 1), args.dry_run)
+                print("%s: one per %s older than %g days in %.1fs" % (
+                    retention.table, resolution, age, time.time() - start))
+                for table, rows in reclaimed.items():
+                    print("  %s: %d rows %s" % (table, rows, "to delete" if args.dry_run else "deleted"))
+        sys.stdout.flush()
+        if not args.every:
+            break
+        time.sleep(args.every * 3600)
@@ -0,0 +1,109 @@
+""" Serve applications of several unified.apis packages in one process.
+
+    Each package is mounted under a URL prefix, e.g. /xfs/usage, with its own
+    configuration file. Tables of packages collide in one SQLAlchemy MetaData
+    and the configuration is read when `unified` is imported, so each package
+    is loaded from a separate copy of the `unified` package, named after its
+    prefix. The copies share the process, its libraries, engines of the
+    same database and handlers of the same log file.
+
+    A settings file maps prefixes to a package and its configuration:
+
+    MOUNTS = {
+        "/xfs": ("xfs", "/usr/lib/ersa_reporting/config-xfs.py"),
+        "/hnas": ("hnas", "/usr/lib/ersa_reporting/config-hnas.py"),
+    }
+
+    and is set in environment variable DISPATCHER_SETTINGS for gunicorn:
+
+    gunicorn -e DISPATCHER_SETTINGS=mounts.py dispatcher:application
+"""
+
+import os
+import re
+import sys
+import runpy
+import importlib
+import importlib.util
+import logging.handlers
+
+from sqlalchemy import create_engine
+from werkzeug.exceptions import NotFound
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+# Engines by database URI and options, shared by the copies
+_ENGINES = {}
+
+
+def shared_engine(sa_url, engine_opts):
+    """Create an engine once for packages of the same database."""
+    key = (str(sa_url), repr(sorted(engine_opts.items())))
+    if key not in _ENGINES:
+        _ENGINES[key] = create_engine(sa_url, **engine_opts)
+    return _ENGINES[key]
+
+
+# Log file handlers by path, shared by copies of the same package, as handlers
+# of one file would each rotate it under the others
+_FILE_HANDLERS = {}
+
+
+def shared_file_handler(filename, **kwargs):
+    """Open a log file once for packages writing to it."""
+    path = os.path.abspath(filename)
+    if path not in _FILE_HANDLERS:
+        _FILE_HANDLERS[path] = logging.handlers.RotatingFileHandler(filename, **kwargs)
+    return _FILE_HANDLERS[path]
+
+
+def module_name(prefix):
+    """Name of the copy of unified for a prefix, e.g. unified_xfs for /xfs."""
+    return "unified_" + re.sub(r"\W", "_", prefix.strip("/"))
+
+
+def load_package(prefix, package, settings):
+    """Import unified.apis.package from a new copy of unified configured by
+       settings and return its Flask application.
+    """
+    name = module_name(prefix)
+    if name in sys.modules:
+        raise ValueError("%s has been mounted" % prefix)
+
+    location = importlib.util.find_spec("unified").submodule_search_locations
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(location[0], "__init__.py"),
+        submodule_search_locations=list(location))
+
+    previous = os.environ.get("APP_SETTINGS")
+    os.environ["APP_SETTINGS"] = settings
+    try:
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        module.db.engine_factory = shared_engine
+        importlib.import_module(name + ".logs").file_handler_factory = shared_file_handler
+        importlib.import_module("%s.apis.%s" % (name, package))
+    except BaseException:
+        for loaded in [key for key in sys.modules if key == name or key.startswith(name + ".")]:
+            del sys.modules[loaded]
+        raise
+    finally:
+        if previous is None:
+            del os.environ["APP_SETTINGS"]
+        else:
+            os.environ["APP_SETTINGS"] = previous
+    return module.app
+
+
+def create_application(mounts):
+    """A WSGI application of {prefix: (package, settings)}."""
+    apps = {}
+    for prefix, (package, settings) in sorted(mounts.items()):
+        prefix = "/" + prefix.strip("/")
+        apps[prefix] = load_package(prefix, package, os.path.abspath(settings))
+    return DispatcherMiddleware(NotFound(), apps)
+
+
+if "DISPATCHER_SETTINGS" in os.environ:
+    application = create_application(
+        runpy.run_path(os.environ["DISPATCHER_SETTINGS"])["MOUNTS"])
@@ -4,9 +4,12 @@
 # pylint: disable=no-init, too-few-public-methods, no-self-use
 
 import re
+import time
 import uuid
+import threading
 
 from functools import wraps
+from collections import OrderedDict
 
 import requests
 import logging
@@ -50,6 +53,67 @@ AUTH_TOKEN = app.config["ERSA_AUTH_TOKEN"]
 if AUTH_TOKEN is not None:
     AUTH_TOKEN = AUTH_TOKEN.lower()
 
+AUTH_URL = app.config.get("ERSA_AUTH_URL", "https://reporting.ersa.edu.au/auth")
+AUTH_TIMEOUT = app.config.get("ERSA_AUTH_TIMEOUT", 10)
+AUTH_CACHE_TTL = app.config.get("ERSA_AUTH_CACHE_TTL", 300)
+AUTH_CACHE_NEGATIVE_TTL = app.config.get("ERSA_AUTH_CACHE_NEGATIVE_TTL", 30)
+# Statuses of rejected tokens, others are failures of the service, not cached
+AUTH_REJECTED_STATUSES = (401, 403, 404)
+AUTH_CACHE_SIZE = app.config.get("ERSA_AUTH_CACHE_SIZE", 10000)
+
+
+class AuthCache(object):
+    """Allowed packages by token, least recently used dropped when full.
+
+       unified.cache.TTLCache cannot be imported here, importing unified
+       creates its application. Safe to share between threads.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        # token: (expiry, allowed package names)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._data.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._data[token]
+                return None
+            self._data.move_to_end(token)
+            return entry[1]
+
+    def set(self, token, packages, ttl):
+        with self._lock:
+            self._data[token] = (time.monotonic() + ttl, packages)
+            self._data.move_to_end(token)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ThreadLocalSession(object):
+    """A requests.Session for each thread, sessions are not safe to share."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, *args, **kwargs):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session.get(*args, **kwargs)
+
+
+AUTH_CACHE = AuthCache(AUTH_CACHE_SIZE)
+AUTH_SESSION = ThreadLocalSession()
+
 UUID_NAMESPACE = uuid.UUID("aeb7cf1c-a842-4592-82e9-55d2dad00150")
 
 if "LOG_DIR" in app.config:
@@ -182,6 +246,35 @@ def constant_time_compare(val1, val2):
     return result == 0
 
 
+def allowed_packages(token):
+    """Get names of packages a token is allowed to access, cached with a TTL."""
+    cached = AUTH_CACHE.get(token)
+    if cached is not None:
+        return cached
+
+    try:
+        auth_response = AUTH_SESSION.get(AUTH_URL,
+                                         params={"secret": token},
+                                         timeout=AUTH_TIMEOUT)
+    except requests.RequestException as e:
+        top_logger.error("Auth service is not available. Detail: %s", e)
+        return frozenset()
+
+    if auth_response.status_code == 200:
+        packages = frozenset(endpoint["name"]
+                             for endpoint in auth_response.json()["endpoints"])
+        ttl = AUTH_CACHE_TTL
+    elif auth_response.status_code in AUTH_REJECTED_STATUSES:
+        packages = frozenset()
+        ttl = AUTH_CACHE_NEGATIVE_TTL
+    else:
+        top_logger.error("Auth service failed with status %d", auth_response.status_code)
+        return frozenset()
+
+    AUTH_CACHE.set(token, packages, ttl)
+    return packages
+
+
 def require_auth(func):
     """
     Authenticate via the external reporting-auth service.
@@ -205,14 +298,7 @@ def require_auth(func):
             if constant_time_compare(token, AUTH_TOKEN):
                 success = True
         else:
-            auth_response = requests.get(
-                "https://reporting.ersa.edu.au/auth?secret=%s" % token)
-            if auth_response.status_code == 200:
-                auth_data = auth_response.json()
-                for endpoint in auth_data["endpoints"]:
-                    if endpoint["name"] == PACKAGE:
-                        success = True
-                        break
+            success = PACKAGE in allowed_packages(token)
 
         if success:
             return func(*args, **kwargs)
@@ -11,7 +11,7 @@ setup(name="ersa-reporting",
       install_requires=["flask>=0.10.1", "flask-restful", "flask-cors",
                         "flask-sqlalchemy", "psycopg2", "requests", "arrow",
                         "python-keystoneclient", "python-novaclient"],
-      py_modules=["nectar"],
+      py_modules=["nectar", "dispatcher"],
       packages=["unified", "unified.apis", "unified.models"],
       scripts=["bin/gconf_generator.sh",
                "bin/service_generator.sh",
@@ -2,7 +2,9 @@ import os
 import sys
 import logging
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
+from sqlalchemy import orm, event
+from sqlalchemy.engine.url import make_url
 
 if 'APP_SETTINGS' not in os.environ:
     sys.exit('Missing APP_SETTINGS envrionment variable')
@@ -11,6 +13,106 @@ LOG_FORMAT = '%(asctime)s %(levelname)s %(module)s %(filename)s %(lineno)d: %(me
 SAN_MS_DATE = '%Y-%m-%d %H:%M:%S'
 LOG_FORMATTER = logging.Formatter(LOG_FORMAT, SAN_MS_DATE)
 
+
+class RoutingSession(SignallingSession):
+    """A session which reads from replicas while info["replica"], a function
+       of a bind key, tells the replica of the bind is fresh.
+
+       Flushes always go to the primary.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        bind = super().get_bind(mapper, clause)
+        is_fresh = self.info.get("replica")
+        if is_fresh and not self._flushing and is_fresh(self.db.get_bind_key(self.app, bind)):
+            return self.db.get_replica_engine(self.app, bind)
+        return bind
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """SQLAlchemy with read-only replicas.
+
+       Like SQLALCHEMY_DATABASE_URI and SQLALCHEMY_BINDS, SQLALCHEMY_REPLICA_URI
+       is the replica of the default database and SQLALCHEMY_REPLICA_BINDS maps
+       bind keys to URIs of their replicas.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # {primary engine: replica engine or the primary without a replica}
+        self._replica_engines = {}
+        # Engines of this instance and (event, listener) added to each
+        self._engines = []
+        self._engine_listeners = []
+        # Creates engines instead of sqlalchemy.create_engine if set
+        self.engine_factory = None
+        super().__init__(*args, **kwargs)
+
+    def create_engine(self, sa_url, engine_opts):
+        factory = self.engine_factory or super().create_engine
+        engine = factory(sa_url, engine_opts)
+        for identifier, listener in self._engine_listeners:
+            if not event.contains(engine, identifier, listener):
+                event.listen(engine, identifier, listener)
+        self._engines.append(engine)
+        return engine
+
+    def listen_engines(self, identifier, listener):
+        """Listen to an event of the engines of this instance, created or to come.
+
+           Unlike listeners of the Engine class, they do not see engines of
+           other copies of the package in dispatcher.py, except engines the
+           copies share.
+        """
+        self._engine_listeners.append((identifier, listener))
+        for engine in self._engines:
+            event.listen(engine, identifier, listener)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def replica_uris(self, app=None):
+        """{bind key: URI} of replicas, None is the key of the default database."""
+        config = self.get_app(app).config
+        uris = dict(config.get("SQLALCHEMY_REPLICA_BINDS") or {})
+        if config.get("SQLALCHEMY_REPLICA_URI"):
+            uris[None] = config["SQLALCHEMY_REPLICA_URI"]
+        return uris
+
+    def get_bind_key(self, app, engine):
+        """The bind key of a primary engine, None for the default database."""
+        if engine is self.get_engine(app):
+            return None
+        for key in list(app.config.get("SQLALCHEMY_BINDS") or {}):
+            if self.get_engine(app, bind=key) is engine:
+                return key
+        return None
+
+    def get_replica_engine(self, app=None, engine=None):
+        """The replica engine of a primary engine, the primary if it has no replica."""
+        app = self.get_app(app)
+        if engine is None:
+            engine = self.get_engine(app)
+        replica = self._replica_engines.get(engine)
+        if replica is not None:
+            return replica
+
+        replica = engine
+        uris = self.replica_uris(app)
+        for key in [None] + list(app.config.get("SQLALCHEMY_BINDS") or {}):
+            if key in uris and self.get_engine(app, bind=key) is engine:
+                options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+                # Writes fail on any server, not only on a hot standby
+                options["connect_args"] = dict(options.get("connect_args", {}),
+                                               options="-c default_transaction_read_only=on")
+                replica = self.create_engine(make_url(uris[key]), options)
+                break
+        return self._replica_engines.setdefault(engine, replica)
+
+
 app = Flask("app")
 app.config.from_envvar('APP_SETTINGS')
 
@@ -1,19 +1,50 @@
+import io
+import os
+import csv
+import json
+import time
+import zlib
 import uuid
+import random
+import base64
+import hashlib
+import binascii
 import requests
+import threading
+import psycopg2.extensions
 
 import logging
 import logging.handlers
 
 import flask_restful
 
-from functools import wraps
-from flask import request
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from functools import wraps, lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, Response, stream_with_context, g, has_request_context, \
+    has_app_context, current_app
 from flask_cors import CORS
 from flask_restful import Resource, reqparse
+from flask_sqlalchemy import Pagination
+from sqlalchemy import and_, or_, tuple_, func, select
+from sqlalchemy.orm import ColumnProperty
+from sqlalchemy.dialects.postgresql import UUID, insert
 from sqlalchemy.orm.relationships import RelationshipProperty
+from werkzeug.exceptions import BadRequest, HTTPException
+from werkzeug.http import quote_etag
 
 from .. import db, app
-from ..models import Input
+from ..cache import TTLCache
+from ..logs import BackgroundHandler, open_file_handler
+from ..spool import Spool, QUEUED
+from ..metrics import REGISTRY, Counter, Histogram, Gauge, COUNT_BUCKETS
+from ..models import Input, STREAM_CHUNK_SIZE, row_serializer, estimate_count, \
+    snapshot_index, invalidate_snapshot_indexes, invalidate_dimension_names
 
 restapi = flask_restful.Api(app)
 cors = CORS(app)
@@ -26,6 +57,16 @@ QUERY_PARSER.add_argument("count",
                           type=int,
                           default=1000,
                           help="Items per page")
+# Keyset pagination: an empty value starts from the first item
+QUERY_PARSER.add_argument("after", help="Cursor of the last item seen")
+QUERY_PARSER.add_argument("fields", help="Comma separated attributes to return")
+# How to count all items: exact runs COUNT(*), estimate asks the planner
+QUERY_PARSER.add_argument("total", choices=("exact", "estimate", "none"),
+                          help="Total count of items")
+
+# Stream large responses as a JSON array or newline delimited JSON
+STREAM_PARSER = reqparse.RequestParser()
+STREAM_PARSER.add_argument("stream", choices=("json", "ndjson"), help="Stream format")
 
 # All defalut time range arguments
 RANGE_PARSER = reqparse.RequestParser()
@@ -47,6 +88,68 @@ if "ERSA_AUTH_TOKEN" in app.config:
 if AUTH_TOKEN is not None:
     AUTH_TOKEN = AUTH_TOKEN.lower()
 
+# The external reporting-auth service and how its verdicts are cached.
+# Rejected tokens are cached for a shorter time than accepted ones. Other
+# statuses than these rejections are failures of the service, not cached.
+AUTH_REJECTED_STATUSES = (401, 403, 404)
+AUTH_URL = app.config.get("ERSA_AUTH_URL", "https://reporting.ersa.edu.au/auth")
+AUTH_TIMEOUT = app.config.get("ERSA_AUTH_TIMEOUT", 10)
+AUTH_CACHE_TTL = app.config.get("ERSA_AUTH_CACHE_TTL", 300)
+AUTH_CACHE_NEGATIVE_TTL = app.config.get("ERSA_AUTH_CACHE_NEGATIVE_TTL", 30)
+AUTH_CACHE = TTLCache(maxsize=app.config.get("ERSA_AUTH_CACHE_SIZE", 10000),
+                      ttl=AUTH_CACHE_TTL)
+
+
+class ThreadLocalSession(object):
+    """A requests.Session for each thread, sessions are not safe to share."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def get(self, *args, **kwargs):
+        return self.session.get(*args, **kwargs)
+
+
+# Keep-alive connections to the auth service
+AUTH_SESSION = ThreadLocalSession()
+
+# Results of range queries: (immutable, result) by request. Results of
+# ranges ending before the latest snapshot stay, others go when data is
+# ingested. Results with more items than SUMMARY_CACHE_MAX_ITEMS are not kept.
+SUMMARY_CACHE = TTLCache(maxsize=app.config.get("SUMMARY_CACHE_SIZE", 1000),
+                         ttl=app.config.get("SUMMARY_CACHE_TTL", 86400))
+SUMMARY_CACHE_MAX_ITEMS = app.config.get("SUMMARY_CACHE_MAX_ITEMS", 10000)
+# bin/retention.py downsamples snapshots older than these days, so results of
+# ranges ending after the older of the two, plus a day between its runs, can
+# still change
+RETENTION_AGE = 86400 * max(app.config.get("RETENTION_HOURLY_AFTER_DAYS", 0) or 0,
+                            app.config.get("RETENTION_DAILY_AFTER_DAYS", 0) or 0)
+if RETENTION_AGE:
+    RETENTION_AGE += 86400
+# Snapshot model of the package, set by configure, and the data version
+# the mutable results in SUMMARY_CACHE were computed at
+SNAPSHOT_MODEL = None
+SUMMARY_CACHE_VERSION = None
+
+# GET requests read from replicas of SQLALCHEMY_REPLICA_URI and
+# SQLALCHEMY_REPLICA_BINDS while the replica has all rows of the primary in
+# the marker table of its bind: inputs for the default database and snapshots
+# of the package for its bind key. Binds without a marker are read from the
+# primary. Each is checked at most every REPLICA_CHECK_SECONDS and again after
+# ingests.
+REPLICA_CHECK_SECONDS = app.config.get("REPLICA_CHECK_SECONDS", 5)
+# {bind key: model}, configure adds the snapshot model of a bound package
+REPLICA_MARKERS = {None: Input}
+# {bind key: [time of the last check, whether the replica was fresh]}
+_REPLICA_STATES = {}
+
 UUID_NAMESPACE = uuid.UUID("aeb7cf1c-a842-4592-82e9-55d2dad00150")
 
 if "LOG_DIR" in app.config:
@@ -54,10 +157,10 @@ if "LOG_DIR" in app.config:
 else:
     LOG_DIR = "."
 
-if "LOG_LEVEL" in app.config:
-    LOG_LEVEL = getattr(logging, app.config["LOG_LEVEL"].upper(), logging.DEBUG)
-else:
-    LOG_LEVEL = logging.DEBUG
+# A level name like "debug" or a number like logging.DEBUG
+LOG_LEVEL = app.config.get("LOG_LEVEL", logging.INFO)
+if not isinstance(LOG_LEVEL, int):
+    LOG_LEVEL = getattr(logging, str(LOG_LEVEL).upper(), logging.INFO)
 
 if "LOG_SIZE" in app.config:
     LOG_SIZE = app.config["LOG_SIZE"]
@@ -68,20 +171,66 @@ LOG_FORMAT = '%(asctime)s %(levelname)s %(module)s %(filename)s %(lineno)d: %(me
 SAN_MS_DATE = '%Y-%m-%d %H:%M:%S'
 LOG_FORMATTER = logging.Formatter(LOG_FORMAT, SAN_MS_DATE)
 
+
+def rotating_file_handler(name, backup_count=0):
+    """A handler of LOG_DIR/name.log rotated at LOG_SIZE."""
+    handler = open_file_handler(
+        "%s/%s.log" % (LOG_DIR, name), maxBytes=LOG_SIZE, backupCount=backup_count)
+    handler.setFormatter(LOG_FORMATTER)
+    return handler
+
+
+# All loggers of apis write to one file of the package in a background thread.
+# Files are named after the package, not the module, as dispatcher.py loads
+# the module under other names.
 top_logger = logging.getLogger(__name__)
+top_logger.setLevel(LOG_LEVEL)
+top_logger.addHandler(BackgroundHandler(rotating_file_handler(
+    "unified.apis.%s" % PACKAGE if PACKAGE else "unified.apis")))
+
+# Asynchronous ingest: payloads of /ingest are spooled in INGEST_SPOOL_DIR and
+# 202 is returned with a job id. bin/ingest_worker.py drains the spool, so
+# ingests do not compete with queries, unless INGEST_WORKERS threads of each
+# process are asked for. Jobs running longer than INGEST_JOB_TIMEOUT seconds
+# are taken as stopped and queued again when bin/ingest_worker.py starts.
+INGEST_ASYNC = app.config.get("INGEST_ASYNC", False)
+INGEST_SPOOL_DIR = app.config.get("INGEST_SPOOL_DIR", os.path.join(LOG_DIR, "spool", PACKAGE))
+INGEST_WORKERS = app.config.get("INGEST_WORKERS", 0)
+INGEST_POLL_SECONDS = app.config.get("INGEST_POLL_SECONDS", 5)
+INGEST_JOB_TIMEOUT = app.config.get("INGEST_JOB_TIMEOUT", 7200)
+SPOOL = Spool(INGEST_SPOOL_DIR) if INGEST_ASYNC else None
+# Ingests generate ids in Python and write dimensions and facts a table at a
+# time, see BulkWriter. Rows per INSERT of facts is INGEST_INSERT_ROWS.
+CLIENT_SIDE_IDS = app.config.get("CLIENT_SIDE_IDS", False)
+INGEST_INSERT_ROWS = app.config.get("INGEST_INSERT_ROWS", 1000)
+# Process which has started the threads, a forked worker starts its own
+_INGEST_WORKERS_PID = None
+_INGEST_WORKERS_LOCK = threading.Lock()
+
+# Statements taking at least SLOW_QUERY_SECONDS are logged with their plan to
+# slow_query.PACKAGE.log. SLOW_QUERY_SAMPLE is the fraction of them to log. ANALYZE
+# runs the statement again so it is only used if SLOW_QUERY_ANALYZE is set.
+SLOW_QUERY_SECONDS = app.config.get("SLOW_QUERY_SECONDS", 1.0)
+SLOW_QUERY_SAMPLE = app.config.get("SLOW_QUERY_SAMPLE", 1.0)
+SLOW_QUERY_EXPLAIN = app.config.get("SLOW_QUERY_EXPLAIN", True)
+SLOW_QUERY_ANALYZE = app.config.get("SLOW_QUERY_ANALYZE", False)
+
+slow_query_logger = logging.getLogger(__name__ + ".slow_query")
+slow_query_logger.propagate = False
+if SLOW_QUERY_SECONDS is not None:
+    slow_query_logger.addHandler(BackgroundHandler(rotating_file_handler(
+        "slow_query.%s" % PACKAGE if PACKAGE else "slow_query",
+        app.config.get("SLOW_QUERY_LOG_BACKUPS", 5))))
+    slow_query_logger.setLevel(logging.INFO)
 
 
-# Logger is created by the calling module with the calling module's name as log name
-# All other modules use this log
 def create_logger(module_name):
-    log_name = "%s/%s.log" % (LOG_DIR, module_name)
-    file_handler = logging.handlers.RotatingFileHandler(log_name, maxBytes=LOG_SIZE)
-    file_handler.setFormatter(LOG_FORMATTER)
-    logger = logging.getLogger(__name__)
-    logger.addHandler(file_handler)
-    logger.setLevel(LOG_LEVEL)
+    """Get the logger of a module. Its records go to the file of top_logger.
 
-    return logger
+       Pass arguments of messages to the logger instead of formatting them,
+       so they are only formatted if the level is enabled.
+    """
+    return logging.getLogger(module_name)
 
 
 def identifier(content):
@@ -124,6 +273,123 @@ def get(model, **kwargs):
     return db.session.query(model).filter_by(**kwargs).first()
 
 
+class BulkWriter(object):
+    """Rows of an ingest built in memory and written a table at a time.
+
+       dimension() returns the id of a dimension row by its natural key, e.g.
+       Owner by name, and fact() queues a fact row. Both take column names.
+       New dimension rows are inserted and flushed at once to get ids from the
+       database, unless client_side_ids (default CLIENT_SIDE_IDS) is set: then
+       their ids are identifier() of table and key, and nothing is sent until
+       write(). It looks up rows which exist under other ids with a query per
+       table, replaces those ids and inserts the rest with one statement.
+       Facts get uuid4 ids there and are written with multi-row INSERTs or COPY.
+    """
+
+    def __init__(self, client_side_ids=None):
+        self.client_side_ids = CLIENT_SIDE_IDS if client_side_ids is None else client_side_ids
+        self._ids = {}
+        self._dimensions = OrderedDict()
+        self._facts = OrderedDict()
+
+    def dimension(self, model, **key):
+        cache_key = (model, tuple(sorted(key.items())))
+        if cache_key not in self._ids:
+            if self.client_side_ids:
+                row = dict(key, id=identifier((model.__tablename__, ) + cache_key[1]))
+                self._dimensions.setdefault(model, []).append(row)
+                self._ids[cache_key] = row["id"]
+            else:
+                item = get_or_create(model, **key)
+                if item.id is None:
+                    db.session.flush()
+                self._ids[cache_key] = item.id
+        return self._ids[cache_key]
+
+    def fact(self, model, **row):
+        if self.client_side_ids:
+            row["id"] = str(uuid.uuid4())
+        self._facts.setdefault(model, []).append(row)
+
+    @staticmethod
+    def _replace(row, replaced):
+        return {name: value if name == "id" else replaced.get(value, value)
+                for name, value in row.items()}
+
+    @staticmethod
+    def _existing(model, names, rows):
+        """{values of names: id} of rows of model with the values of rows."""
+        existing = {}
+        # NULLs never match in IN, so rows are looked up by their NULL columns
+        by_nulls = OrderedDict()
+        for row in rows:
+            by_nulls.setdefault(tuple(name for name in names if row[name] is None), []).append(row)
+        for nulls, group in by_nulls.items():
+            present = [name for name in names if name not in nulls]
+            query = db.session.query(model.id, *[getattr(model, name) for name in names]).\
+                filter(*[getattr(model, name).is_(None) for name in nulls])
+            if present:
+                query = query.filter(tuple_(*[getattr(model, name) for name in present]).in_(
+                    [tuple(row[name] for name in present) for row in group]))
+            existing.update((tuple(found[1:]), found[0]) for found in query)
+        return existing
+
+    def _write_dimension(self, model, rows):
+        """Insert rows which do not exist, return {row id: id of existing row}."""
+        names = sorted(set(rows[0]) - {"id"})
+        existing = self._existing(model, names, rows)
+        new = [row for row in rows if tuple(row[name] for name in names) not in existing]
+        if new:
+            inserted = set(str(found[0]) for found in db.session.execute(
+                insert(model.__table__).values(new).on_conflict_do_nothing().returning(model.id)))
+            # Rows inserted by a concurrent ingest since the lookup
+            lost = [row for row in new if str(row["id"]) not in inserted]
+            if lost:
+                existing.update(self._existing(model, names, lost))
+        return {row["id"]: existing[tuple(row[name] for name in names)]
+                for row in rows if tuple(row[name] for name in names) in existing}
+
+    @staticmethod
+    def _copy_value(value):
+        """value in the text format of COPY."""
+        if value is None:
+            return "\\N"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").\
+            replace("\n", "\\n").replace("\r", "\\r")
+
+    def _copy(self, table, rows):
+        columns = list(rows[0])
+        tsv = io.StringIO()
+        for row in rows:
+            tsv.write("\t".join(self._copy_value(row[column]) for column in columns) + "\n")
+        tsv.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_from(tsv, table.name, columns=columns)
+
+    def write(self, copy=False):
+        """Write queued rows, facts with COPY if copy. Return the number of facts."""
+        replaced = {}
+        # Tables referred to first
+        order = {table: index for index, table in enumerate(db.metadata.sorted_tables)}
+        for model in sorted(self._dimensions, key=lambda model: order[model.__table__]):
+            rows = self._dimensions[model]
+            replaced.update(self._write_dimension(model, [self._replace(row, replaced) for row in rows]))
+        self._ids = {key: replaced.get(id, id) for key, id in self._ids.items()}
+
+        written = 0
+        for model, rows in self._facts.items():
+            rows = [self._replace(row, replaced) for row in rows]
+            if copy:
+                self._copy(model.__table__, rows)
+            else:
+                for start in range(0, len(rows), INGEST_INSERT_ROWS):
+                    db.session.execute(model.__table__.insert().values(rows[start:start + INGEST_INSERT_ROWS]))
+            written += len(rows)
+        self._dimensions.clear()
+        self._facts.clear()
+        return written
+
+
 def commit():
     """Commit session."""
     db.session.commit()
@@ -173,6 +439,40 @@ def constant_time_compare(val1, val2):
     return result == 0
 
 
+def allowed_packages(token):
+    """
+    Get names of packages a token is allowed to access.
+
+    Verdicts of the reporting-auth service are cached: accepted tokens for
+    ERSA_AUTH_CACHE_TTL seconds and rejected tokens for
+    ERSA_AUTH_CACHE_NEGATIVE_TTL seconds. Failures to reach the service
+    and errors of it are not cached.
+    """
+    packages = AUTH_CACHE.get(token)
+    if packages is not None:
+        return packages
+
+    try:
+        auth_response = AUTH_SESSION.get(AUTH_URL,
+                                         params={"secret": token},
+                                         timeout=AUTH_TIMEOUT)
+    except requests.RequestException as e:
+        top_logger.error("Auth service is not available. Detail: %s", e)
+        return frozenset()
+
+    if auth_response.status_code == 200:
+        packages = frozenset(endpoint["name"]
+                             for endpoint in auth_response.json()["endpoints"])
+        AUTH_CACHE.set(token, packages)
+    elif auth_response.status_code in AUTH_REJECTED_STATUSES:
+        packages = frozenset()
+        AUTH_CACHE.set(token, packages, ttl=AUTH_CACHE_NEGATIVE_TTL)
+    else:
+        top_logger.error("Auth service failed with status %d", auth_response.status_code)
+        packages = frozenset()
+    return packages
+
+
 def require_auth(func):
     """
     Authenticate via the external reporting-auth service.
@@ -196,14 +496,7 @@ def require_auth(func):
             if constant_time_compare(token, AUTH_TOKEN):
                 success = True
         else:
-            auth_response = requests.get(
-                "https://reporting.ersa.edu.au/auth?secret=%s" % token)
-            if auth_response.status_code == 200:
-                auth_data = auth_response.json()
-                for endpoint in auth_data["endpoints"]:
-                    if endpoint["name"] == PACKAGE:
-                        success = True
-                        break
+            success = PACKAGE in allowed_packages(token)
 
         if success:
             return func(*args, **kwargs)
@@ -213,6 +506,56 @@ def require_auth(func):
     return decorated
 
 
+def value_converter(column):
+    """Get a function which checks and converts a filter value for a column."""
+    if isinstance(column.type, UUID):
+        def python_type(value):
+            return str(uuid.UUID(value))
+    else:
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = None
+        if python_type not in (int, float):
+            return lambda value: value
+
+    def convert(value):
+        try:
+            return python_type(value)
+        except ValueError:
+            raise BadRequest("Invalid value %s of %s" % (value, column.key))
+    return convert
+
+
+@lru_cache(maxsize=1024)
+def compile_filter(model, key, op):
+    """
+    Resolve the column and the operation of a filter once.
+
+    Returns a function which builds the filter from a value. Dashboards
+    reuse a few filter shapes so lookups of attributes and operators are
+    not repeated for every request.
+    """
+    column = getattr(model, key, None)
+    if isinstance(getattr(column, "property", None), RelationshipProperty):
+        column = getattr(model, key + "_id", None)
+    if not isinstance(getattr(column, "property", None), ColumnProperty):
+        raise BadRequest("Unknown attribute %s" % key)
+
+    convert = value_converter(column)
+    if op == "in":
+        return lambda value: column.in_([convert(item) for item in value.split(",")])
+
+    for candidate in ["%s", "%s_", "__%s__"]:
+        if hasattr(column, candidate % op):
+            operation = getattr(column, candidate % op)
+            break
+    else:
+        raise BadRequest("Unknown operation %s" % op)
+
+    return lambda value: operation(None if value == "null" else convert(value))
+
+
 def dynamic_query(model, query, expression):
     """
     Construct query based on:
@@ -220,22 +563,11 @@ def dynamic_query(model, query, expression):
     For example:
         foo.eq.42
     """
-    key, op, value = expression.split(".", 2)
-    column = getattr(model, key, None)
-    if isinstance(column.property, RelationshipProperty):
-        column = getattr(model, key + "_id", None)
-    if op == "in":
-        query_filter = column.in_(value.split(","))
-    else:
-        attr = None
-        for candidate in ["%s", "%s_", "__%s__"]:
-            if hasattr(column, candidate % op):
-                attr = candidate % op
-                break
-        if value == "null":
-            value = None
-        query_filter = getattr(column, attr)(value)
-    return query.filter(query_filter)
+    try:
+        key, op, value = expression.split(".", 2)
+    except ValueError:
+        raise BadRequest("Filter %s is not attribute.operation.value" % expression)
+    return query.filter(compile_filter(model, key, op)(value))
 
 
 def name_or_id(model, name):
@@ -249,24 +581,408 @@ def name_or_id(model, name):
         return None
 
 
-def do_query(model):
-    """Perform a query with request-specified filtering and ordering."""
-    args = QUERY_PARSER.parse_args()
+def filtered_query(model, args):
+    """Build a query with request-specified filters."""
     query = model.query
-    # filter
     if args["filter"]:
         for query_filter in args["filter"]:
             query = dynamic_query(model, query, query_filter)
-    # order
-    order = []
-    for order_spec in args["order"].split(","):
-        if not order_spec.startswith("-"):
-            order.append(name_or_id(model, order_spec))
-        else:
-            order.append(name_or_id(model, order_spec[1:]).desc())
-    query = query.order_by(*order)
+    return query
+
+
+def order_columns(model, order):
+    """Parse an order specification into a list of (column, descending)."""
+    columns = []
+    for order_spec in order.split(","):
+        descending = order_spec.startswith("-")
+        column = name_or_id(model, order_spec.lstrip("-"))
+        if not isinstance(getattr(column, "property", None), ColumnProperty):
+            raise BadRequest("Unknown order %s" % order_spec)
+        columns.append((column, descending))
+    return columns
+
+
+def projected_columns(model, fields):
+    """Map comma separated attribute names to a list of (name, column)."""
+    columns = []
+    for name in fields.split(","):
+        column = name_or_id(model, name)
+        if not isinstance(getattr(column, "property", None), ColumnProperty):
+            raise BadRequest("Unknown field %s" % name)
+        columns.append((name, column))
+    return columns
+
+
+def project(model, query, fields, extra=[]):
+    """Select only the requested columns, plus extra ones the query needs.
+
+       Without fields, columns behind json() of the model are selected if
+       it has a precompiled serializer. Rows are then plain tuples instead
+       of ORM instances.
+    """
+    if fields:
+        columns = [column for _, column in projected_columns(model, fields)]
+    elif row_serializer(model) is not None:
+        columns = list(row_serializer(model).columns)
+    else:
+        return query
+    keys = [column.key for column in columns]
+    columns.extend(column for column in extra if column.key not in keys)
+    return query.with_entities(*columns)
+
+
+def serializer(model, fields):
+    """Get a function which converts a row of a query to a dict."""
+    if not fields:
+        return row_serializer(model) or (lambda item: item.json())
+    names = [name for name, _ in projected_columns(model, fields)]
+    return lambda row: dict(zip(names, row))
+
+
+def ordered_query(model, args):
+    """Build a query with request-specified filtering, ordering and fields."""
+    query = filtered_query(model, args)
+    order = [column.desc() if descending else column
+             for column, descending in order_columns(model, args["order"])]
+    return project(model, query, args["fields"]).order_by(*order)
+
+
+def paginate(query, page, per_page, total="exact"):
+    """Get a page of a query with its total counted as requested.
+
+       total: exact runs COUNT(*) over the query, estimate takes the row
+       estimate of the planner and none leaves total as None.
+    """
+    if total == "exact":
+        return query.paginate(page, per_page=per_page, error_out=False)
+    page = max(page, 1)
+    items = query.limit(per_page).offset((page - 1) * per_page).all()
+    total = estimate_count(query) if total == "estimate" else None
+    return Pagination(query, page, per_page, total, items)
+
+
+def total_headers(pagination, total):
+    """Headers which report the total of a page."""
+    if total == "exact":
+        return {"X-Total-Count": pagination.total}
+    if total == "estimate":
+        return {"X-Total-Estimate": pagination.total}
+    return {}
+
+
+def do_query(model):
+    """Perform a query with request-specified filtering and ordering.
+
+       Items are not counted unless total is requested.
+    """
+    args = QUERY_PARSER.parse_args()
+    query = ordered_query(model, args)
     # execute
-    return query.paginate(args["page"], per_page=args["count"], error_out=False).items
+    return paginate(query, args["page"], args["count"], args["total"] or "none")
+
+
+def do_stream_query(model):
+    """Iterate over the requested page through a server-side cursor."""
+    args = QUERY_PARSER.parse_args()
+    query = ordered_query(model, args).\
+        limit(args["count"]).offset((args["page"] - 1) * args["count"])
+    return query.yield_per(STREAM_CHUNK_SIZE)
+
+
+def data_version():
+    """Number of recorded inputs. It changes whenever data is ingested."""
+    return db.session.query(func.count(Input.id)).scalar()
+
+
+def replica_is_fresh(bind_key=None):
+    """Whether the replica of a database has all rows of the primary in the
+       marker table of its bind key, see REPLICA_MARKERS.
+    """
+    state = _REPLICA_STATES.setdefault(bind_key, [0.0, False])
+    checked, fresh = state
+    now = time.monotonic()
+    if checked and now - checked < REPLICA_CHECK_SECONDS:
+        return fresh
+    marker = REPLICA_MARKERS.get(bind_key)
+    if marker is None or bind_key not in db.replica_uris(app):
+        fresh = False
+    else:
+        count = select([func.count(marker.id)])
+        primary = db.get_engine(app, bind=bind_key)
+        try:
+            fresh = db.get_replica_engine(app, primary).scalar(count) >= primary.scalar(count)
+        except Exception as e:
+            top_logger.warning("Reading from the primary, replica of %s failed: %s",
+                               bind_key or "the default database", e)
+            fresh = False
+    state[:] = [now, fresh]
+    return fresh
+
+
+def request_etag(version, mimetype):
+    """Validator of the response to the current request at a data version,
+       in the representation mimetype and the encoding the client accepts.
+    """
+    encoding = "gzip" if "gzip" in request.accept_encodings else "identity"
+    key = json.dumps([PACKAGE, version, request.path,
+                      sorted(request.args.items(multi=True)), mimetype, encoding])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def latest_snapshot_ts():
+    """Timestamp of the latest snapshot, 0 if the package has no snapshots."""
+    if SNAPSHOT_MODEL is None:
+        return 0
+    return snapshot_index(SNAPSHOT_MODEL).latest_ts()
+
+
+def invalidate_summaries(version=None):
+    """Drop cached results which can change with newly ingested data,
+       look for new snapshots and dimensions and check the replica again
+       before reading from it.
+
+       version is the data version the remaining results are valid for.
+       Other workers find out by comparing it with data_version().
+    """
+    global SUMMARY_CACHE_VERSION
+    SUMMARY_CACHE.prune(lambda value: not value[0])
+    SUMMARY_CACHE_VERSION = version
+    invalidate_snapshot_indexes()
+    invalidate_dimension_names()
+    # Replicas may not have the new data yet
+    for state in _REPLICA_STATES.values():
+        state[0] = 0.0
+
+
+def cached_summary(version, get, end):
+    """Get a result of a range query from SUMMARY_CACHE or by calling get.
+
+       Returns the result and whether it was a hit.
+    """
+    if version != SUMMARY_CACHE_VERSION:
+        invalidate_summaries(version)
+    key = (PACKAGE, request.endpoint, tuple(sorted(request.view_args.items())),
+           tuple(sorted(request.args.items(multi=True))))
+    entry = SUMMARY_CACHE.get(key)
+    if entry is not None:
+        return entry[1], True
+    result = get()
+    # Empty results may come from failures handled in _get
+    small = not isinstance(result, (list, dict)) or len(result) <= SUMMARY_CACHE_MAX_ITEMS
+    if result and small:
+        immutable = 0 < end <= latest_snapshot_ts() and \
+            (not RETENTION_AGE or end <= time.time() - RETENTION_AGE)
+        SUMMARY_CACHE.set(key, (immutable, result))
+    return result, False
+
+
+def chunked(rows):
+    """Group rows into lists of STREAM_CHUNK_SIZE.
+
+       As the status has been sent when rows are streamed, failures can
+       only be logged.
+    """
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= STREAM_CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    except Exception as e:
+        top_logger.error("Streaming failed. Detail: %s", e)
+
+
+def json_chunks(chunks):
+    """Encode chunks of rows as one JSON array."""
+    yield "["
+    first = True
+    for chunk in chunks:
+        yield ("" if first else ",") + ",".join(json.dumps(row, default=str) for row in chunk)
+        first = False
+    yield "]"
+
+
+def ndjson_chunks(chunks):
+    """Encode chunks of rows as newline delimited JSON."""
+    for chunk in chunks:
+        yield "".join(json.dumps(row, default=str) + "\n" for row in chunk)
+
+
+def csv_value(value):
+    """Nested values are written as JSON in a cell."""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+def csv_chunks(chunks):
+    """Encode chunks of dicts as CSV with a header row from keys of the first row."""
+    buffer = io.StringIO()
+    writer = None
+    for chunk in chunks:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(chunk[0]),
+                                    restval="", extrasaction="ignore")
+            writer.writeheader()
+        writer.writerows({key: csv_value(value) for key, value in row.items()} for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def msgpack_chunks(chunks):
+    """Encode chunks of rows as a sequence of MessagePack maps."""
+    for chunk in chunks:
+        yield b"".join(msgpack.packb(row, default=str, use_bin_type=True) for row in chunk)
+
+
+# Encoders of streamed rows by media type, chosen by the Accept header
+ENCODERS = {"application/json": json_chunks,
+            "application/x-ndjson": ndjson_chunks,
+            "text/csv": csv_chunks}
+if msgpack is not None:
+    ENCODERS["application/msgpack"] = msgpack_chunks
+
+
+def stream_mimetype(stream):
+    """Media type of a streamed response: NDJSON if asked, otherwise by Accept."""
+    if stream == "ndjson":
+        return "application/x-ndjson"
+    return request.accept_mimetypes.best_match(
+        [mimetype for mimetype in ENCODERS if mimetype != "application/x-ndjson"],
+        default="application/json")
+
+
+def stream_response(rows, mimetype="application/json"):
+    """Send dicts produced by rows in chunks encoded as mimetype.
+
+       The first chunk is sent before all rows are fetched so a client
+       does not wait for the whole result.
+    """
+    chunks = ENCODERS[mimetype](chunked(rows))
+    return Response(stream_with_context(chunks), mimetype=mimetype)
+
+
+def table_rows(data):
+    """Rows of a non-streamed result to be written in a table."""
+    if isinstance(data, dict):
+        data = data.get("items", [data])
+    return [row if isinstance(row, dict) else {"value": row} for row in data]
+
+
+@restapi.representation("text/csv")
+def output_csv(data, code, headers=None):
+    rows = table_rows(data)
+    body = "".join(csv_chunks([rows] if rows else []))
+    return Response(body, code, headers, mimetype="text/csv")
+
+
+if msgpack is not None:
+    @restapi.representation("application/msgpack")
+    def output_msgpack(data, code, headers=None):
+        body = msgpack.packb(data, default=str, use_bin_type=True)
+        return Response(body, code, headers, mimetype="application/msgpack")
+
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_SIZE = app.config.get("GZIP_MIN_SIZE", 1024)
+
+
+def gzip_chunks(chunks):
+    """Compress chunks as they are produced, each can be decompressed on arrival."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+@app.after_request
+def gzip_response(response):
+    """Compress responses for clients which accept gzip."""
+    if "gzip" not in request.accept_encodings or response.status_code != 200 or \
+            response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    if response.is_streamed:
+        response.response = gzip_chunks(response.iter_encoded())
+        response.headers.pop("Content-Length", None)
+    else:
+        if response.content_length is not None and response.content_length < GZIP_MIN_SIZE:
+            return response
+        response.set_data(b"".join(gzip_chunks([response.get_data()])))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def encode_cursor(values):
+    """Encode values of order columns into an opaque cursor."""
+    return base64.urlsafe_b64encode(
+        json.dumps(values, default=str).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Decode a cursor created by encode_cursor."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except (ValueError, TypeError, binascii.Error):
+        raise BadRequest("Invalid cursor")
+
+
+def keyset_filter(columns, values):
+    """Build a filter for rows after values in the order of columns.
+
+       When all columns are in the same direction a row value comparison is
+       used, e.g. (ts, id) > (1, 'x'), which PostgreSQL can resolve by an
+       index range scan. Otherwise it is expanded as
+       c1 > v1 OR (c1 = v1 AND c2 > v2) ...
+    """
+    directions = set(descending for _, descending in columns)
+    if len(directions) == 1:
+        keys = tuple_(*[column for column, _ in columns])
+        if directions.pop():
+            return keys < tuple_(*values)
+        return keys > tuple_(*values)
+
+    clauses = []
+    for i, (column, descending) in enumerate(columns):
+        equals = [columns[j][0] == values[j] for j in range(i)]
+        beyond = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*(equals + [beyond])))
+    return or_(*clauses)
+
+
+def do_keyset_query(model):
+    """Perform a query paged by a cursor instead of a page number.
+
+       The cursor holds values of order columns of the last item returned,
+       id is always appended as a tie-breaker. No total count is run.
+       Returns items and the cursor of the next page which is None at the end.
+    """
+    args = QUERY_PARSER.parse_args()
+    query = filtered_query(model, args)
+
+    columns = order_columns(model, args["order"])
+    if "id" not in [column.key for column, _ in columns]:
+        columns.append((model.id, False))
+
+    if args["after"]:
+        values = decode_cursor(args["after"])
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise BadRequest("Cursor does not match order")
+        query = query.filter(keyset_filter(columns, values))
+
+    query = project(model, query, args["fields"], [column for column, _ in columns])
+    order = [column.desc() if descending else column for column, descending in columns]
+    items = query.order_by(*order).limit(args["count"] + 1).all()
+
+    cursor = None
+    if len(items) > args["count"]:
+        items = items[:args["count"]]
+        cursor = encode_cursor([getattr(items[-1], column.key) for column, _ in columns])
+    return items, cursor
 
 
 def instance_method(model, method, id, default=[], **kwargs):
@@ -288,16 +1004,52 @@ class QueryResource(Resource):
     def get_raw(self):
         """Query"""
         try:
-            top_logger.debug("Query: %s" % self.query_class.query)
+            top_logger.debug("Query: %s", self.query_class.query)
             return do_query(self.query_class)
+        except HTTPException:
+            raise
+        except Exception as e:
+            top_logger.error("Query %s failed. Detail: %s", self.query_class.query, e)
+            return Pagination(None, 1, 0, None, [])
+
+    def get_stream(self):
+        """Query through a server-side cursor"""
+        try:
+            return do_stream_query(self.query_class)
+        except HTTPException:
+            raise
         except Exception as e:
-            top_logger.error("Query %s failed. Detail: %s" % (self.query_class.query, str(e)))
+            top_logger.error("Query %s failed. Detail: %s", self.query_class.query, e)
             return []
 
+    def get_keyset(self):
+        """Query paged by cursor
+
+           Errors are raised, as an empty page would be taken as the last.
+        """
+        try:
+            return do_keyset_query(self.query_class)
+        except HTTPException:
+            raise
+        except Exception as e:
+            top_logger.error("Query %s failed. Detail: %s", self.query_class.query, e)
+            raise
+
     @require_auth
     def get(self):
         """Query"""
-        return [item.json() for item in self.get_raw()]
+        args = QUERY_PARSER.parse_args()
+        to_dict = serializer(self.query_class, args["fields"])
+        stream = STREAM_PARSER.parse_args()["stream"]
+        if stream:
+            items = self.get_stream()
+            return stream_response((to_dict(item) for item in items), stream_mimetype(stream))
+        if args["after"] is not None:
+            items, cursor = self.get_keyset()
+            return {"items": [to_dict(item) for item in items], "next": cursor}
+        pagination = self.get_raw()
+        return [to_dict(item) for item in pagination.items], 200, \
+            total_headers(pagination, args["total"])
 
     @require_auth
     def post(self):
@@ -321,12 +1073,40 @@ class RangeQuery(Resource):
 
     @require_auth
     def get(self, **kwargs):
-        """Get method"""
+        """Get method
+
+           If a subclass implements _stream which returns an iterator of dicts,
+           the result can be streamed by adding stream=json or stream=ndjson.
+
+           Results only change when data is ingested, so an ETag is sent and
+           If-None-Match is answered with 304 before running any query.
+           Results which are not streamed are kept in SUMMARY_CACHE.
+        """
         kwargs.update(self.arg_parser.parse_args())
+        stream = STREAM_PARSER.parse_args()["stream"]
         try:
-            return self._get(**kwargs)
+            version = data_version()
+            streamed = stream and hasattr(self, "_stream")
+            if streamed:
+                mimetype = stream_mimetype(stream)
+            else:
+                mimetype = request.accept_mimetypes.best_match(
+                    restapi.representations, default=restapi.default_mediatype)
+            etag = request_etag(version, mimetype)
+            # Representations of a URL differ by Accept and Accept-Encoding
+            headers = {"ETag": quote_etag(etag, weak=True), "Vary": "Accept, Accept-Encoding"}
+            if request.if_none_match.contains_weak(etag):
+                return Response(status=304, headers=headers)
+            if streamed:
+                response = stream_response(self._stream(**kwargs), mimetype)
+                response.headers.extend(headers)
+                return response
+            result, hit = cached_summary(version, lambda: self._get(**kwargs),
+                                         kwargs.get("end", 0))
+            headers["X-Cache"] = "hit" if hit else "miss"
+            return result, 200, headers
         except Exception as e:
-            top_logger.error("Query of summary failed. Detail: %s" % str(e))
+            top_logger.error("Query of summary failed. Detail: %s", e)
             return self.default
 
 
@@ -341,8 +1121,155 @@ class BaseIngestResource(Resource):
 
     @require_auth
     def put(self):
+        if SPOOL is not None:
+            return spool_ingest()
         record_input()
-        return self.ingest()
+        result = self.ingest()
+        invalidate_summaries()
+        return result
+
+
+def spool_ingest():
+    """Save the payload of the current ingest request as a job, respond 202."""
+    INPUT_PARSER.parse_args()
+    job_id = SPOOL.put(request.stream, request.endpoint, request.path,
+                       request.query_string.decode("utf-8"), request.content_type)
+    return {"id": job_id, "status": QUEUED}, 202, \
+        {"Location": "%s/%s" % (request.script_root + request.path, job_id)}
+
+
+def run_ingest_job(job):
+    """Ingest a spooled payload as if it was put to its endpoint now."""
+    resource = app.view_functions[job["endpoint"]].view_class
+    path = SPOOL.payload_path(job["id"])
+    with open(path, "rb") as payload:
+        with app.test_request_context(job["path"], method="PUT",
+                                      query_string=job["query"],
+                                      input_stream=payload,
+                                      content_length=os.path.getsize(path),
+                                      content_type=job["content_type"]):
+            try:
+                record_input()
+                resource().ingest()
+            except Exception:
+                rollback()
+                raise
+    invalidate_summaries()
+
+
+def drain_spool(forever=True):
+    """Run spooled jobs one by one.
+
+       If forever, wait INGEST_POLL_SECONDS for new jobs when the spool is
+       empty, otherwise return.
+    """
+    while True:
+        job = SPOOL.claim()
+        if job is None:
+            if not forever:
+                return
+            time.sleep(INGEST_POLL_SECONDS)
+            continue
+        top_logger.info("Ingest job %s started", job["id"])
+        try:
+            run_ingest_job(job)
+        except Exception as e:
+            top_logger.error("Ingest job %s failed. Detail: %s", job["id"], e)
+            SPOOL.finish(job["id"], error=str(e))
+        else:
+            top_logger.info("Ingest job %s done", job["id"])
+            SPOOL.finish(job["id"])
+
+
+def start_ingest_workers():
+    """Start threads draining the spool once in this process."""
+    global _INGEST_WORKERS_PID
+    with _INGEST_WORKERS_LOCK:
+        if _INGEST_WORKERS_PID == os.getpid():
+            return
+        # Jobs are not requeued here, other processes may still run them
+        _INGEST_WORKERS_PID = os.getpid()
+        for _ in range(INGEST_WORKERS):
+            threading.Thread(target=drain_spool, daemon=True).start()
+
+
+@app.before_request
+def _start_ingest_workers():
+    if SPOOL is not None and INGEST_WORKERS > 0:
+        start_ingest_workers()
+
+
+class IngestJobResource(Resource):
+    """Status of an asynchronous ingest job"""
+
+    @require_auth
+    def get(self, job):
+        status = SPOOL.get(job)
+        if status is None:
+            return "", 404
+        return status
+
+
+# /batch runs at most BATCH_MAX_REQUESTS GET requests of resources. They share
+# the database session of the batch unless BATCH_THREADS is more than 1, then
+# they run in a pool of threads with a session each.
+BATCH_MAX_REQUESTS = app.config.get("BATCH_MAX_REQUESTS", 100)
+BATCH_THREADS = app.config.get("BATCH_THREADS", 1)
+BATCH_EXECUTOR = ThreadPoolExecutor(BATCH_THREADS) if BATCH_THREADS > 1 else None
+
+
+def run_subrequest(path, args, headers):
+    """Run GET of the resource at path in this process, return status and data.
+
+       Errors are handled in the request context, as an error leaving it
+       can keep it from being popped. It runs in a savepoint which is rolled
+       back after, so a failed statement does not abort the transaction that
+       later requests of a serial batch share.
+    """
+    with app.test_request_context(path, method="GET", query_string=args, headers=headers):
+        savepoint = db.session.begin_nested()
+        try:
+            if request.routing_exception is not None:
+                raise request.routing_exception
+            resource = app.view_functions[request.endpoint].view_class
+            result = resource().get(**request.view_args)
+            if isinstance(result, Response):
+                body = result.get_data(as_text=True)
+                return result.status_code, json.loads(body) if result.is_json and body else body
+            if isinstance(result, tuple):
+                return result[1], result[0]
+            return 200, result
+        except HTTPException as e:
+            return e.code, {"message": e.description}
+        except Exception as e:
+            top_logger.error("Batch request of %s failed. Detail: %s", path, e)
+            return 500, {"message": "Internal Server Error"}
+        finally:
+            savepoint.rollback()
+
+
+class BatchResource(Resource):
+    """Many GET requests in one: [{"path": "/usage/summary", "args": {...}}]"""
+
+    @require_auth
+    def post(self):
+        subrequests = request.get_json(force=True)
+        if not isinstance(subrequests, list):
+            raise BadRequest("Batch should be a list of requests")
+        if len(subrequests) > BATCH_MAX_REQUESTS:
+            raise BadRequest("Batch has more than %d requests" % BATCH_MAX_REQUESTS)
+        for item in subrequests:
+            if not isinstance(item, dict) or not isinstance(item.get("path"), str) or \
+                    not isinstance(item.get("args", {}), dict):
+                raise BadRequest("Request should be {\"path\": path, \"args\": {}}")
+
+        headers = {"x-ersa-auth-token": request.headers.get("x-ersa-auth-token", "")}
+        calls = [(item["path"], item.get("args", {}), headers) for item in subrequests]
+        if BATCH_EXECUTOR is None:
+            results = [run_subrequest(*call) for call in calls]
+        else:
+            results = BATCH_EXECUTOR.map(lambda call: run_subrequest(*call), calls)
+        return [{"status": status, "data": data} for status, data in results]
 
 
 class InputResource(QueryResource):
@@ -354,9 +1281,156 @@ class InputResource(QueryResource):
         """Record a processed input."""
         record_input()
         commit()
+        invalidate_summaries()
         return "", 204
 
 
+REQUESTS = REGISTRY.register(Counter(
+    "ersa_requests_total", "Requests by resource, method and status",
+    ("resource", "method", "status")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "ersa_request_duration_seconds", "Time to respond by resource",
+    ("resource", "method")))
+DB_SECONDS = REGISTRY.register(Histogram(
+    "ersa_db_duration_seconds", "Time spent in SQL statements of a request by resource",
+    ("resource", "method")))
+# Resources doing N+1 lookups stand out with many statements per request
+DB_STATEMENTS = REGISTRY.register(Histogram(
+    "ersa_db_statements_per_request", "SQL statements of a request by resource",
+    ("resource", "method"), buckets=COUNT_BUCKETS))
+REPLICA_READS = REGISTRY.register(Counter(
+    "ersa_replica_reads_total", "Requests which could read from a replica by database read",
+    ("database", )))
+REGISTRY.register(Gauge(
+    "ersa_cache_hits", "Hits of in-process caches", ("cache",),
+    lambda: {("auth",): AUTH_CACHE.hits, ("summary",): SUMMARY_CACHE.hits}))
+REGISTRY.register(Gauge(
+    "ersa_cache_misses", "Misses of in-process caches", ("cache",),
+    lambda: {("auth",): AUTH_CACHE.misses, ("summary",): SUMMARY_CACHE.misses}))
+
+
+def _own_statement():
+    """Whether a statement runs for this copy of the package.
+
+       Copies in dispatcher.py share engines, so listeners of each copy see
+       statements of the others, which run in the context of their app.
+    """
+    return not has_app_context() or current_app._get_current_object() is app
+
+
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    # On the context, a failed statement has no after_cursor_execute
+    if context is not None and _own_statement():
+        context._query_start = time.perf_counter()
+
+
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    if context is None or not _own_statement():
+        return
+    # Outside of an app, listeners of each copy see the statement and the
+    # first one takes it
+    start = context.__dict__.pop("_query_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_request_context() and "db_statements" in g:
+        g.db_statements += 1
+        g.db_seconds += elapsed
+    if SLOW_QUERY_SECONDS is not None and elapsed >= SLOW_QUERY_SECONDS and \
+            random.random() < SLOW_QUERY_SAMPLE:
+        log_slow_query(cursor, statement, parameters, elapsed, executemany)
+
+
+db.listen_engines("before_cursor_execute", _start_statement)
+db.listen_engines("after_cursor_execute", _end_statement)
+
+
+def explain(cursor, statement, parameters):
+    """Plan of a statement as text, got with the DBAPI cursor of the connection.
+
+       A savepoint keeps the transaction usable if EXPLAIN fails.
+    """
+    options = "ANALYZE, BUFFERS" if SLOW_QUERY_ANALYZE else "COSTS"
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute("SAVEPOINT explain_slow_query")
+        try:
+            explain_cursor.execute("EXPLAIN (%s) %s" % (options, statement), parameters)
+            return "\n".join(row[0] for row in explain_cursor.fetchall())
+        except Exception as e:
+            explain_cursor.execute("ROLLBACK TO SAVEPOINT explain_slow_query")
+            return "EXPLAIN failed: %s" % str(e)
+        finally:
+            explain_cursor.execute("RELEASE SAVEPOINT explain_slow_query")
+    finally:
+        explain_cursor.close()
+
+
+def in_transaction(connection):
+    """Whether a DBAPI connection is in a transaction which has not failed.
+
+       The savepoint of explain() needs one.
+    """
+    return not connection.autocommit and \
+        connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+
+def log_slow_query(cursor, statement, parameters, elapsed, executemany):
+    """Log a slow statement with its bound parameters and plan."""
+    resource = request.endpoint if has_request_context() else None
+    plan = None
+    # Only plans of queries, ANALYZE of others would change data again
+    if SLOW_QUERY_EXPLAIN and not executemany and \
+            statement.lstrip()[:6].upper() == "SELECT":
+        # It runs in a listener of the statement, which must not fail
+        try:
+            if in_transaction(cursor.connection):
+                plan = explain(cursor, statement, parameters)
+            else:
+                plan = "Not explained outside of a transaction"
+        except Exception as e:
+            top_logger.warning("EXPLAIN of a slow query failed: %s", e)
+    slow_query_logger.warning("%.3fs in %s: %s\nParameters: %r\nPlan:\n%s",
+                              elapsed, resource, statement, parameters, plan)
+
+
+@app.before_request
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.db_statements = 0
+    g.db_seconds = 0.0
+
+
+@app.before_request
+def _read_from_replica():
+    if request.method in ("GET", "HEAD") and db.replica_uris(app):
+        db.session.info["replica"] = replica_is_fresh
+        REPLICA_READS.inc("replica" if replica_is_fresh() else "primary")
+
+
+@app.after_request
+def _time_request(response):
+    """Record metrics of a request and report them in Server-Timing."""
+    if "request_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    resource = request.endpoint or "unknown"
+    REQUESTS.inc(resource, request.method, response.status_code)
+    REQUEST_SECONDS.observe(elapsed, resource, request.method)
+    DB_SECONDS.observe(g.db_seconds, resource, request.method)
+    DB_STATEMENTS.observe(g.db_statements, resource, request.method)
+    response.headers["Server-Timing"] = 'db;dur=%.1f;desc="statements=%d", total;dur=%.1f' % (
+        g.db_seconds * 1000, g.db_statements, elapsed * 1000)
+    return response
+
+
+class MetricsResource(Resource):
+    """Metrics of this worker in the Prometheus text format."""
+
+    def get(self):
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 class PingResource(Resource):
     """Basic liveness test."""
 
@@ -365,9 +1439,23 @@ class PingResource(Resource):
         return "pong"
 
 
-def configure(resources):
+def configure(resources, snapshot=None):
+    """Add resources of a package.
+
+       snapshot is the Snapshot model of the package which tells which
+       ranges of summaries will not change.
+    """
+    global SNAPSHOT_MODEL
+    SNAPSHOT_MODEL = snapshot
+    bind_key = getattr(snapshot, "__bind_key__", None)
+    if bind_key is not None:
+        REPLICA_MARKERS[bind_key] = snapshot
     restapi.add_resource(PingResource, "/ping")
+    restapi.add_resource(MetricsResource, "/metrics")
     restapi.add_resource(InputResource, "/input")
+    restapi.add_resource(BatchResource, "/batch")
 
     for (endpoint, cls) in resources.items():
         restapi.add_resource(cls, endpoint)
+        if endpoint == "/ingest" and SPOOL is not None:
+            restapi.add_resource(IngestJobResource, "/ingest/<job>")
@@ -107,7 +107,7 @@ def setup():
         "/ingest": IngestResource
     }
 
-    configure(resources)
+    configure(resources, snapshot=Snapshot)
 
 
 setup()
@@ -88,7 +88,7 @@ def setup():
         "/ingest": IngestResource
     }
 
-    configure(resources)
+    configure(resources, snapshot=Snapshot)
 
 
 setup()
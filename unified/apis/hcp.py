@@ -2,12 +2,11 @@ import re
 import uuid
 import arrow
 
-from functools import lru_cache
-
 from . import app, configure, request, instance_method
-from . import get_or_create, commit, add
+from . import commit, BulkWriter
 from . import QueryResource, BaseIngestResource, RangeQuery
 
+from ..models import ensure_partitions, update_rollups
 from ..models.hcp import Snapshot, Allocation, Tenant, Namespace, Usage
 
 ALPHA_PREFIX = re.compile("^[A-Za-z]+")
@@ -77,13 +76,14 @@ class IngestResource(BaseIngestResource):
     def ingest(self):
         """Ingest usage."""
 
+        writer = BulkWriter()
         timestamps = set()
 
-        @lru_cache(maxsize=10000)
-        def cache(model, **kwargs):
-            return get_or_create(model, **kwargs)
+        messages = request.get_json(force=True)
+        # Before any row is written, see MonthlyPartitions.ensure
+        ensure_partitions(message["data"]["timestamp"] for message in messages)
 
-        for message in request.get_json(force=True):
+        for message in messages:
             data = message["data"]
 
             timestamp = data["timestamp"]
@@ -92,18 +92,18 @@ class IngestResource(BaseIngestResource):
             else:
                 timestamps.add(timestamp)
 
-            snapshot = cache(Snapshot, ts=timestamp)
+            snapshot_id = writer.dimension(Snapshot, ts=timestamp)
 
             for tenant_name, namespaces in data.items():
                 if not isinstance(namespaces, list):
                     continue
 
-                allocation = None
-                allocation_id = extract_allocation(tenant_name)
-                if allocation_id:
-                    allocation = cache(Allocation, allocation=allocation_id)
+                allocation_id = None
+                allocation = extract_allocation(tenant_name)
+                if allocation:
+                    allocation_id = writer.dimension(Allocation, allocation=allocation)
 
-                tenant = cache(Tenant, name=tenant_name, allocation=allocation)
+                tenant_id = writer.dimension(Tenant, name=tenant_name, allocation_id=allocation_id)
 
                 for details in namespaces:
                     if "namespaceName" in details:
@@ -111,23 +111,24 @@ class IngestResource(BaseIngestResource):
                     else:
                         namespace_name = "__total__"
 
-                    allocation = None
-                    allocation_id = extract_allocation(namespace_name)
-                    if allocation_id:
-                        allocation = cache(Allocation,
-                                           allocation=allocation_id)
+                    allocation_id = None
+                    allocation = extract_allocation(namespace_name)
+                    if allocation:
+                        allocation_id = writer.dimension(Allocation,
+                                                         allocation=allocation)
 
-                    namespace = cache(Namespace,
-                                      name=namespace_name,
-                                      tenant=tenant,
-                                      allocation=allocation)
+                    namespace_id = writer.dimension(Namespace,
+                                                    name=namespace_name,
+                                                    tenant_id=tenant_id,
+                                                    allocation_id=allocation_id)
 
                     start_time = arrow.get(details["startTime"]).timestamp
                     end_time = arrow.get(details["endTime"]).timestamp
 
                     usage = {
-                        "snapshot": snapshot,
-                        "namespace": namespace,
+                        "snapshot_id": snapshot_id,
+                        "ts": timestamp,
+                        "namespace_id": namespace_id,
                         "start_time": start_time,
                         "end_time": end_time,
                         "ingested_bytes": details["ingestedVolume"],
@@ -160,8 +161,10 @@ class IngestResource(BaseIngestResource):
                     else:
                         usage["tiered_bytes"] = 0
 
-                    add(Usage(**usage))
+                    writer.fact(Usage, **usage)
 
+        writer.write()
+        update_rollups(timestamps)
         commit()
 
         return "", 204
@@ -183,7 +186,7 @@ def setup():
         "/ingest": IngestResource
     }
 
-    configure(resources)
+    configure(resources, snapshot=Snapshot)
 
 
 setup()
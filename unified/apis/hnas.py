@@ -1,10 +1,10 @@
 import uuid
-from functools import lru_cache
 
 from . import app, configure, request, instance_method
-from . import add, get_or_create, commit
+from . import commit, BulkWriter
 from . import QueryResource, BaseIngestResource, RangeQuery
 
+from ..models import ensure_partitions, update_rollups
 from ..models.hnas import (
     Snapshot, Owner, Filesystem, VirtualVolume, FilesystemUsage, VirtualVolumeUsage)
 
@@ -35,6 +35,11 @@ class FilesystemList(RangeQuery):
                                start_ts=kwargs['start'],
                                end_ts=kwargs['end'])
 
+    def _stream(self, id='', **kwargs):
+        return instance_method(Filesystem, 'iter_list', id,
+                               start_ts=kwargs['start'],
+                               end_ts=kwargs['end'])
+
 
 class VirtualVolumeResource(QueryResource):
     query_class = VirtualVolume
@@ -53,6 +58,12 @@ class VirtualVolumeList(RangeQuery):
                                start_ts=kwargs['start'],
                                end_ts=kwargs['end'])
 
+    def _stream(self, id='', **kwargs):
+        """Rows are not grouped by owner but have owner field"""
+        return instance_method(VirtualVolume, 'iter_list', id,
+                               start_ts=kwargs['start'],
+                               end_ts=kwargs['end'])
+
 
 class FilesystemUsageResource(QueryResource):
     query_class = FilesystemUsage
@@ -76,30 +87,32 @@ class IngestResource(BaseIngestResource):
     def ingest(self):
         """Ingest usage."""
 
-        @lru_cache(maxsize=1000)
-        def cache(model, **kwargs):
-            return get_or_create(model, **kwargs)
+        writer = BulkWriter()
+        timestamps = set()
+
+        messages = [message for message in request.get_json(force=True)
+                    if message["schema"] == "hnas.filesystems"]
+        # Before any row is written, see MonthlyPartitions.ensure
+        ensure_partitions(message["data"]["timestamp"] for message in messages)
 
-        for message in request.get_json(force=True):
-            if not message["schema"] == "hnas.filesystems":
-                continue
+        for message in messages:
 
             data = message["data"]
+            timestamp = data["timestamp"]
 
-            snapshot = cache(Snapshot, ts=data["timestamp"])
+            snapshot_id = writer.dimension(Snapshot, ts=timestamp)
+            timestamps.add(timestamp)
 
             for name, details in data["filesystems"].items():
-                fs = cache(Filesystem, name=name)
-                fs_usage = {
-                    "filesystem": fs,
-                    "snapshot": snapshot,
-                    "capacity": details["capacity"],
-                    "free": details["free"],
-                    "live_usage": details["live-fs-used"],
-                    "snapshot_usage": details["snapshot-used"]
-                }
-
-                add(FilesystemUsage(**fs_usage))
+                fs_id = writer.dimension(Filesystem, name=name)
+                writer.fact(FilesystemUsage,
+                            filesystem_id=fs_id,
+                            snapshot_id=snapshot_id,
+                            ts=timestamp,
+                            capacity=details["capacity"],
+                            free=details["free"],
+                            live_usage=details["live-fs-used"],
+                            snapshot_usage=details["snapshot-used"])
 
                 if "virtual_volumes" in details:
                     for vusage in details["virtual_volumes"]:
@@ -107,25 +120,26 @@ class IngestResource(BaseIngestResource):
                         if name.startswith("/"):
                             name = name[1:]
 
-                        vivol = cache(VirtualVolume,
-                                      name=name,
-                                      filesystem=fs)
-
-                        vivol_usage = {
-                            "snapshot": snapshot,
-                            "virtual_volume": vivol,
-                            "files": vusage["file-count"],
-                            "usage": vusage["usage"],
-                            "quota": vusage["usage-limit"]
-                        }
+                        vivol_id = writer.dimension(VirtualVolume,
+                                                    name=name,
+                                                    filesystem_id=fs_id)
 
+                        owner_id = None
                         if len(vusage["user-group-account"]) > 0:
-                            owner = cache(Owner,
-                                          name=vusage["user-group-account"])
-                            vivol_usage["owner"] = owner
-
-                        add(VirtualVolumeUsage(**vivol_usage))
-
+                            owner_id = writer.dimension(Owner,
+                                                        name=vusage["user-group-account"])
+
+                        writer.fact(VirtualVolumeUsage,
+                                    snapshot_id=snapshot_id,
+                                    ts=timestamp,
+                                    virtual_volume_id=vivol_id,
+                                    owner_id=owner_id,
+                                    files=vusage["file-count"],
+                                    usage=vusage["usage"],
+                                    quota=vusage["usage-limit"])
+
+        writer.write()
+        update_rollups(timestamps)
         commit()
 
         return "", 204
@@ -150,7 +164,7 @@ def setup():
         "/ingest": IngestResource
     }
 
-    configure(resources)
+    configure(resources, snapshot=Snapshot)
 
 
 setup()
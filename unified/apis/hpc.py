@@ -63,6 +63,9 @@ class JobList(RangeQuery):
     def _get(self, **kwargs):
         return Job.list(start_ts=kwargs['start'], end_ts=kwargs['end'])
 
+    def _stream(self, **kwargs):
+        return Job.iter_list(start_ts=kwargs['start'], end_ts=kwargs['end'])
+
 
 class JobSummary(RangeQuery):
     def _get(self, **kwargs):
@@ -116,7 +116,7 @@ def setup():
         "/ingest": IngestResource
     }
 
-    configure(resources)
+    configure(resources, snapshot=Snapshot)
 
 
 setup()
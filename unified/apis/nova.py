@@ -9,7 +9,7 @@ from flask_sqlalchemy import BaseQuery
 from . import create_logger
 from . import app, configure, request, require_auth
 from . import db, get_or_create, add, commit, QUERY_PARSER, RANGE_PARSER
-from . import QueryResource, BaseIngestResource, RangeQuery
+from . import QueryResource, BaseIngestResource, RangeQuery, paginate
 
 from ..models.nova import (
     Snapshot, Image, Flavor, Hypervisor, AvailabilityZone, Tenant, Account,
@@ -55,7 +55,7 @@ class IngestResource(BaseIngestResource):
                 availability_zone = cache(AvailabilityZone,
                                           name=availability_zone_name)
                 if not availability_zone_name.startswith('sa'):
-                    logger.debug("Skip non-sa zone: %s" % availability_zone_name)
+                    logger.debug("Skip non-sa zone: %s", availability_zone_name)
                     continue
 
                 hypervisor_hostname = instance_detail[
@@ -217,12 +217,15 @@ class InstanceStateResource(QueryResource):
     query_class = InstanceState
 
 
+# A copy, resources are created per request and RANGE_PARSER is shared
+SUMMARY_PARSER = RANGE_PARSER.copy()
+for arg in SUMMARY_PARSER.args:
+    arg.required = True
+SUMMARY_PARSER.add_argument("distinct", type=bool, default=False)
+
+
 class SummaryResource(RangeQuery):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        for arg in self.arg_parser.args:
-            arg.required = True
-        self.arg_parser.add_argument("distinct", type=bool, default=False)
+    arg_parser = SUMMARY_PARSER
 
     # TODO: consider to remove
     def _query(self, start_ts, end_ts):
@@ -251,10 +254,16 @@ class SummaryResource(RangeQuery):
             query = self._query(kwargs["start"], kwargs["end"])
 
         result = {'total': 0, 'pages': 0, 'items': []}
+        total = common_args["total"] or "exact"
         try:
-            qp = query.paginate(common_args["page"], common_args["count"])
+            if total == "exact":
+                qp = query.paginate(common_args["page"], common_args["count"])
+            else:
+                qp = paginate(query, common_args["page"], common_args["count"], total)
             result['total'] = qp.total
-            result['pages'] = qp.pages
+            if total == "estimate":
+                result['estimate'] = True
+            result['pages'] = qp.pages if qp.total is not None else None
             result['page'] = qp.page
             if kwargs["distinct"]:
                 result['items'] = [item[0] for item in qp.items]
@@ -266,7 +275,7 @@ class SummaryResource(RangeQuery):
         except NotFound:
             pass
         except Exception as e:
-            logger.error("Query of summary failed. Detail: %s" % str(e))
+            logger.error("Query of summary failed. Detail: %s", e)
 
         return result
 
@@ -303,7 +312,7 @@ def setup():
         "/ingest": IngestResource
     }
 
-    configure(resources)
+    configure(resources, snapshot=Snapshot)
 
 
 setup()
@@ -1,11 +1,12 @@
 import string
 
-from functools import lru_cache, reduce
+from functools import reduce
 
 from . import app, configure, request
-from . import add, get_or_create, commit
+from . import commit, BulkWriter
 from . import QueryResource, BaseIngestResource, RangeQuery
 
+from ..models import ensure_partitions, update_rollups
 from ..models.swift import Snapshot, Account, Usage
 
 
@@ -23,14 +24,19 @@ class UsageResource(QueryResource):
 
 class IngestResource(BaseIngestResource):
     def ingest(self):
-        @lru_cache(maxsize=100000)
-        def cache(model, **kwargs):
-            return get_or_create(model, **kwargs)
+        writer = BulkWriter()
+        timestamps = set()
 
-        for message in request.get_json(force=True):
+        messages = request.get_json(force=True)
+        # Before any row is written, see MonthlyPartitions.ensure
+        ensure_partitions(message["data"]["timestamp"] for message in messages)
+
+        for message in messages:
             data = message["data"]
+            timestamp = data["timestamp"]
 
-            snapshot = cache(Snapshot, ts=data["timestamp"])
+            snapshot_id = writer.dimension(Snapshot, ts=timestamp)
+            timestamps.add(timestamp)
 
             for key, value in data.items():
                 # Ugly hack until swift data pushed down into own dict.
@@ -38,15 +44,17 @@ class IngestResource(BaseIngestResource):
                 if not reduce(lambda x, y: x and y, valid):
                     continue
 
-                account = cache(Account, openstack_id=key)
-
-                add(Usage(bytes=value["bytes"],
-                          containers=value["containers"],
-                          objects=value["objects"],
-                          quota=value["quota"],
-                          account=account,
-                          snapshot=snapshot))
-
+                writer.fact(Usage,
+                            bytes=value["bytes"],
+                            containers=value["containers"],
+                            objects=value["objects"],
+                            quota=value["quota"],
+                            account_id=writer.dimension(Account, openstack_id=key),
+                            snapshot_id=snapshot_id,
+                            ts=timestamp)
+
+        writer.write()
+        update_rollups(timestamps)
         commit()
 
         return "", 204
@@ -68,7 +76,7 @@ def setup():
         "/ingest": IngestResource
     }
 
-    configure(resources)
+    configure(resources, snapshot=Snapshot)
 
 
 setup()
@@ -1,11 +1,8 @@
-import io
-import uuid
-from functools import lru_cache
-
 from . import app, configure, request, instance_method
-from . import db, get_or_create, commit
+from . import commit, BulkWriter
 from . import QueryResource, BaseIngestResource, RangeQuery
 
+from ..models import ensure_partitions, update_rollups
 from ..models.xfs import Snapshot, Host, Filesystem, Owner, Usage
 
 
@@ -38,55 +35,46 @@ class IngestResource(BaseIngestResource):
     def ingest(self):
         """Ingest usage."""
 
-        @lru_cache(maxsize=10000)
-        def cache(model, **kwargs):
-            return get_or_create(model, **kwargs)
-
-        # This one is experimentally optimised for performance.
-        # Internally creates a TSV and copies it straight
-        # into the database.
-        # Probably not necessary though.
-
-        tsv = io.StringIO()
-
-        for ingest_pass in [1, 2]:
-            for message in request.get_json(force=True):
-                if message["schema"] != "xfs.quota.report":
-                    continue
-
-                data = message["data"]
-
-                host = cache(Host, name=data["hostname"])
-                snapshot = cache(Snapshot,
-                                 ts=data["timestamp"],
-                                 host=host,
-                                 message=message["id"])
-
-                for entry in data["filesystems"]:
-                    filesystem = cache(Filesystem,
-                                       name=entry["filesystem"],
-                                       host=host)
-
-                    for record in entry["quota"]:
-                        owner = cache(Owner, name=record["username"])
-
-                        if ingest_pass == 2:
-                            columns = [
-                                uuid.uuid4(), record["soft"], record["hard"],
-                                record["used"], owner.id, snapshot.id,
-                                filesystem.id
-                            ]
-
-                            tsv.write("\t".join([str(c) for c in columns]) +
-                                      "\n")
-
-            if ingest_pass == 2:
-                tsv.seek(0)
-
-                cursor = db.session.connection().connection.cursor()
-                cursor.copy_from(tsv, "usage")
-
-            commit()
+        # Facts are copied straight into the database, which needs ids of
+        # dimensions first: BulkWriter has them in memory with CLIENT_SIDE_IDS
+        writer = BulkWriter()
+        timestamps = set()
+
+        messages = [message for message in request.get_json(force=True)
+                    if message["schema"] == "xfs.quota.report"]
+        # Before any row is written, see MonthlyPartitions.ensure
+        ensure_partitions(message["data"]["timestamp"] for message in messages)
+
+        for message in messages:
+
+            data = message["data"]
+            timestamp = data["timestamp"]
+
+            host_id = writer.dimension(Host, name=data["hostname"])
+            snapshot_id = writer.dimension(Snapshot,
+                                           ts=timestamp,
+                                           host_id=host_id,
+                                           message=message["id"])
+            timestamps.add(timestamp)
+
+            for entry in data["filesystems"]:
+                filesystem_id = writer.dimension(Filesystem,
+                                                 name=entry["filesystem"],
+                                                 host_id=host_id)
+
+                for record in entry["quota"]:
+                    writer.fact(Usage,
+                                soft=record["soft"],
+                                hard=record["hard"],
+                                usage=record["used"],
+                                owner_id=writer.dimension(Owner, name=record["username"]),
+                                snapshot_id=snapshot_id,
+                                filesystem_id=filesystem_id,
+                                ts=timestamp)
+
+        writer.write(copy=True)
+        update_rollups(timestamps)
+        commit()
 
         return "", 204
 
@@ -111,6 +99,12 @@ class FilesystemList(RangeQuery):
                                start_ts=kwargs['start'],
                                end_ts=kwargs['end'])
 
+    def _stream(self, id='', **kwargs):
+        return instance_method(Filesystem, 'iter_list', id,
+                               default=[],
+                               start_ts=kwargs['start'],
+                               end_ts=kwargs['end'])
+
 
 class OwnerSummary(RangeQuery):
     def _get(self, id='', **kwargs):
@@ -144,7 +138,7 @@ def setup():
         "/ingest": IngestResource
     }
 
-    configure(resources)
+    configure(resources, snapshot=Snapshot)
 
 
 setup()
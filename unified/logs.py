@@ -0,0 +1,69 @@
+"""Logging which does not block requests on writing files."""
+
+import os
+import queue
+import atexit
+import threading
+
+import logging.handlers
+
+# Records waiting to be written, more are dropped rather than block requests
+QUEUE_SIZE = 10000
+# Opens log files instead of logging.handlers.RotatingFileHandler if set, e.g.
+# by dispatcher.py so copies of a package share the handler of a file
+file_handler_factory = None
+
+
+def open_file_handler(filename, **kwargs):
+    """A RotatingFileHandler of filename, or the one file_handler_factory gives."""
+    factory = file_handler_factory or logging.handlers.RotatingFileHandler
+    return factory(filename, **kwargs)
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    """Put records on a queue which a thread writes with handlers.
+
+       The thread is started on the first record of each process, so it
+       also works in workers forked after the handler is created.
+    """
+
+    def __init__(self, *handlers, queue_size=QUEUE_SIZE):
+        super().__init__(queue.Queue(queue_size))
+        self.targets = handlers
+        self.queue_size = queue_size
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self.pid == os.getpid():
+                return
+            # A queue inherited by fork has no reader
+            self.queue = queue.Queue(self.queue_size)
+            self.listener = logging.handlers.QueueListener(
+                self.queue, *self.targets, respect_handler_level=True)
+            self.listener.start()
+            self.pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Write records left in the queue and stop the thread."""
+        with self._start_lock:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+            self.pid = None
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.stop()
+        super().close()
@@ -1,22 +1,151 @@
 import re
+import time
+import uuid
+import calendar
+import datetime
+import threading
 
+from bisect import bisect_left
+from collections import OrderedDict
+
+from sqlalchemy import event, and_, true, func, any_, cast, bindparam, select, union_all
 from sqlalchemy.sql import text
-from sqlalchemy.orm import load_only
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import load_only, ColumnProperty
+from sqlalchemy.dialects.postgresql import UUID, ARRAY, insert
 
 from .. import app, db
 
 STRIP_ID = re.compile("_id$")
 
+# Rows fetched per round trip when iterating through a server-side cursor
+STREAM_CHUNK_SIZE = app.config.get("STREAM_CHUNK_SIZE", 1000)
+
+# Seconds a snapshot index is used before checking for new snapshots, unless
+# it is invalidated earlier by an ingest
+SNAPSHOT_INDEX_TTL = app.config.get("SNAPSHOT_INDEX_TTL", 60)
+
+# Seconds names of dimensions are used before checking for new rows, unless
+# they are invalidated earlier by an ingest
+DIMENSION_NAMES_TTL = app.config.get("DIMENSION_NAMES_TTL", 60)
+
+
+# (class, fields): [(key, attribute)] worked out once by to_dict
+_DICT_LAYOUTS = {}
+
 
 def to_dict(object, fields):
     """Generate dictionary with specified fields."""
-    output = {}
-    fields = set(["id"] + (fields if fields is not None else []))
-    for name in fields:
-        if hasattr(object, name):
-            output[STRIP_ID.sub("", name)] = getattr(object, name)
-    return output
+    layout_key = (type(object), tuple(fields) if fields is not None else ())
+    layout = _DICT_LAYOUTS.get(layout_key)
+    if layout is None:
+        names = ["id"] + [name for name in layout_key[1] if name != "id"]
+        layout = _DICT_LAYOUTS[layout_key] = \
+            [(STRIP_ID.sub("", name), name) for name in names if hasattr(object, name)]
+    return {key: getattr(object, name) for key, name in layout}
+
+
+def fetch_rows(query, stream):
+    """Rows of a query, through a server-side cursor if they are streamed.
+
+       Results built in memory anyway are read at once, without the round
+       trips and the open transaction of a cursor.
+    """
+    return query.yield_per(STREAM_CHUNK_SIZE) if stream else query.all()
+
+
+class _AttributeName(str):
+    """Marks a value read from an attribute by the json method of a model."""
+
+
+class _AttributeRecorder(object):
+    """Stands in for an instance to find which attribute is behind a json key."""
+
+    def __getattr__(self, name):
+        return _AttributeName(name)
+
+
+class RowSerializer(object):
+    """Converts result tuples to the dicts json() of a model produces.
+
+       Keys and the attributes behind them are recorded once from json(),
+       rows of a query with entities of columns are then zipped with the
+       keys without loading ORM instances.
+    """
+
+    def __init__(self, model, keys, attributes):
+        self.model = model
+        self.keys = keys
+        self.attributes = attributes
+        self._columns = None
+
+    @property
+    def columns(self):
+        """Columns to select, in the order of keys."""
+        if self._columns is None:
+            self._columns = [getattr(self.model, name) for name in self.attributes]
+        return self._columns
+
+    def __call__(self, row):
+        return dict(zip(self.keys, row))
+
+
+SERIALIZERS = {}
+
+
+def compile_serializer(model):
+    """Record layout of json() of a model, None if it is not a plain mapping of columns."""
+    if not hasattr(model, "json"):
+        return None
+    try:
+        layout = model.json(_AttributeRecorder())
+    except Exception:
+        return None
+    if not isinstance(layout, dict) or \
+            not all(isinstance(value, _AttributeName) for value in layout.values()):
+        return None
+    return RowSerializer(model, list(layout.keys()), [str(value) for value in layout.values()])
+
+
+def row_serializer(model):
+    """Get the precompiled serializer of a model or None."""
+    serializer = SERIALIZERS.get(model)
+    if serializer is not None and serializer._columns is None:
+        # json() may refer to relationships or other non-column attributes
+        if not all(isinstance(getattr(getattr(model, name, None), "property", None), ColumnProperty)
+                   for name in serializer.attributes):
+            SERIALIZERS[model] = serializer = None
+    return serializer
+
+
+@event.listens_for(db.Model, "instrument_class", propagate=True)
+def _compile_serializer(mapper, cls):
+    SERIALIZERS[cls] = compile_serializer(cls)
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN of a statement, the plan is returned as JSON."""
+
+    def __init__(self, statement):
+        self.statement = statement
+
+    def get_children(self, **kwargs):
+        # Lets the session find tables of the statement and their bind
+        return (self.statement, )
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kwargs):
+    return "EXPLAIN (FORMAT JSON) %s" % compiler.process(element.statement, **kwargs)
+
+
+def estimate_count(query):
+    """Number of rows of a query estimated by the planner, without running it."""
+    statement = query.order_by(None).limit(None).offset(None).statement
+    # Read from the cursor: result processors of the explained columns do not apply
+    plan = db.session.execute(Explain(statement)).cursor.fetchone()[0]
+    return int(plan[0]["Plan"]["Plan Rows"])
 
 
 def id_column():
@@ -26,6 +155,11 @@ def id_column():
                      primary_key=True)
 
 
+def ts_column():
+    """Generate an indexed column of the ts of the snapshot of a fact."""
+    return db.Column(db.Integer, nullable=False, index=True)
+
+
 def get_db_binding(package):
     """Get db binding for a package. Default is None. Argument is __name__"""
     db_binding = None
@@ -46,6 +180,152 @@ class Input(db.Model):
         return {"id": self.id, "name": self.name}
 
 
+class SnapshotIndex(object):
+    """Sorted ts and ids of all snapshots of a model.
+
+       Snapshots are few, so ranges of them are resolved in memory. A
+       refresh compares the count and the sum of ts of the snapshots with
+       those loaded. As ingests add snapshots, it first only loads those from
+       the latest known ts on. All are reloaded if that does not account for
+       the difference, e.g. after SnapshotRetention deleted some.
+    """
+
+    def __init__(self, model, ttl=SNAPSHOT_INDEX_TTL, timer=time.monotonic):
+        self.model = model
+        self.ttl = ttl
+        self.timer = timer
+        # (sorted ts, ids in the same order, {id: ts}), replaced as a whole
+        self._data = ([], [], {})
+        # (count, sum of ts) of the loaded snapshots
+        self._signature = (0, 0)
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data[1])
+
+    def invalidate(self):
+        """Check for new snapshots before the next use."""
+        self._loaded = None
+
+    def _load(self):
+        model = self.model
+        tss, ids, ts_by_id = self._data
+        signature = tuple(db.session.query(func.count(model.id), func.coalesce(func.sum(model.ts), 0)).one())
+        if signature == self._signature:
+            return
+        query = db.session.query(model.ts, model.id).order_by(model.ts, model.id)
+        if tss:
+            new = [row for row in query.filter(model.ts >= tss[-1]) if row[1] not in ts_by_id]
+            added = (self._signature[0] + len(new), self._signature[1] + sum(row[0] for row in new))
+            if added == signature:
+                ts_by_id = dict(ts_by_id)
+                ts_by_id.update((row[1], row[0]) for row in new)
+                self._data = (tss + [row[0] for row in new], ids + [row[1] for row in new], ts_by_id)
+                self._signature = added
+                return
+        rows = query.all()
+        self._data = ([row[0] for row in rows], [row[1] for row in rows],
+                      {row[1]: row[0] for row in rows})
+        self._signature = (len(rows), sum(row[0] for row in rows))
+
+    def refresh(self):
+        """Load new snapshots if invalidated or older than ttl."""
+        if self._loaded is not None and self.timer() - self._loaded < self.ttl:
+            return self._data
+        with self._lock:
+            if self._loaded is None or self.timer() - self._loaded >= self.ttl:
+                self._load()
+                self._loaded = self.timer()
+        return self._data
+
+    def ids_between(self, start_ts=0, end_ts=0):
+        """Ids of snapshots between start_ts and end_ts in ts order."""
+        tss, ids, _ = self.refresh()
+        low = bisect_left(tss, start_ts) if start_ts > 0 else 0
+        high = bisect_left(tss, end_ts) if end_ts > 0 else len(tss)
+        return ids[low:high]
+
+    def ts(self, snapshot_id):
+        """ts of a snapshot, None if it is unknown."""
+        return self.refresh()[2].get(snapshot_id)
+
+    def latest_ts(self):
+        """ts of the latest snapshot, 0 without snapshots."""
+        tss = self.refresh()[0]
+        return tss[-1] if tss else 0
+
+
+SNAPSHOT_INDEXES = {}
+
+
+def snapshot_index(model):
+    """Get the SnapshotIndex of a model with id and ts columns."""
+    index = SNAPSHOT_INDEXES.get(model)
+    if index is None:
+        index = SNAPSHOT_INDEXES.setdefault(model, SnapshotIndex(model))
+    return index
+
+
+def invalidate_snapshot_indexes():
+    """Make indexes check for new snapshots, e.g. after ingest."""
+    for index in list(SNAPSHOT_INDEXES.values()):
+        index.invalidate()
+
+
+class DimensionNames(object):
+    """Names of all rows of a dimension model by id, shared by requests.
+
+       loader returns {id: name}, a name can be a tuple. Rows of dimensions
+       are only added, SnapshotRetention deletes facts and snapshots only, so
+       a refresh counts them and only calls loader if the count has changed. An unknown id refreshes them before KeyError, as
+       another process may have ingested it.
+    """
+
+    def __init__(self, model, loader, ttl=DIMENSION_NAMES_TTL, timer=time.monotonic):
+        self.model = model
+        self.loader = loader
+        self.ttl = ttl
+        self.timer = timer
+        # (count, {id: name}), replaced as a whole
+        self._data = (None, {})
+        self._loaded = None
+        self._lock = threading.Lock()
+        DIMENSION_NAMES.append(self)
+
+    def invalidate(self):
+        """Check for new rows before the next use."""
+        self._loaded = None
+
+    def refresh(self):
+        """Load names if invalidated or older than ttl."""
+        if self._loaded is not None and self.timer() - self._loaded < self.ttl:
+            return self._data[1]
+        with self._lock:
+            if self._loaded is None or self.timer() - self._loaded >= self.ttl:
+                count = db.session.query(func.count(self.model.id)).scalar()
+                if count != self._data[0]:
+                    self._data = (count, self.loader())
+                self._loaded = self.timer()
+        return self._data[1]
+
+    def __getitem__(self, id):
+        names = self.refresh()
+        if id not in names:
+            self.invalidate()
+            names = self.refresh()
+        return names[id]
+
+
+DIMENSION_NAMES = []
+
+
+def invalidate_dimension_names():
+    """Make all DimensionNames check for new rows, e.g. after ingest."""
+    for names in DIMENSION_NAMES:
+        names.invalidate()
+
+
 class SnapshotMothods(object):
     """Mixin for Snapshot"""
     @classmethod
@@ -61,6 +341,30 @@ class SnapshotMothods(object):
             id_query = id_query.filter(cls.ts < end_ts)
         return id_query.with_entities(cls.id).subquery()
 
+    @classmethod
+    def id_in(cls, snapshot_id_column, start_ts=0, end_ts=0):
+        """"Gets a criterion of rows of snapshots between start_ts and end_ts.
+
+        Ids are found in the SnapshotIndex of the model and bound as one
+        array, so the snapshot table is not queried.
+        """
+        ids = snapshot_index(cls).ids_between(start_ts, end_ts)
+        return snapshot_id_column == any_(cast(bindparam(None, ids), ARRAY(UUID)))
+
+    @classmethod
+    def ts_between(cls, ts_column, start_ts=0, end_ts=0):
+        """"Gets a criterion of facts between start_ts and end_ts.
+
+        Fact tables keep ts of their snapshots in ts_column, so a range is
+        scanned with their own index instead of a list of snapshot ids.
+        """
+        criteria = []
+        if start_ts > 0:
+            criteria.append(ts_column >= start_ts)
+        if end_ts > 0:
+            criteria.append(ts_column < end_ts)
+        return and_(true(), *criteria)
+
     @classmethod
     def between(cls, start_ts=0, end_ts=0):
         """"Gets snapshop id and timestamps between start_ts and end_ts.
@@ -73,3 +377,352 @@ class SnapshotMothods(object):
         if end_ts > 0:
             btw_query = btw_query.filter(cls.ts < end_ts)
         return btw_query.options(load_only("id", "ts")).subquery()
+
+
+DAY = 86400
+# Stands in for NULL keys of rollups, which are part of their primary keys
+NO_KEY = "00000000-0000-0000-0000-000000000000"
+
+# Rollups by fact model, in the order they are defined
+ROLLUPS = OrderedDict()
+
+
+class DailyRollup(object):
+    """Maxima or minima of columns of a fact model per day and keys.
+
+       The rollup model has an Integer day, the start of a UTC day, and the
+       keys as its primary key, plus the columns. Ingests update the days of
+       the snapshots they add in their transaction with update(), so a
+       summary of a range reads rollups of whole days and raw facts only of
+       the partial days at its edges.
+    """
+
+    def __init__(self, fact, model, keys, columns):
+        """columns: (name, "max" or "min") in the order of summaries"""
+        self.fact = fact
+        self.model = model
+        self.keys = tuple(keys)
+        self.columns = tuple(columns)
+        ROLLUPS[fact] = self
+
+    def _nullable(self, key):
+        return getattr(self.fact, key).property.columns[0].nullable
+
+    def _aggregated_facts(self, criterion):
+        """Select day, keys and aggregated columns of facts."""
+        fact = self.fact
+        day = (fact.ts - fact.ts % DAY).label("day")
+        keys = [func.coalesce(getattr(fact, key), NO_KEY).label(key) if self._nullable(key)
+                else getattr(fact, key) for key in self.keys]
+        columns = [getattr(func, function)(getattr(fact, name)).label(name) for name, function in self.columns]
+        return select([day] + keys + columns).where(criterion).\
+            group_by(day, *[getattr(fact, key) for key in self.keys])
+
+    def update(self, timestamps):
+        """Add facts of snapshots at timestamps to their days.
+
+           It runs in the transaction of the session which added the facts.
+        """
+        if not timestamps:
+            return
+        db.session.flush()
+        table = self.model.__table__
+        names = ["day"] + list(self.keys) + [name for name, _ in self.columns]
+        statement = insert(table).from_select(names, self._aggregated_facts(
+            self.fact.ts == any_(cast(bindparam(None, sorted(set(timestamps))), ARRAY(db.Integer)))))
+        combine = {"max": func.greatest, "min": func.least}
+        statement = statement.on_conflict_do_update(
+            index_elements=["day"] + list(self.keys),
+            set_={name: combine[function](table.c[name], statement.excluded[name])
+                  for name, function in self.columns})
+        db.session.execute(statement)
+
+    def rebuild(self, start_ts=0, end_ts=0):
+        """Compute days between start_ts and end_ts again from facts.
+
+           Both are rounded down to days. Return the number of rollup rows.
+        """
+        start_day = start_ts - start_ts % DAY if start_ts > 0 else 0
+        end_day = end_ts - end_ts % DAY if end_ts > 0 else 0
+        model = self.model
+        days = SnapshotMothods.ts_between(model.day, start_day, end_day)
+        db.session.query(model).filter(days).delete(synchronize_session=False)
+        names = ["day"] + list(self.keys) + [name for name, _ in self.columns]
+        result = db.session.execute(insert(model.__table__).from_select(
+            names, self._aggregated_facts(SnapshotMothods.ts_between(self.fact.ts, start_day, end_day))))
+        return result.rowcount
+
+    def summary(self, start_ts=0, end_ts=0):
+        """Query keys and aggregated columns of facts between start_ts and end_ts."""
+        fact, model = self.fact, self.model
+        # Whole days are [first_day, last_day)
+        first_day = start_ts + (-start_ts) % DAY if start_ts > 0 else 0
+        last_day = end_ts - end_ts % DAY if end_ts > 0 else 0
+        names = list(self.keys) + [name for name, _ in self.columns]
+
+        def raw(start, end):
+            return select([getattr(fact, name) for name in names]).\
+                where(SnapshotMothods.ts_between(fact.ts, start, end))
+
+        if end_ts > 0 and last_day <= first_day:
+            parts = [raw(start_ts, end_ts)]
+        else:
+            keys = [func.nullif(getattr(model, key), NO_KEY, type_=getattr(model, key).type).label(key)
+                    if self._nullable(key)
+                    else getattr(model, key) for key in self.keys]
+            parts = [select(keys + [getattr(model, name) for name, _ in self.columns]).
+                     where(SnapshotMothods.ts_between(model.day, first_day, last_day))]
+            if start_ts > 0 and start_ts < first_day:
+                parts.append(raw(start_ts, first_day))
+            if end_ts > 0 and last_day < end_ts:
+                parts.append(raw(last_day, end_ts))
+        rows = union_all(*parts).alias("rows") if len(parts) > 1 else parts[0].alias("rows")
+
+        keys = [rows.c[key] for key in self.keys]
+        aggregates = [getattr(func, function)(rows.c[name]) for name, function in self.columns]
+        return db.session.query(*(keys + aggregates)).group_by(*keys)
+
+
+def update_rollups(timestamps):
+    """Update all rollups with facts of snapshots at timestamps."""
+    for rollup in ROLLUPS.values():
+        rollup.update(timestamps)
+
+
+# Monthly partitions by fact model, in the order they are defined
+PARTITIONS = OrderedDict()
+
+
+def month_range(ts):
+    """Start and end ts of the UTC month of ts."""
+    day = datetime.datetime.utcfromtimestamp(ts)
+    year, month = (day.year + 1, 1) if day.month == 12 else (day.year, day.month + 1)
+    return (calendar.timegm((day.year, day.month, 1, 0, 0, 0)),
+            calendar.timegm((year, month, 1, 0, 0, 0)))
+
+
+class MonthlyPartitions(object):
+    """Range partitions of a fact table by ts, one per UTC month.
+
+       Tables are created without partitions and converted by
+       bin/partition_facts.py, which is checked once per process. Ingests call
+       ensure() with ts of snapshots before writing rows, which creates
+       partitions of their months and of the following ones.
+    """
+
+    def __init__(self, fact):
+        self.fact = fact
+        self.table = fact.__tablename__
+        self.name_pattern = re.compile(r"^%s_y(\d{4})m(\d{2})$" % re.escape(self.table))
+        self._partitioned = None
+        self._known = set()
+        self._lock = threading.Lock()
+        PARTITIONS[fact] = self
+
+    def name(self, ts):
+        """Name of the partition of the month of ts, e.g. usage_y2017m01."""
+        day = datetime.datetime.utcfromtimestamp(ts)
+        return "%s_y%04dm%02d" % (self.table, day.year, day.month)
+
+    def partitions(self, bind=None):
+        """(name, start_ts, end_ts) of attached monthly partitions by start_ts."""
+        rows = (bind or db.session).execute(text(
+            "SELECT c.relname FROM pg_inherits AS i JOIN pg_class AS c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table)"), {"table": self.table})
+        found = []
+        for name, in rows:
+            match = self.name_pattern.match(name)
+            if match:
+                start = calendar.timegm((int(match.group(1)), int(match.group(2)), 1, 0, 0, 0))
+                found.append((name, ) + month_range(start))
+        return sorted(found, key=lambda partition: partition[1])
+
+    def is_partitioned(self, bind=None):
+        with self._lock:
+            if self._partitioned is None:
+                bind = bind or db.session
+                self._partitioned = bind.execute(text(
+                    "SELECT EXISTS(SELECT 1 FROM pg_partitioned_table "
+                    "WHERE partrelid = to_regclass(:table))"), {"table": self.table}).scalar()
+                if self._partitioned:
+                    self._known.update(partition[0] for partition in self.partitions(bind))
+            return self._partitioned
+
+    def create(self, ts, bind=None):
+        """Create the partition of the month of ts unless it exists, return its name."""
+        start, end = month_range(ts)
+        name = self.name(start)
+        bind = bind or db.session
+        # Concurrent ingests of a new month wait for the first one to commit
+        bind.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": name})
+        bind.execute(text('CREATE TABLE IF NOT EXISTS "%s" PARTITION OF "%s" FOR VALUES FROM (%d) TO (%d)' %
+                          (name, self.table, start, end)))
+        return name
+
+    def ensure(self, timestamps):
+        """Create partitions of months of timestamps and of the months after.
+
+           Creating a partition locks the fact table until commit, so each is
+           committed on a connection of its own rather than held by the
+           transaction of the ingest. It waits for locks of the tables facts
+           refer to, so call it before the ingest writes rows.
+        """
+        if not self.is_partitioned():
+            return
+        engine = db.get_engine(app, bind=self.fact.__table__.info.get("bind_key"))
+        for ts in set(timestamps):
+            for start in month_range(ts):
+                name = self.name(start)
+                if name not in self._known:
+                    with engine.begin() as connection:
+                        self.create(start, connection)
+                    self._known.add(name)
+
+    def detach(self, before_ts, drop=False, bind=None):
+        """Detach partitions which end by before_ts and drop them if asked.
+
+           Return names of the partitions.
+        """
+        bind = bind or db.session
+        names = []
+        for name, _, end in self.partitions(bind):
+            if end <= before_ts:
+                bind.execute(text('ALTER TABLE "%s" DETACH PARTITION "%s"' % (self.table, name)))
+                if drop:
+                    bind.execute(text('DROP TABLE "%s"' % name))
+                self._known.discard(name)
+                names.append(name)
+        return names
+
+
+def ensure_partitions(timestamps):
+    """Create partitions of all partitioned fact tables for timestamps."""
+    timestamps = set(timestamps)
+    for partitions in PARTITIONS.values():
+        partitions.ensure(timestamps)
+
+
+# Retention of snapshots by snapshot model, in the order they are defined
+RETENTIONS = OrderedDict()
+
+RESOLUTIONS = OrderedDict([("hour", 3600), ("day", DAY)])
+
+_MERGE_FACTS = """
+WITH merge AS (
+    SELECT * FROM unnest(CAST(:snapshot_ids AS uuid[]), CAST(:snapshot_ts AS integer[]),
+                         CAST(:kept_ids AS uuid[]), CAST(:kept_ts AS integer[]))
+        AS m(snapshot_id, snapshot_ts, kept_id, kept_ts)),
+latest AS (
+    SELECT (array_agg(f.id ORDER BY m.snapshot_ts DESC))[1] AS id, m.kept_id, m.kept_ts{aggregates}
+    FROM "{table}" AS f JOIN merge AS m ON m.snapshot_id = f.snapshot_id
+    WHERE true{in_range}
+    GROUP BY m.kept_id, m.kept_ts, {keys})
+UPDATE "{table}" AS f SET snapshot_id = latest.kept_id{assignments}
+FROM latest
+WHERE f.id = latest.id{in_range} AND ({changed})
+"""
+
+
+class SnapshotRetention(object):
+    """Downsampling of old snapshots of a package to one per hour or day.
+
+       Snapshots are put in buckets by their ts and by the group columns of
+       the snapshot model, e.g. the host of xfs snapshots, and the latest one
+       of a bucket is kept. For each value of the keys of a fact model, the
+       latest fact of the bucket takes the maxima or minima of the columns
+       over the bucket and moves to the kept snapshot, so maxima of a day, and
+       daily rollups, stay the same. Other facts and snapshots of the bucket
+       are deleted, and an Input is recorded as ingests do, which changes the
+       data version cached results and ETags depend on.
+    """
+
+    def __init__(self, snapshot, facts, group=()):
+        """facts: (fact model, keys, columns), columns as of DailyRollup"""
+        self.snapshot = snapshot
+        self.table = snapshot.__tablename__
+        self.facts = [(fact, tuple(keys), tuple(columns)) for fact, keys, columns in facts]
+        self.group = tuple(group)
+        RETENTIONS[snapshot] = self
+
+    def _execute(self, statement, params):
+        # The mapper selects the database of packages with a bind key
+        return db.session.execute(text(statement), params, mapper=self.snapshot.__mapper__)
+
+    def _bucket(self, resolution):
+        return ", ".join(["ts - ts %% %d" % resolution] + ['"%s"' % name for name in self.group])
+
+    def days(self, before_ts, resolution):
+        """Start ts of days before before_ts which have buckets to merge."""
+        return [row[0] for row in self._execute(
+            'SELECT DISTINCT min(ts) - min(ts) %% %d FROM "%s" WHERE ts < :before '
+            "GROUP BY %s HAVING count(*) > 1 ORDER BY 1" % (DAY, self.table, self._bucket(resolution)),
+            {"before": before_ts})]
+
+    def buckets(self, start_ts, end_ts, resolution):
+        """Kept snapshot of buckets with more than one, as
+           {(snapshot id, ts): [(id, ts) of snapshots to delete]}.
+        """
+        columns = ", ".join(["id", "ts"] + ['"%s"' % name for name in self.group])
+        rows = self._execute(
+            'SELECT %s FROM "%s" WHERE ts >= :start AND ts < :end ORDER BY ts DESC' % (columns, self.table),
+            {"start": start_ts, "end": end_ts})
+        kept = {}
+        buckets = OrderedDict()
+        for row in rows:
+            bucket = (row[1] - row[1] % resolution, ) + tuple(row[2:])
+            if bucket in kept:
+                buckets[kept[bucket]].append((row[0], row[1]))
+            else:
+                kept[bucket] = (row[0], row[1])
+                buckets[kept[bucket]] = []
+        return OrderedDict((snapshot, merged) for snapshot, merged in buckets.items() if merged)
+
+    def _merge_statement(self, fact, keys, columns):
+        has_ts = "ts" in fact.__table__.c
+        changed = ["f.snapshot_id <> latest.kept_id"]
+        if columns:
+            changed.append("ROW(%s) IS DISTINCT FROM ROW(%s)" % (
+                ", ".join('f."%s"' % name for name, _ in columns),
+                ", ".join('latest."%s"' % name for name, _ in columns)))
+        assignments = ['"%s" = latest."%s"' % (name, name) for name, _ in columns]
+        if has_ts:
+            assignments.append("ts = latest.kept_ts")
+        return _MERGE_FACTS.format(
+            table=fact.__tablename__,
+            aggregates="".join(', %s(f."%s") AS "%s"' % (function, name, name) for name, function in columns),
+            keys=", ".join('f."%s"' % key for key in keys),
+            assignments="".join(", " + assignment for assignment in assignments),
+            in_range=" AND f.ts >= :start AND f.ts < :end" if has_ts else "",
+            changed=" OR ".join(changed))
+
+    def downsample(self, start_ts, end_ts, resolution):
+        """Keep a snapshot per resolution seconds between start_ts and end_ts.
+
+           It runs in the current transaction of db.session. Return the number
+           of deleted rows by table.
+        """
+        buckets = self.buckets(start_ts, end_ts, resolution)
+        reclaimed = OrderedDict()
+        if not buckets:
+            return reclaimed
+        merge = [(snapshot, kept) for kept, merged in buckets.items() for snapshot in [kept] + merged]
+        params = {
+            "start": start_ts,
+            "end": end_ts,
+            "snapshot_ids": [str(snapshot[0]) for snapshot, _ in merge],
+            "snapshot_ts": [snapshot[1] for snapshot, _ in merge],
+            "kept_ids": [str(kept[0]) for _, kept in merge],
+            "kept_ts": [kept[1] for _, kept in merge],
+            "deleted": [str(snapshot[0]) for merged in buckets.values() for snapshot in merged]
+        }
+        for fact, keys, columns in self.facts:
+            self._execute(self._merge_statement(fact, keys, columns), params)
+            in_range = " AND ts >= :start AND ts < :end" if "ts" in fact.__table__.c else ""
+            reclaimed[fact.__tablename__] = self._execute(
+                'DELETE FROM "%s" WHERE snapshot_id = ANY(CAST(:deleted AS uuid[]))%s' %
+                (fact.__tablename__, in_range), params).rowcount
+        reclaimed[self.table] = self._execute(
+            'DELETE FROM "%s" WHERE id = ANY(CAST(:deleted AS uuid[]))' % self.table, params).rowcount
+        db.session.add(Input(name="retention of %s from %d to %d by %d %s" % (
+            self.table, start_ts, end_ts, resolution, uuid.uuid4())))
+        return reclaimed
@@ -1,5 +1,7 @@
 from sqlalchemy.sql import func
-from . import db, id_column, to_dict, SnapshotMothods
+from sqlalchemy.dialects.postgresql import UUID
+from . import db, id_column, ts_column, to_dict, SnapshotMothods, DailyRollup, MonthlyPartitions, \
+    SnapshotRetention, DimensionNames
 
 
 class Allocation(db.Model):
@@ -50,12 +52,10 @@ class Tenant(db.Model):
 
         Maximal usage of the period is returned.
         """
-        id_query = Snapshot.id_between(start_ts, end_ts)
-
         namespaces = self._get_namespaces()
         namespace_ids = namespaces.keys()
 
-        query = Usage.query.filter(Usage.snapshot_id.in_(id_query)).\
+        query = Usage.query.filter(Snapshot.ts_between(Usage.ts, start_ts, end_ts)).\
             filter(Usage.namespace_id.in_(namespace_ids)).\
             group_by(Usage.namespace_id).\
             with_entities(Usage.namespace_id,
@@ -87,15 +87,14 @@ class Tenant(db.Model):
     def list(self, start_ts=0, end_ts=0):
         """"Gets a list of usages of a tenant between start_ts and end_ts.
         """
-        snapshots = Snapshot.between(start_ts, end_ts)
         namespaces = self._get_namespaces()
         namespace_ids = namespaces.keys()
 
-        query = Usage.query.join(snapshots).\
+        query = Usage.query.filter(Snapshot.ts_between(Usage.ts, start_ts, end_ts)).\
             filter(Usage.namespace_id.in_(namespace_ids)).\
-            order_by(Usage.namespace_id, snapshots.c.ts).\
+            order_by(Usage.namespace_id, Usage.ts).\
             with_entities(Usage.namespace_id,
-                          snapshots.c.ts,
+                          Usage.ts,
                           Usage.ingested_bytes,
                           Usage.raw_bytes,
                           Usage.reads,
@@ -141,12 +140,10 @@ class Namespace(db.Model):
     def list(self, start_ts=0, end_ts=0):
         """"Gets a list of usages of a namespace between start_ts and end_ts.
         """
-        snapshots = Snapshot.between(start_ts, end_ts)
-
-        query = Usage.query.join(snapshots).\
+        query = Usage.query.filter(Snapshot.ts_between(Usage.ts, start_ts, end_ts)).\
             filter(Usage.namespace_id == self.id).\
-            order_by(snapshots.c.ts).\
-            with_entities(snapshots.c.ts,
+            order_by(Usage.ts).\
+            with_entities(Usage.ts,
                           Usage.ingested_bytes,
                           Usage.raw_bytes,
                           Usage.reads,
@@ -199,6 +196,7 @@ class Usage(db.Model):
                              db.ForeignKey("namespace.id"),
                              index=True,
                              nullable=False)
+    ts = ts_column()
 
     def json(self):
         """JSON"""
@@ -215,25 +213,9 @@ class Usage(db.Model):
 
         Maximal usage of the period is returned.
         """
-        id_query = Snapshot.id_between(start_ts, end_ts)
-
-        query = cls.query.filter(cls.snapshot_id.in_(id_query)).\
-            group_by(cls.namespace_id).\
-            with_entities(cls.namespace_id,
-                          func.max(cls.ingested_bytes),
-                          func.max(cls.raw_bytes),
-                          func.max(cls.reads),
-                          func.max(cls.writes),
-                          func.max(cls.deletes),
-                          func.max(cls.objects),
-                          func.max(cls.bytes_in),
-                          func.max(cls.bytes_out),
-                          func.max(cls.metadata_only_objects),
-                          func.max(cls.metadata_only_bytes),
-                          func.max(cls.tiered_objects),
-                          func.max(cls.tiered_bytes))
-
-        namespaces = dict(Namespace.query.with_entities(Namespace.id, Namespace.name).all())
+        query = USAGE_ROLLUP.summary(start_ts, end_ts)
+
+        namespaces = NAMESPACE_NAMES
 
         fields = ['namespace', 'ingested_bytes', 'raw_bytes', 'reads',
                   'writes', 'deletes', 'objects', 'bytes_in', 'bytes_out',
@@ -246,3 +228,34 @@ class Usage(db.Model):
             mappings.extend(q[1:])
             rslt.append(dict(zip(fields, mappings)))
         return rslt
+
+
+class DailyUsage(db.Model):
+    """Daily maxima of Usage by namespace"""
+    day = db.Column(db.Integer, primary_key=True)
+    namespace_id = db.Column(UUID, primary_key=True)
+    ingested_bytes = db.Column(db.BigInteger, nullable=False)
+    raw_bytes = db.Column(db.BigInteger, nullable=False)
+    reads = db.Column(db.BigInteger, nullable=False)
+    writes = db.Column(db.BigInteger, nullable=False)
+    deletes = db.Column(db.BigInteger, nullable=False)
+    objects = db.Column(db.BigInteger, nullable=False)
+    bytes_in = db.Column(db.BigInteger, nullable=False)
+    bytes_out = db.Column(db.BigInteger, nullable=False)
+    metadata_only_objects = db.Column(db.BigInteger, nullable=False)
+    metadata_only_bytes = db.Column(db.BigInteger, nullable=False)
+    tiered_objects = db.Column(db.BigInteger, nullable=False)
+    tiered_bytes = db.Column(db.BigInteger, nullable=False)
+
+
+USAGE_ROLLUP = DailyRollup(
+    Usage, DailyUsage, ("namespace_id", ),
+    [(name, "max") for name in (
+        "ingested_bytes", "raw_bytes", "reads", "writes", "deletes", "objects",
+        "bytes_in", "bytes_out", "metadata_only_objects", "metadata_only_bytes",
+        "tiered_objects", "tiered_bytes")])
+USAGE_PARTITIONS = MonthlyPartitions(Usage)
+SNAPSHOT_RETENTION = SnapshotRetention(Snapshot, [(Usage, USAGE_ROLLUP.keys, USAGE_ROLLUP.columns)])
+
+NAMESPACE_NAMES = DimensionNames(
+    Namespace, lambda: dict(Namespace.query.with_entities(Namespace.id, Namespace.name)))
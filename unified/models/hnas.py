@@ -1,5 +1,7 @@
 from sqlalchemy.sql import func
-from . import db, id_column, to_dict, SnapshotMothods
+from sqlalchemy.dialects.postgresql import UUID
+from . import db, id_column, ts_column, to_dict, SnapshotMothods, DailyRollup, MonthlyPartitions, \
+    SnapshotRetention, DimensionNames, fetch_rows
 
 
 class Owner(db.Model):
@@ -43,13 +45,9 @@ class Filesystem(db.Model):
 
         Maximal usage of the period is returned.
         """
-        snapshot_ids = Snapshot.id_between(start_ts, end_ts)
-        id_query = FilesystemUsage.query.\
+        query = FilesystemUsage.query.\
             filter(FilesystemUsage.filesystem_id == self.id).\
-            filter(FilesystemUsage.snapshot_id.in_(snapshot_ids)).\
-            with_entities(FilesystemUsage.id)
-
-        query = FilesystemUsage.query.filter(FilesystemUsage.id.in_(id_query)).\
+            filter(Snapshot.ts_between(FilesystemUsage.ts, start_ts, end_ts)).\
             with_entities(func.max(FilesystemUsage.capacity),
                           func.min(FilesystemUsage.free),
                           func.max(FilesystemUsage.live_usage),
@@ -62,25 +60,27 @@ class Filesystem(db.Model):
             fields = ['capacity', 'free', 'live_usage', 'snapshot_usage']
             return dict(zip(fields, values))
 
-    def list(self, start_ts=0, end_ts=0):
-        """"Gets a list of usages of a filesystem between start_ts and end_ts.
+    def iter_list(self, start_ts=0, end_ts=0, stream=True):
+        """"Iterates over usages of a filesystem between start_ts and end_ts.
         """
-        snapshots = Snapshot.between(start_ts, end_ts)
-        query = FilesystemUsage.query.join(snapshots).\
+        query = FilesystemUsage.query.\
+            filter(Snapshot.ts_between(FilesystemUsage.ts, start_ts, end_ts)).\
             filter(FilesystemUsage.filesystem_id == self.id).\
-            order_by(snapshots.c.ts).\
-            with_entities(snapshots.c.ts,
+            order_by(FilesystemUsage.ts).\
+            with_entities(FilesystemUsage.ts,
                           FilesystemUsage.capacity,
                           FilesystemUsage.free,
                           FilesystemUsage.live_usage,
                           FilesystemUsage.snapshot_usage)
 
         fields = ['ts', 'capacity', 'free', 'live_usage', 'snapshot_usage']
-        rslt = []
+        for q in fetch_rows(query, stream):
+            yield dict(zip(fields, q))
 
-        for q in query.all():
-            rslt.append(dict(zip(fields, q)))
-        return rslt
+    def list(self, start_ts=0, end_ts=0):
+        """"Gets a list of usages of a filesystem between start_ts and end_ts.
+        """
+        return list(self.iter_list(start_ts, end_ts, stream=False))
 
 
 class FilesystemUsage(db.Model):
@@ -98,6 +98,7 @@ class FilesystemUsage(db.Model):
                               db.ForeignKey("filesystem.id"),
                               index=True,
                               nullable=False)
+    ts = ts_column()
 
     def json(self):
         """JSON"""
@@ -110,17 +111,9 @@ class FilesystemUsage(db.Model):
 
         Maximal usage of the period is returned.
         """
-        id_query = Snapshot.id_between(start_ts, end_ts)
-
-        query = cls.query.filter(cls.snapshot_id.in_(id_query)).\
-            group_by(cls.filesystem_id).\
-            with_entities(cls.filesystem_id,
-                          func.max(cls.capacity).label('capacity'),
-                          func.min(cls.free).label('free'),
-                          func.max(cls.live_usage).label('live_usage'),
-                          func.max(cls.snapshot_usage).label('snapshot_usage'))
+        query = FILESYSTEM_USAGE_ROLLUP.summary(start_ts, end_ts)
 
-        file_systems = dict(Filesystem.query.with_entities(Filesystem.id, Filesystem.name).all())
+        file_systems = FILESYSTEM_NAMES
 
         fields = ['filesystem', 'capacity', 'free', 'live_usage', 'snapshot_usage']
         rslt = []
@@ -150,14 +143,9 @@ class VirtualVolume(db.Model):
 
         Maximal usage of the period is returned.
         """
-        snapshot_ids = Snapshot.id_between(start_ts, end_ts)
-        id_query = VirtualVolumeUsage.query.\
-            filter(VirtualVolumeUsage.virtual_volume_id == self.id).\
-            filter(VirtualVolumeUsage.snapshot_id.in_(snapshot_ids)).\
-            with_entities(VirtualVolumeUsage.id)
-
         query = VirtualVolumeUsage.query.\
-            filter(VirtualVolumeUsage.id.in_(id_query)).\
+            filter(VirtualVolumeUsage.virtual_volume_id == self.id).\
+            filter(Snapshot.ts_between(VirtualVolumeUsage.ts, start_ts, end_ts)).\
             group_by(VirtualVolumeUsage.owner_id).\
             with_entities(VirtualVolumeUsage.owner_id,
                           func.max(VirtualVolumeUsage.quota),
@@ -169,36 +157,45 @@ class VirtualVolume(db.Model):
 
         for q in query.all():
             values = list(q)
-            # almost all usages has no owner, query owner directly if needed
+            # almost all usages has no owner
             if values[0]:
-                values[0] = Owner.query.get(q[0]).name
+                values[0] = OWNER_NAMES[q[0]]
             rslt.append(dict(zip(fields, values)))
         return rslt
 
-    def list(self, start_ts=0, end_ts=0):
-        """"Gets a list of usages of a virtual volume between start_ts and end_ts.
+    def iter_list(self, start_ts=0, end_ts=0, stream=True):
+        """"Iterates over usages of a virtual volume between start_ts and end_ts.
+
+        Rows are ordered by owner then ts and have the name of owner.
         """
-        snapshots = Snapshot.between(start_ts, end_ts)
-        query = VirtualVolumeUsage.query.join(snapshots).\
+        query = VirtualVolumeUsage.query.\
+            filter(Snapshot.ts_between(VirtualVolumeUsage.ts, start_ts, end_ts)).\
             filter(VirtualVolumeUsage.virtual_volume_id == self.id).\
-            order_by(VirtualVolumeUsage.owner_id, snapshots.c.ts).\
+            order_by(VirtualVolumeUsage.owner_id, VirtualVolumeUsage.ts).\
             with_entities(VirtualVolumeUsage.owner_id,
-                          snapshots.c.ts,
+                          VirtualVolumeUsage.ts,
                           VirtualVolumeUsage.quota,
                           VirtualVolumeUsage.files,
                           VirtualVolumeUsage.usage)
 
-        fields = ['ts', 'quota', 'files', 'usage']
-        rslt = {}
+        owners = OWNER_NAMES
+        fields = ['owner', 'ts', 'quota', 'files', 'usage']
 
-        for q in query.all():
-            if q[0]:
-                owner = Owner.query.get(q[0]).name
-            else:
-                owner = 'UNKNOWN'  # no owner
+        for q in fetch_rows(query, stream):
+            owner = owners[q[0]] if q[0] else 'UNKNOWN'  # no owner
+            yield dict(zip(fields, (owner, ) + tuple(q[1:])))
+
+    def list(self, start_ts=0, end_ts=0):
+        """"Gets a list of usages of a virtual volume between start_ts and end_ts.
+
+        Grouped by owner
+        """
+        rslt = {}
+        for row in self.iter_list(start_ts, end_ts, stream=False):
+            owner = row.pop('owner')
             if owner not in rslt:
                 rslt[owner] = []
-            rslt[owner].append(dict(zip(fields, q[1:])))
+            rslt[owner].append(row)
         return rslt
 
 
@@ -217,6 +214,7 @@ class VirtualVolumeUsage(db.Model):
                                   db.ForeignKey("virtual_volume.id"),
                                   index=True,
                                   nullable=False)
+    ts = ts_column()
 
     def json(self):
         """JSON"""
@@ -229,23 +227,12 @@ class VirtualVolumeUsage(db.Model):
 
         Maximal usage of the period is returned.
         """
-        id_query = Snapshot.id_between(start_ts, end_ts)
+        query = VIRTUAL_VOLUME_USAGE_ROLLUP.summary(start_ts, end_ts)
 
-        query = cls.query.filter(cls.snapshot_id.in_(id_query)).\
-            group_by(cls.virtual_volume_id, cls.owner_id).\
-            with_entities(cls.virtual_volume_id, cls.owner_id,
-                          func.max(cls.quota).label('quota'),
-                          func.max(cls.files).label('files'),
-                          func.max(cls.usage).label('usage'))
-
-        fq = VirtualVolume.query.join(Filesystem).\
-            with_entities(VirtualVolume.id, Filesystem.name, VirtualVolume.name).all()
-        file_systems = {}
-        for fs in fq:
-            file_systems[fs[0]] = fs[1:]
+        file_systems = VIRTUAL_VOLUME_NAMES
 
         # Not all virtual volumes has owner
-        owners = dict(Owner.query.with_entities(Owner.id, Owner.name).all())
+        owners = OWNER_NAMES
 
         fields = ['filesystem', 'virtual_volume', 'owner', 'quota', 'files', 'usage']
         rslt = []
@@ -256,3 +243,46 @@ class VirtualVolumeUsage(db.Model):
             mappings = (fn, vn, owner, q[2], q[3], q[4])
             rslt.append(dict(zip(fields, mappings)))
         return rslt
+
+
+class DailyFilesystemUsage(db.Model):
+    """Daily maxima and minima of FilesystemUsage by filesystem"""
+    day = db.Column(db.Integer, primary_key=True)
+    filesystem_id = db.Column(UUID, primary_key=True)
+    capacity = db.Column(db.BigInteger, nullable=False)
+    free = db.Column(db.BigInteger, nullable=False)
+    live_usage = db.Column(db.BigInteger, nullable=False)
+    snapshot_usage = db.Column(db.BigInteger, nullable=False)
+
+
+class DailyVirtualVolumeUsage(db.Model):
+    """Daily maxima of VirtualVolumeUsage by virtual volume and owner"""
+    day = db.Column(db.Integer, primary_key=True)
+    virtual_volume_id = db.Column(UUID, primary_key=True)
+    # Usages without owner are kept with NO_KEY
+    owner_id = db.Column(UUID, primary_key=True)
+    quota = db.Column(db.BigInteger, nullable=False)
+    files = db.Column(db.BigInteger, nullable=False)
+    usage = db.Column(db.BigInteger, nullable=False)
+
+
+FILESYSTEM_USAGE_ROLLUP = DailyRollup(
+    FilesystemUsage, DailyFilesystemUsage, ("filesystem_id", ),
+    (("capacity", "max"), ("free", "min"), ("live_usage", "max"),
+     ("snapshot_usage", "max")))
+VIRTUAL_VOLUME_USAGE_ROLLUP = DailyRollup(
+    VirtualVolumeUsage, DailyVirtualVolumeUsage, ("virtual_volume_id", "owner_id"),
+    (("quota", "max"), ("files", "max"), ("usage", "max")))
+FILESYSTEM_USAGE_PARTITIONS = MonthlyPartitions(FilesystemUsage)
+VIRTUAL_VOLUME_USAGE_PARTITIONS = MonthlyPartitions(VirtualVolumeUsage)
+SNAPSHOT_RETENTION = SnapshotRetention(Snapshot, [
+    (rollup.fact, rollup.keys, rollup.columns)
+    for rollup in (FILESYSTEM_USAGE_ROLLUP, VIRTUAL_VOLUME_USAGE_ROLLUP)])
+
+FILESYSTEM_NAMES = DimensionNames(
+    Filesystem, lambda: dict(Filesystem.query.with_entities(Filesystem.id, Filesystem.name)))
+# Filesystem and virtual volume names of virtual volumes
+VIRTUAL_VOLUME_NAMES = DimensionNames(VirtualVolume, lambda: {
+    row[0]: row[1:] for row in
+    VirtualVolume.query.join(Filesystem).with_entities(VirtualVolume.id, Filesystem.name, VirtualVolume.name)})
+OWNER_NAMES = DimensionNames(Owner, lambda: dict(Owner.query.with_entities(Owner.id, Owner.name)))
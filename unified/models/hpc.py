@@ -1,5 +1,5 @@
 from sqlalchemy.sql import func
-from . import db, id_column
+from . import db, id_column, fetch_rows
 
 
 class Owner(db.Model):
@@ -116,8 +116,10 @@ class Job(db.Model):
         return id_query.with_entities(cls.id).subquery()
 
     @classmethod
-    def list(cls, start_ts=0, end_ts=0):
-        """"Gets jobs finished between start_ts and end_ts.
+    def iter_list(cls, start_ts=0, end_ts=0, stream=True):
+        """"Iterates over jobs finished between start_ts and end_ts.
+
+        Rows are fetched through a server-side cursor if stream is set.
         """
         query = cls.query.join(Owner).join(Queue).\
             with_entities(Job.job_id, Job.name,
@@ -131,7 +133,14 @@ class Job(db.Model):
             query = query.filter(Job.end < end_ts)
         fields = ['job_id', 'name', 'queue', 'owner', 'start',
                   'end', 'cores', 'cpu_seconds']
-        return [dict(zip(fields, q)) for q in query.all()]
+        for q in fetch_rows(query, stream):
+            yield dict(zip(fields, q))
+
+    @classmethod
+    def list(cls, start_ts=0, end_ts=0):
+        """"Gets jobs finished between start_ts and end_ts.
+        """
+        return list(cls.iter_list(start_ts, end_ts, stream=False))
 
     @classmethod
     def summarise(cls, start_ts=0, end_ts=0):
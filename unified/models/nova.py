@@ -1,9 +1,9 @@
 from flask_sqlalchemy import BaseQuery
 from sqlalchemy.dialects.postgresql import INET, MACADDR
-from sqlalchemy import distinct, desc
+from sqlalchemy import distinct
 from sqlalchemy.sql import func
 
-from . import db, id_column, get_db_binding
+from . import db, id_column, get_db_binding, SnapshotMothods, SnapshotRetention, snapshot_index
 
 DB_BINDING = get_db_binding(__name__)
 
@@ -102,7 +102,7 @@ class Instance(db.Model):
         }
 
 
-class Snapshot(db.Model):
+class Snapshot(db.Model, SnapshotMothods):
     """A snapshot of the world."""
     __bind_key__ = DB_BINDING
     id = id_column()
@@ -257,17 +257,15 @@ class InstanceState(db.Model):
         # This retrieves all InstanceState.id and Snapshot.ts in order
         # to get the latest state and calculate span at once.
         # This sacrifices memory usage to avoid multiple database hit.
-        query = db.session.query(InstanceState).join(Snapshot).\
-            filter(InstanceState.snapshot_id == Snapshot.id).\
+        # ts of snapshots come from the in-memory index instead of a join.
+        query = InstanceState.query.\
+            filter(Snapshot.id_in(InstanceState.snapshot_id, start_ts, end_ts)).\
             filter(InstanceState.instance_id == instance_id).\
-            order_by(desc(Snapshot.ts))
+            with_entities(InstanceState.id, InstanceState.snapshot_id)
 
-        if start_ts > 0:
-            query = query.filter(Snapshot.ts >= start_ts)
-        if end_ts > 0:
-            query = query.filter(Snapshot.ts < end_ts)
-
-        timely_states = query.with_entities(InstanceState.id, Snapshot.ts)
+        index = snapshot_index(Snapshot)
+        timely_states = sorted(((state_id, index.ts(snapshot_id)) for state_id, snapshot_id in query),
+                               key=lambda state: state[1], reverse=True)
         latest_state = InstanceState.query.get(timely_states[0][0])
         state = {"server": latest_state.name}
         # state["span"] is the difference between mapped snapshots
@@ -344,12 +342,18 @@ class Summary():
             filter(AvailabilityZone.name.like("sa%")).\
             with_entities(Hypervisor.id).subquery()
 
-        self.query = BaseQuery([Snapshot, InstanceState], db.session()).\
-            filter(Snapshot.ts >= start_ts, Snapshot.ts < end_ts).\
-            filter(InstanceState.snapshot_id == Snapshot.id).\
+        self.query = BaseQuery([InstanceState], db.session()).\
+            filter(Snapshot.id_in(InstanceState.snapshot_id, start_ts, end_ts)).\
             with_entities(InstanceState.instance_id).\
             distinct(InstanceState.instance_id).\
             filter(InstanceState.hypervisor_id.in_(az_query))
 
     def value(self):
         return [item[0] for item in self.query.all()]
+
+
+# The latest state and addresses of an instance in a bucket are kept
+SNAPSHOT_RETENTION = SnapshotRetention(Snapshot, [
+    (InstanceState, ("instance_id", ), ()),
+    (IPAddressMapping, ("instance_id", "address_id"), ()),
+    (MACAddressMapping, ("instance_id", "address_id"), ())])
@@ -1,5 +1,6 @@
-from sqlalchemy.sql import func
-from . import db, id_column, to_dict, SnapshotMothods
+from sqlalchemy.dialects.postgresql import UUID
+from . import db, id_column, ts_column, to_dict, SnapshotMothods, DailyRollup, MonthlyPartitions, \
+    SnapshotRetention, DimensionNames
 
 
 class Account(db.Model):
@@ -30,6 +31,7 @@ class Usage(db.Model):
     quota = db.Column(db.BigInteger)
     account_id = db.Column(None, db.ForeignKey("account.id"), nullable=False)
     snapshot_id = db.Column(None, db.ForeignKey("snapshot.id"), nullable=False)
+    ts = ts_column()
 
     def json(self):
         """JSON"""
@@ -42,17 +44,9 @@ class Usage(db.Model):
 
         Maximal usage of the period is returned.
         """
-        id_query = Snapshot.id_between(start_ts, end_ts)
+        query = USAGE_ROLLUP.summary(start_ts, end_ts)
 
-        query = cls.query.filter(cls.snapshot_id.in_(id_query)).\
-            group_by(cls.account_id).\
-            with_entities(cls.account_id,
-                          func.max(cls.quota),
-                          func.max(cls.bytes),
-                          func.max(cls.containers),
-                          func.max(cls.objects))
-
-        accounts = dict(Account.query.with_entities(Account.id, Account.openstack_id).all())
+        accounts = ACCOUNT_NAMES
 
         fields = ['openstack_id', 'quota', 'bytes', 'containers', 'objects']
         rslt = []
@@ -60,3 +54,23 @@ class Usage(db.Model):
         for q in query.all():
             rslt.append(dict(zip(fields, (accounts[q[0]], q[1], q[2], q[3], q[4]))))
         return rslt
+
+
+class DailyUsage(db.Model):
+    """Daily maxima of Usage by account"""
+    day = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(UUID, primary_key=True)
+    quota = db.Column(db.BigInteger)
+    bytes = db.Column(db.BigInteger, nullable=False)
+    containers = db.Column(db.Integer, nullable=False)
+    objects = db.Column(db.Integer, nullable=False)
+
+
+USAGE_ROLLUP = DailyRollup(
+    Usage, DailyUsage, ("account_id", ),
+    (("quota", "max"), ("bytes", "max"), ("containers", "max"), ("objects", "max")))
+USAGE_PARTITIONS = MonthlyPartitions(Usage)
+SNAPSHOT_RETENTION = SnapshotRetention(Snapshot, [(Usage, USAGE_ROLLUP.keys, USAGE_ROLLUP.columns)])
+
+ACCOUNT_NAMES = DimensionNames(
+    Account, lambda: dict(Account.query.with_entities(Account.id, Account.openstack_id)))
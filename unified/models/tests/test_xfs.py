@@ -2,7 +2,7 @@ import time
 import datetime
 import unittest
 
-from ...models.xfs import Filesystem, Usage, Owner
+from ...models.xfs import Filesystem, Host, Usage, Owner, FILESYSTEM_NAMES
 from ...tests import now, now_minus_24hrs
 
 
@@ -40,15 +40,12 @@ class OwnerTestCase(unittest.TestCase):
         self.owners = Owner.query.limit(10)
 
     def test_file_systems(self):
-        old = None
-        for owner in self.owners:
-            fs = owner._get_file_systems()
-            self.assertTrue(isinstance(fs, dict))
-            self.assertGreaterEqual(len(fs.keys()), 0)
-            if old:
-                self.assertEqual(old, fs)
-            else:
-                old = fs
+        fs = FILESYSTEM_NAMES.refresh()
+        self.assertTrue(isinstance(fs, dict))
+        self.assertEqual(len(fs), Filesystem.query.count())
+        for filesystem in Filesystem.query.limit(10):
+            self.assertEqual(FILESYSTEM_NAMES[filesystem.id],
+                             (Host.query.get(filesystem.host_id).name, filesystem.name))
 
     def test_now(self):
         for owner in self.owners:
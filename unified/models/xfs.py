@@ -3,7 +3,8 @@ from sqlalchemy.sql import func
 from sqlalchemy import UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 
-from . import db, id_column, SnapshotMothods
+from . import db, id_column, ts_column, SnapshotMothods, DailyRollup, MonthlyPartitions, \
+    SnapshotRetention, DimensionNames, fetch_rows
 
 # Days between start_ts and end_ts to switch from filtering owner locally
 # to remotely in Owner.summarise. This is very ad-hoc and tested with
@@ -21,22 +22,10 @@ class Owner(db.Model):
         """Jsonify"""
         return {"id": self.id, "name": self.name}
 
-    @classmethod
-    def _get_file_systems(cls):
-        """Get a dict with filesystem id as keys and host and filesystem names as values"""
-        if not hasattr(cls, '_fs_dict'):
-            fq = Filesystem.query.join(Host).\
-                with_entities(Filesystem.id, Host.name, Filesystem.name).all()
-            cls._fs_dict = {}
-            for fs in fq:
-                cls._fs_dict[fs[0]] = fs[1:]
-
-        return cls._fs_dict
-
-    def _remote_filter(self, id_query):
+    def _remote_filter(self, ts_criterion):
         # Do remote owner filter because planer can efficiently find
         # relevant usage records
-        query = Usage.query.filter(Usage.snapshot_id.in_(id_query)).\
+        query = Usage.query.filter(ts_criterion).\
             filter(Usage.owner_id == self.id).\
             group_by(Usage.filesystem_id).\
             with_entities(Usage.filesystem_id,
@@ -45,7 +34,7 @@ class Owner(db.Model):
                           func.max(Usage.usage).label('usage'))
 
         fields = ['host', 'filesystem', 'soft', 'hard', 'usage']
-        file_systems = self._get_file_systems()
+        file_systems = FILESYSTEM_NAMES
         rslt = []
 
         for q in query.all():
@@ -54,10 +43,10 @@ class Owner(db.Model):
             rslt.append(dict(zip(fields, mappings)))
         return rslt
 
-    def _local_filter(self, id_query):
+    def _local_filter(self, ts_criterion):
         # Do local owner filter because planer chooses to use bitmapAnd when
         # fewer snapshots involved which is slow
-        query = Usage.query.filter(Usage.snapshot_id.in_(id_query)).\
+        query = Usage.query.filter(ts_criterion).\
             group_by(Usage.owner_id, Usage.filesystem_id).\
             with_entities(Usage.owner_id, Usage.filesystem_id,
                           func.max(Usage.soft).label('soft'),
@@ -65,7 +54,7 @@ class Owner(db.Model):
                           func.max(Usage.usage).label('usage'))
 
         fields = ['host', 'filesystem', 'soft', 'hard', 'usage']
-        file_systems = self._get_file_systems()
+        file_systems = FILESYSTEM_NAMES
         rslt = []
 
         for q in query.all():
@@ -81,29 +70,29 @@ class Owner(db.Model):
 
         Maximal usage of the period is returned. Grouped by filesystem
         """
-        id_query = Snapshot.id_between(start_ts, end_ts)
+        ts_criterion = Snapshot.ts_between(Usage.ts, start_ts, end_ts)
         date_window = timedelta(seconds=(end_ts - start_ts))
 
         if date_window.total_seconds() == 0 or abs(date_window.days) >= CUT_OFF:
-            return self._remote_filter(id_query)
+            return self._remote_filter(ts_criterion)
         else:
-            return self._local_filter(id_query)
+            return self._local_filter(ts_criterion)
 
     def list(self, start_ts=0, end_ts=0):
         """"Gets a list of usages between start_ts and end_ts.
         """
-        snapshots = Snapshot.between(start_ts, end_ts)
-        query = Usage.query.join(snapshots).\
+        query = Usage.query.\
+            filter(Snapshot.ts_between(Usage.ts, start_ts, end_ts)).\
             filter(Usage.owner_id == self.id).\
-            order_by(Usage.filesystem_id, snapshots.c.ts).\
+            order_by(Usage.filesystem_id, Usage.ts).\
             with_entities(Usage.filesystem_id,
-                          snapshots.c.ts,
+                          Usage.ts,
                           Usage.soft,
                           Usage.hard,
                           Usage.usage)
 
         fields = ['ts', 'host', 'soft', 'hard', 'usage']
-        file_systems = self._get_file_systems()
+        file_systems = FILESYSTEM_NAMES
         rslt = {}
 
         for q in query.all():
@@ -145,10 +134,9 @@ class Filesystem(db.Model):
 
         Maximal usage of the period is returned.
         """
-        snapshot_ids = Snapshot.id_between(start_ts, end_ts)
         query = Usage.query.join(Owner).\
             filter(Usage.filesystem_id == self.id).\
-            filter(Usage.snapshot_id.in_(snapshot_ids)).\
+            filter(Snapshot.ts_between(Usage.ts, start_ts, end_ts)).\
             group_by(Owner.name).\
             with_entities(Owner.name,
                           func.max(Usage.soft).label('soft'),
@@ -158,22 +146,28 @@ class Filesystem(db.Model):
         fields = ['owner', 'soft', 'hard', 'usage']
         return [dict(zip(fields, q)) for q in query.all()]
 
-    def list(self, start_ts=0, end_ts=0):
-        """"Gets usages between start_ts and end_ts.
+    def iter_list(self, start_ts=0, end_ts=0, stream=True):
+        """"Iterates over usages between start_ts and end_ts.
         """
-        snapshots = Snapshot.between(start_ts, end_ts)
-        query = Usage.query.join(snapshots).\
+        query = Usage.query.\
+            filter(Snapshot.ts_between(Usage.ts, start_ts, end_ts)).\
             filter(Usage.filesystem_id == self.id).\
             join(Owner).\
-            order_by(snapshots.c.ts).\
-            with_entities(snapshots.c.ts,
+            order_by(Usage.ts).\
+            with_entities(Usage.ts,
                           Owner.name,
                           Usage.soft,
                           Usage.hard,
                           Usage.usage)
 
         fields = ['ts', 'owner', 'soft', 'hard', 'usage']
-        return [dict(zip(fields, q)) for q in query.all()]
+        for q in fetch_rows(query, stream):
+            yield dict(zip(fields, q))
+
+    def list(self, start_ts=0, end_ts=0):
+        """"Gets usages between start_ts and end_ts.
+        """
+        return list(self.iter_list(start_ts, end_ts, stream=False))
 
 
 class Usage(db.Model):
@@ -194,6 +188,7 @@ class Usage(db.Model):
                               db.ForeignKey("filesystem.id"),
                               nullable=False,
                               index=True)
+    ts = ts_column()
 
     def json(self):
         """Jsonify"""
@@ -213,25 +208,13 @@ class Usage(db.Model):
 
         Maximal usage of the period is returned.
         """
-        id_query = Snapshot.id_between(start_ts, end_ts)
-
         # 1. soft and hard quotas are not changed very often
         # 2. Record number of Host, Filesystem and Owner are relatively very small,
         # link them in code to avoid expand usage rows whose number is very very high
-        query = Usage.query.filter(Usage.snapshot_id.in_(id_query)).\
-            group_by(Usage.filesystem_id, Usage.owner_id).\
-            with_entities(Usage.filesystem_id, Usage.owner_id,
-                          func.max(Usage.soft).label('soft'),
-                          func.max(Usage.hard).label('hard'),
-                          func.max(Usage.usage).label('usage'))
-
-        fq = Filesystem.query.join(Host).\
-            with_entities(Filesystem.id, Host.name, Filesystem.name).all()
-        file_systems = {}
-        for fs in fq:
-            file_systems[fs[0]] = fs[1:]
+        query = USAGE_ROLLUP.summary(start_ts, end_ts)
 
-        owners = dict(Owner.query.with_entities(Owner.id, Owner.name).all())
+        file_systems = FILESYSTEM_NAMES
+        owners = OWNER_NAMES
 
         fields = ['host', 'filesystem', 'owner', 'soft', 'hard', 'usage']
         rslt = []
@@ -260,3 +243,27 @@ class Snapshot(db.Model, SnapshotMothods):
             "host": self.host_id,
             "message": self.message
         }
+
+
+class DailyUsage(db.Model):
+    """Daily maxima of Usage by filesystem and owner"""
+    day = db.Column(db.Integer, primary_key=True)
+    filesystem_id = db.Column(UUID, primary_key=True)
+    owner_id = db.Column(UUID, primary_key=True)
+    soft = db.Column(db.BigInteger, nullable=False)
+    hard = db.Column(db.BigInteger, nullable=False)
+    usage = db.Column(db.BigInteger, nullable=False)
+
+
+USAGE_ROLLUP = DailyRollup(Usage, DailyUsage, ("filesystem_id", "owner_id"),
+                           (("soft", "max"), ("hard", "max"), ("usage", "max")))
+USAGE_PARTITIONS = MonthlyPartitions(Usage)
+# Snapshots are per host
+SNAPSHOT_RETENTION = SnapshotRetention(
+    Snapshot, [(Usage, USAGE_ROLLUP.keys, USAGE_ROLLUP.columns)], group=("host_id", ))
+
+# Host and filesystem names of filesystems
+FILESYSTEM_NAMES = DimensionNames(Filesystem, lambda: {
+    row[0]: row[1:] for row in
+    Filesystem.query.join(Host).with_entities(Filesystem.id, Host.name, Filesystem.name)})
+OWNER_NAMES = DimensionNames(Owner, lambda: dict(Owner.query.with_entities(Owner.id, Owner.name)))
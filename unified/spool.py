@@ -0,0 +1,128 @@
+"""A durable local queue of ingest payloads.
+
+   Payloads are written to files in a directory and jobs are tracked in a
+   SQLite database next to them, so they survive restarts and can be
+   drained by threads of any worker process or by a separate process.
+"""
+
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import threading
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    id TEXT PRIMARY KEY,
+    endpoint TEXT NOT NULL,
+    path TEXT NOT NULL,
+    query TEXT NOT NULL,
+    content_type TEXT,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT
+)
+"""
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class Spool(object):
+    """Jobs of ingest payloads in directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.database = os.path.join(directory, "jobs.sqlite")
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(SCHEMA)
+
+    def _connection(self):
+        """A connection of the current thread. As a context manager it commits."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.database, timeout=60, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return _Transaction(connection)
+
+    def payload_path(self, job_id):
+        return os.path.join(self.directory, "%s.payload" % job_id)
+
+    def put(self, stream, endpoint, path, query, content_type=None):
+        """Save the payload read from stream as a queued job, return its id."""
+        job_id = str(uuid.uuid4())
+        partial = self.payload_path(job_id) + ".part"
+        with open(partial, "wb") as payload:
+            shutil.copyfileobj(stream, payload, COPY_BUFFER_SIZE)
+            payload.flush()
+            os.fsync(payload.fileno())
+        os.rename(partial, self.payload_path(job_id))
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO job (id, endpoint, path, query, content_type, status, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, endpoint, path, query, content_type, QUEUED, time.time()))
+        return job_id
+
+    def claim(self):
+        """Mark the oldest queued job running and return it, None if none is queued."""
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT * FROM job WHERE status = ? ORDER BY created LIMIT 1",
+                (QUEUED, )).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE job SET status = ?, started = ? WHERE id = ?",
+                               (RUNNING, time.time(), row["id"]))
+        return dict(row, status=RUNNING)
+
+    def finish(self, job_id, error=None):
+        """Record the end of a job. Payloads of done jobs are removed."""
+        with self._connection() as connection:
+            connection.execute("UPDATE job SET status = ?, finished = ?, error = ? WHERE id = ?",
+                               (FAILED if error else DONE, time.time(), error, job_id))
+        if not error:
+            os.remove(self.payload_path(job_id))
+
+    def get(self, job_id):
+        """Status of a job as a dict, None if it is unknown."""
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT id, status, created, started, finished, error FROM job WHERE id = ?",
+                (job_id, )).fetchone()
+        return dict(row) if row else None
+
+    def requeue(self, older_than):
+        """Queue again jobs which have been running longer than older_than seconds.
+
+           They were left by a process which stopped. Return the number of them.
+        """
+        with self._connection() as connection:
+            cursor = connection.execute(
+                "UPDATE job SET status = ?, started = NULL WHERE status = ? AND started < ?",
+                (QUEUED, RUNNING, time.time() - older_than))
+        return cursor.rowcount
+
+
+class _Transaction(object):
+    """BEGIN IMMEDIATE on enter, so claims of processes do not interleave."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
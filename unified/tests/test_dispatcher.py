@@ -0,0 +1,81 @@
+import os
+import sys
+import logging
+import unittest
+
+from werkzeug.test import Client
+
+import dispatcher
+
+from . import HEADERS
+from .. import app
+
+PACKAGE = app.config["ERSA_REPORTING_PACKAGE"]
+
+
+class DispatcherTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        settings = os.environ["APP_SETTINGS"]
+        cls.client = Client(dispatcher.create_application({
+            "/first": (PACKAGE, settings),
+            "second": (PACKAGE, settings),
+        }))
+
+    def test_mounted(self):
+        for prefix in ("/first", "/second"):
+            rv = self.client.get(prefix + "/ping")
+            self.assertEqual(rv.status_code, 200)
+        rv = self.client.get("/third/ping")
+        self.assertEqual(rv.status_code, 404)
+
+    def test_separate_applications(self):
+        apps = self.client.application.mounts
+        self.assertIsNot(apps["/first"], apps["/second"])
+        self.assertIsNot(apps["/first"], app)
+        self.assertEqual(apps["/first"].config["ERSA_REPORTING_PACKAGE"], PACKAGE)
+
+    def test_auth(self):
+        rv = self.client.get("/first/input")
+        self.assertEqual(rv.status_code, 403)
+        rv = self.client.get("/first/input?count=1", headers=HEADERS)
+        self.assertEqual(rv.status_code, 200)
+
+    def test_statements_counted_once(self):
+        rv = self.client.get("/second/input?count=1", headers=HEADERS)
+        self.assertIn('desc="statements=1"', rv.headers["Server-Timing"])
+
+    def test_engines_shared(self):
+        first, second = (self.client.application.mounts[prefix] for prefix in ("/first", "/second"))
+        self.assertIs(first.extensions["sqlalchemy"].db.get_engine(first),
+                      second.extensions["sqlalchemy"].db.get_engine(second))
+
+    def test_log_handlers_shared(self):
+        first, second = (sys.modules[dispatcher.module_name(prefix) + ".apis"] for prefix in ("/first", "/second"))
+        targets = [handler.targets for handler in first.top_logger.handlers + second.top_logger.handlers]
+        self.assertEqual(len(targets), 2)
+        self.assertIs(targets[0][0], targets[1][0])
+
+    def test_slow_queries_logged_by_own_package(self):
+        modules = [sys.modules[dispatcher.module_name(prefix) + ".apis"] for prefix in ("/first", "/second")]
+        records = {module: [] for module in modules}
+        handlers = {}
+        for module in modules:
+            handlers[module] = logging.Handler()
+            handlers[module].emit = records[module].append
+            module.slow_query_logger.addHandler(handlers[module])
+            module.SLOW_QUERY_SECONDS = 0
+        try:
+            rv = self.client.get("/second/input?count=1", headers=HEADERS)
+            self.assertEqual(rv.status_code, 200)
+        finally:
+            for module in modules:
+                module.SLOW_QUERY_SECONDS = module.app.config.get("SLOW_QUERY_SECONDS", 1.0)
+                module.slow_query_logger.removeHandler(handlers[module])
+        self.assertEqual(records[modules[0]], [])
+        self.assertTrue(records[modules[1]])
+        self.assertTrue(all(record.args[1] == "inputresource" for record in records[modules[1]]))
+
+    def test_mounted_twice(self):
+        with self.assertRaises(ValueError):
+            dispatcher.load_package("/first", PACKAGE, os.environ["APP_SETTINGS"])
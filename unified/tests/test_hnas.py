@@ -16,8 +16,8 @@ class HNASTestCase(unittest.TestCase):
         for route in app.url_map.iter_rules():
             rule = route.rule
             # top objects' have pattern of /blar
-            # ingest only accept PUT and OPTIONS
-            if rule not in ('/static/<path:filename>', '/ingest') and \
+            # ingest and batch do not accept GET, metrics are not JSON
+            if rule not in ('/static/<path:filename>', '/ingest', '/metrics', '/batch') and \
                     all(t not in rule for t in ('list', 'summary')):
                 print('Testing %s' % rule)
                 resp = get('%s?count=10' % rule)
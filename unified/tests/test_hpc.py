@@ -16,8 +16,8 @@ class HPCTestCase(unittest.TestCase):
         for route in app.url_map.iter_rules():
             rule = route.rule
             # top objects' have pattern of /blar
-            # ingest only accept PUT and OPTIONS
-            if rule not in ('/static/<path:filename>', '/ingest') and 'summary' not in rule:
+            # ingest and batch do not accept GET, metrics are not JSON
+            if rule not in ('/static/<path:filename>', '/ingest', '/metrics', '/batch') and 'summary' not in rule:
                 print('Testing %s' % rule)
                 resp = get('%s?count=10' % rule)
                 data = json.loads(resp.data)
@@ -47,3 +47,22 @@ class HPCTestCase(unittest.TestCase):
             self.assertEqual(resp.status_code, 200)
             data = json.loads(resp.data)
             print(data)
+
+    def test_job_list_stream(self):
+        query = '/job/list?start=%s&end=%s' % (now_minus_24hrs, now)
+        expected = json.loads(get(query).data)
+
+        resp = get(query + '&stream=json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data), expected)
+
+        resp = get(query + '&stream=ndjson')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in resp.data.decode('utf-8').splitlines()]
+        self.assertEqual(rows, expected)
+
+    def test_collection_stream(self):
+        expected = json.loads(get('/job?count=3&page=2').data)
+        resp = get('/job?count=3&page=2&stream=json')
+        self.assertEqual(json.loads(resp.data), expected)
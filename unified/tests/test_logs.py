@@ -0,0 +1,53 @@
+import os
+import logging
+import unittest
+
+from ..logs import BackgroundHandler
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+class BackgroundHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.target = ListHandler()
+        self.logger = logging.getLogger('unified.tests.logs')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.logger.handlers = []
+
+    def test_written_in_background(self):
+        handler = BackgroundHandler(self.target)
+        self.logger.addHandler(handler)
+        self.logger.info('value %s', 42)
+        handler.stop()
+        self.assertEqual(self.target.messages, ['value 42'])
+
+    def test_full_queue_drops(self):
+        handler = BackgroundHandler(self.target, queue_size=1)
+        # As if started but nothing reads the queue
+        handler.pid = os.getpid()
+        self.logger.addHandler(handler)
+        self.logger.info('kept')
+        self.logger.info('dropped')
+        self.assertEqual(handler.dropped, 1)
+
+    def test_lazy_arguments(self):
+        class Expensive(object):
+            formatted = False
+
+            def __str__(self):
+                Expensive.formatted = True
+                return 'expensive'
+
+        self.logger.addHandler(BackgroundHandler(self.target))
+        self.logger.debug('value %s', Expensive())
+        self.assertFalse(Expensive.formatted)
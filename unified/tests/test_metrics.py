@@ -0,0 +1,37 @@
+import unittest
+
+from ..metrics import Registry, Counter, Histogram, Gauge
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.register(Counter('requests_total', 'Requests', ('resource',)))
+        counter.inc('usage')
+        counter.inc('usage', amount=2)
+        text = self.registry.render()
+        self.assertIn('# TYPE requests_total counter', text)
+        self.assertIn('requests_total{resource="usage"} 3.0', text)
+
+    def test_histogram(self):
+        histogram = self.registry.register(Histogram('seconds', 'Seconds', ('resource',), buckets=(1, 5)))
+        histogram.observe(0.5, 'usage')
+        histogram.observe(1, 'usage')
+        histogram.observe(7, 'usage')
+        lines = self.registry.render().splitlines()
+        self.assertIn('seconds_bucket{resource="usage",le="1"} 2.0', lines)
+        self.assertIn('seconds_bucket{resource="usage",le="5"} 2.0', lines)
+        self.assertIn('seconds_bucket{resource="usage",le="+Inf"} 3.0', lines)
+        self.assertIn('seconds_count{resource="usage"} 3.0', lines)
+        self.assertIn('seconds_sum{resource="usage"} 8.5', lines)
+
+    def test_gauge(self):
+        self.registry.register(Gauge('hits', 'Hits', ('cache',), lambda: {('auth',): 4}))
+        self.assertIn('hits{cache="auth"} 4.0', self.registry.render())
+
+    def test_label_escape(self):
+        counter = self.registry.register(Counter('c', 'C', ('path',)))
+        counter.inc('a"b')
+        self.assertIn('c{path="a\\"b"} 1.0', self.registry.render())
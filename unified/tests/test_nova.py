@@ -2,7 +2,7 @@ import unittest
 from flask import json
 
 from ..apis.nova import app
-from . import client_get
+from . import client_get, now
 
 get = client_get(app)
 
@@ -16,8 +16,8 @@ class NovaTestCase(unittest.TestCase):
         for route in app.url_map.iter_rules():
             rule = route.rule
             # top objects' have pattern of /blar
-            # ingest only accept PUT and OPTIONS
-            if rule not in ('/static/<path:filename>', '/ingest', '/instance', '/summary', '/instance/<id>/latest'):
+            # ingest and batch do not accept GET, metrics are not JSON
+            if rule not in ('/static/<path:filename>', '/ingest', '/metrics', '/batch', '/instance', '/summary', '/instance/<id>/latest'):
                 print('Testing %s' % rule)
                 resp = get('%s?count=10' % rule)
                 data = json.loads(resp.data)
@@ -42,6 +42,20 @@ class NovaTestCase(unittest.TestCase):
         resp_data = json.loads(resp.data)
         self.assertEqual(resp_data, {'items': [], 'page': 1, 'pages': 0, 'total': 0})
 
+    def test_summary_total(self):
+        rule = '/summary?start=0&end=%s&distinct=&count=1' % now
+        resp = get('%s&total=none' % rule)
+        self.assertEqual(resp.status_code, 200)
+        resp_data = json.loads(resp.data)
+        self.assertIsNone(resp_data['total'])
+        self.assertEqual(len(resp_data['items']), 1)
+
+        resp = get('%s&total=estimate' % rule)
+        self.assertEqual(resp.status_code, 200)
+        resp_data = json.loads(resp.data)
+        self.assertTrue(resp_data['estimate'])
+        self.assertIsInstance(resp_data['total'], int)
+
     def test_latest_state(self):
         resp = get('/flavor?count=1')
         flavor_id = json.loads(resp.data)[0]['id']
@@ -1,4 +1,9 @@
+import time
 import unittest
+import importlib
+import threading
+
+import psycopg2.extensions
 
 from ..apis import instance_method
 
@@ -23,3 +28,630 @@ class MethodsTestCase(unittest.TestCase):
         data = instance_method(Filesystem, 'list', 'aeb7cf1c-a842-4592-82e9-55d2dad00150')
         self.assertTrue(isinstance(data, list))
         self.assertEqual(len(data), 0)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, packages=()):
+        self.status_code = status_code
+        self.packages = packages
+
+    def json(self):
+        return {"endpoints": [{"name": name} for name in self.packages]}
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        response = self.responses[params["secret"]]
+        return response.pop(0) if isinstance(response, list) else response
+
+
+class ThreadLocalSessionTestCase(unittest.TestCase):
+    def test_session_per_thread(self):
+        from ..apis import ThreadLocalSession
+        local = ThreadLocalSession()
+        sessions = []
+        for _ in range(2):
+            thread = threading.Thread(target=lambda: sessions.append(local.session))
+            thread.start()
+            thread.join()
+        self.assertIsNot(sessions[0], sessions[1])
+        self.assertIs(local.session, local.session)
+
+
+class AuthCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        from .. import apis
+        self.apis = apis
+        self.session = apis.AUTH_SESSION
+        apis.AUTH_CACHE.clear()
+        apis.AUTH_SESSION = FakeSession({
+            "good": FakeResponse(200, ["xfs", "hnas"]),
+            "bad": FakeResponse(403),
+            "flaky": [FakeResponse(503), FakeResponse(200, ["xfs"])]})
+
+    def tearDown(self):
+        self.apis.AUTH_SESSION = self.session
+        self.apis.AUTH_CACHE.clear()
+
+    def test_accepted_token_is_cached(self):
+        self.assertEqual(self.apis.allowed_packages("good"), frozenset(["xfs", "hnas"]))
+        self.assertEqual(self.apis.allowed_packages("good"), frozenset(["xfs", "hnas"]))
+        self.assertEqual(self.apis.AUTH_SESSION.calls, 1)
+
+    def test_rejected_token_is_cached(self):
+        self.assertEqual(self.apis.allowed_packages("bad"), frozenset())
+        self.assertEqual(self.apis.allowed_packages("bad"), frozenset())
+        self.assertEqual(self.apis.AUTH_SESSION.calls, 1)
+
+    def test_service_error_is_not_cached(self):
+        self.assertEqual(self.apis.allowed_packages("flaky"), frozenset())
+        self.assertEqual(self.apis.allowed_packages("flaky"), frozenset(["xfs"]))
+        self.assertEqual(self.apis.AUTH_SESSION.calls, 2)
+
+
+class CursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        from ..apis import encode_cursor, decode_cursor
+        values = [1452930321, 'aeb7cf1c-a842-4592-82e9-55d2dad00150']
+        self.assertEqual(decode_cursor(encode_cursor(values)), values)
+
+    def test_bad_cursor(self):
+        from werkzeug.exceptions import BadRequest
+        from ..apis import decode_cursor
+        self.assertRaises(BadRequest, decode_cursor, 'not-a-cursor')
+
+
+class FetchRowsTestCase(unittest.TestCase):
+    def tearDown(self):
+        from .. import db
+        db.session.rollback()
+
+    def test_server_side_cursor_when_streamed(self):
+        from .. import db
+        from ..models import Input, fetch_rows
+        query = db.session.query(Input.id)
+        self.assertTrue(fetch_rows(query, True)._execution_options.get("stream_results"))
+        self.assertIsInstance(fetch_rows(query, False), list)
+
+
+class SerializerTestCase(unittest.TestCase):
+    def test_compile_plain_json(self):
+        from ..models import compile_serializer
+
+        class Plain(object):
+            def json(self):
+                return {"id": self.id, "owner": self.owner_id}
+
+        serializer = compile_serializer(Plain)
+        self.assertEqual(serializer.keys, ["id", "owner"])
+        self.assertEqual(serializer.attributes, ["id", "owner_id"])
+        self.assertEqual(serializer(("a", "b")), {"id": "a", "owner": "b"})
+
+    def test_computed_json_not_compiled(self):
+        from ..models import compile_serializer
+
+        class Computed(object):
+            def json(self):
+                return {"total": self.used + self.free}
+
+        self.assertIsNone(compile_serializer(Computed))
+
+    def test_same_as_json(self):
+        from ..models import row_serializer
+        from ..models.xfs import Filesystem, Usage
+        for model in (Filesystem, Usage):
+            serializer = row_serializer(model)
+            rows = model.query.with_entities(*serializer.columns).order_by(model.id).limit(10).all()
+            items = model.query.order_by(model.id).limit(10).all()
+            self.assertEqual([serializer(row) for row in rows], [item.json() for item in items])
+
+
+class FakeCursor(object):
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.executed = []
+        self.connection = self
+
+    def cursor(self):
+        return self
+
+    def execute(self, statement, parameters=None):
+        self.executed.append(statement)
+        if self.fail and statement.startswith("EXPLAIN"):
+            raise Exception("syntax error")
+
+    def fetchall(self):
+        return [("Seq Scan on usage",), ("  Filter: (usage >= 3)",)]
+
+    def close(self):
+        pass
+
+
+class SlowQueryTestCase(unittest.TestCase):
+    def test_explain(self):
+        from ..apis import explain
+        cursor = FakeCursor()
+        plan = explain(cursor, "SELECT * FROM usage WHERE usage >= %(usage)s", {"usage": 3})
+        self.assertEqual(plan, "Seq Scan on usage\n  Filter: (usage >= 3)")
+        self.assertTrue(cursor.executed[1].endswith("SELECT * FROM usage WHERE usage >= %(usage)s"))
+        self.assertEqual(cursor.executed[-1], "RELEASE SAVEPOINT explain_slow_query")
+
+    def test_explain_failure_keeps_transaction(self):
+        from ..apis import explain
+        cursor = FakeCursor(fail=True)
+        plan = explain(cursor, "SELECT nonsense", {})
+        self.assertTrue(plan.startswith("EXPLAIN failed"))
+        self.assertIn("ROLLBACK TO SAVEPOINT explain_slow_query", cursor.executed)
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+    def setUp(self):
+        from .. import apis
+        self.apis = apis
+        self.settings = apis.SLOW_QUERY_SECONDS, apis.SLOW_QUERY_SAMPLE, apis.SLOW_QUERY_EXPLAIN
+        apis.SLOW_QUERY_SECONDS, apis.SLOW_QUERY_SAMPLE, apis.SLOW_QUERY_EXPLAIN = 0, 1, True
+
+    def tearDown(self):
+        from .. import db
+        self.apis.SLOW_QUERY_SECONDS, self.apis.SLOW_QUERY_SAMPLE, self.apis.SLOW_QUERY_EXPLAIN = self.settings
+        db.session.rollback()
+
+    def test_outside_transaction(self):
+        from .. import db
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            self.assertEqual(connection.execute("SELECT 1").scalar(), 1)
+
+    def test_failing_explain(self):
+        from .. import db
+        cursor = FakeCursor()
+        cursor.autocommit = False
+        cursor.get_transaction_status = lambda: psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        cursor.execute = None
+        # Logged, not raised
+        self.apis.log_slow_query(cursor, "SELECT 1", {}, 1.0, False)
+        self.assertEqual(db.session.execute("SELECT 1").scalar(), 1)
+
+
+class StatementCountTestCase(unittest.TestCase):
+    def tearDown(self):
+        from .. import db
+        db.session.rollback()
+
+    def test_failed_statement_not_counted(self):
+        from flask import g
+        from sqlalchemy import event
+        from sqlalchemy.exc import ProgrammingError
+        from .. import app, db
+        from ..apis import _end_statement
+        self.assertTrue(event.contains(db.engine, "after_cursor_execute", _end_statement))
+        with app.test_request_context("/"):
+            g.db_statements, g.db_seconds = 0, 0.0
+            with self.assertRaises(ProgrammingError):
+                db.session.execute("SELECT no_such_column FROM input")
+            db.session.rollback()
+            time.sleep(0.2)
+            db.session.execute("SELECT 1")
+            self.assertEqual(g.db_statements, 1)
+            self.assertLess(g.db_seconds, 0.2)
+
+
+class EstimateCountTestCase(unittest.TestCase):
+    def test_explain_uses_bind_of_tables(self):
+        from ..models import Explain
+        from sqlalchemy import MetaData, Table, Column, Integer, create_engine
+        from sqlalchemy.orm import Session
+        table = Table("bound", MetaData(), Column("id", Integer, primary_key=True))
+        default, bound = create_engine("postgresql://"), create_engine("postgresql://")
+        session = Session(bind=default, binds={table: bound})
+        self.assertIs(session.get_bind(clause=Explain(table.select())), bound)
+
+    def test_estimate(self):
+        from .. import app
+        from ..models import estimate_count
+        module = importlib.import_module("unified.models." + app.config["ERSA_REPORTING_PACKAGE"])
+        model = getattr(module, "Snapshot", None)
+        if model is None:
+            self.skipTest("Package has no snapshots")
+        self.assertGreaterEqual(estimate_count(model.query), 0)
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """The primary database stands in for its replica."""
+
+    def setUp(self):
+        from .. import apis, app, db
+        self.apis, self.app, self.db = apis, app, db
+        app.config["SQLALCHEMY_REPLICA_URI"] = app.config["SQLALCHEMY_DATABASE_URI"]
+        apis._REPLICA_STATES.clear()
+
+    def tearDown(self):
+        del self.app.config["SQLALCHEMY_REPLICA_URI"]
+        self.db._replica_engines.clear()
+        self.apis._REPLICA_STATES.clear()
+
+    def test_get_reads_from_replica(self):
+        from ..models import Input
+        replica = self.db.get_replica_engine(self.app)
+        self.assertIsNot(replica, self.db.engine)
+        with self.app.test_request_context("/input", method="GET"):
+            self.app.preprocess_request()
+            self.assertIs(self.db.session.get_bind(Input.__mapper__), replica)
+            read_only = self.db.session.execute("SHOW transaction_read_only").scalar()
+            self.assertEqual(read_only, "on")
+            self.db.session.remove()
+
+    def test_put_writes_to_primary(self):
+        from ..models import Input
+        with self.app.test_request_context("/input", method="PUT"):
+            self.app.preprocess_request()
+            self.assertIs(self.db.session.get_bind(Input.__mapper__), self.db.engine)
+            self.db.session.remove()
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        from ..models import Input
+        self.apis._REPLICA_STATES[None] = [time.monotonic(), False]
+        with self.app.test_request_context("/input", method="GET"):
+            self.app.preprocess_request()
+            self.assertIs(self.db.session.get_bind(Input.__mapper__), self.db.engine)
+            self.db.session.remove()
+
+    def test_fresh_replica(self):
+        self.assertTrue(self.apis.replica_is_fresh())
+        self.apis.invalidate_summaries()
+        self.assertEqual(self.apis._REPLICA_STATES[None][0], 0.0)
+
+    def test_replica_of_bind(self):
+        from ..models import Input
+        uri = self.app.config["SQLALCHEMY_DATABASE_URI"]
+        binds = self.app.config.get("SQLALCHEMY_BINDS")
+        self.app.config["SQLALCHEMY_BINDS"] = {"other": uri}
+        self.app.config["SQLALCHEMY_REPLICA_BINDS"] = {"other": uri}
+        try:
+            engine = self.db.get_engine(self.app, bind="other")
+            self.assertEqual(self.db.get_bind_key(self.app, engine), "other")
+            self.assertIsNone(self.db.get_bind_key(self.app, self.db.engine))
+            # Without a marker the lag of the replica is unknown
+            self.assertFalse(self.apis.replica_is_fresh("other"))
+            self.apis._REPLICA_STATES.clear()
+            self.apis.REPLICA_MARKERS["other"] = Input
+            self.assertTrue(self.apis.replica_is_fresh("other"))
+        finally:
+            self.apis.REPLICA_MARKERS.pop("other", None)
+            del self.app.config["SQLALCHEMY_REPLICA_BINDS"]
+            self.app.config["SQLALCHEMY_BINDS"] = binds
+
+
+class TsBetweenTestCase(unittest.TestCase):
+    def test_criteria(self):
+        from ..models import SnapshotMothods
+        from sqlalchemy import column
+        ts = column("ts")
+        compiled = str(SnapshotMothods.ts_between(ts, 1, 2))
+        self.assertIn("ts >= :ts_1", compiled)
+        self.assertIn("ts < :ts_2", compiled)
+        self.assertNotIn("<", str(SnapshotMothods.ts_between(ts, 1)))
+        self.assertEqual(str(SnapshotMothods.ts_between(ts)), "true")
+
+
+class DailyRollupTestCase(unittest.TestCase):
+    def setUp(self):
+        from .. import app
+        from ..models import ROLLUPS
+        importlib.import_module("unified.models." + app.config["ERSA_REPORTING_PACKAGE"])
+        if not ROLLUPS:
+            self.skipTest("Package has no rollups")
+        self.rollups = ROLLUPS
+
+    def tearDown(self):
+        from .. import db
+        db.session.rollback()
+
+    def aggregated(self, rollup, start_ts, end_ts):
+        from .. import db
+        from ..models import SnapshotMothods
+        from sqlalchemy import func
+        fact = rollup.fact
+        keys = [getattr(fact, key) for key in rollup.keys]
+        query = db.session.query(*(keys + [getattr(func, function)(getattr(fact, name))
+                                           for name, function in rollup.columns])).\
+            filter(SnapshotMothods.ts_between(fact.ts, start_ts, end_ts)).group_by(*keys)
+        return sorted(tuple(map(str, row)) for row in query)
+
+    def test_summary_matches_facts(self):
+        from .. import db
+        from ..models import DAY
+        from sqlalchemy import func
+        for fact, rollup in self.rollups.items():
+            rollup.rebuild()
+            first, last = db.session.query(func.min(fact.ts), func.max(fact.ts)).one()
+            if first is None:
+                continue
+            for start_ts, end_ts in ((0, 0), (first, 0), (0, last), (first + 1, last),
+                                     (first - first % DAY, last - last % DAY + DAY),
+                                     (first - DAY, last + 1)):
+                summary = sorted(tuple(map(str, row)) for row in rollup.summary(start_ts, end_ts))
+                self.assertEqual(summary, self.aggregated(rollup, start_ts, end_ts))
+
+
+class SnapshotRetentionTestCase(unittest.TestCase):
+    def setUp(self):
+        from .. import app
+        from ..models import RETENTIONS
+        importlib.import_module("unified.models." + app.config["ERSA_REPORTING_PACKAGE"])
+        if not RETENTIONS:
+            self.skipTest("Package has no snapshot retention")
+        self.retentions = RETENTIONS
+
+    def tearDown(self):
+        from .. import db
+        db.session.rollback()
+
+    def daily(self):
+        from .. import db
+        from ..models import ROLLUPS
+        from sqlalchemy import true
+        return {fact: sorted(tuple(map(str, row)) for row in db.session.execute(rollup._aggregated_facts(true())))
+                for fact, rollup in ROLLUPS.items()}
+
+    def test_downsample_keeps_daily_maxima(self):
+        from .. import db
+        from ..models import DAY
+        before = self.daily()
+        # 2035-01-01, after any test data
+        end_ts = 2051222400
+        for retention in self.retentions.values():
+            counts = {fact: fact.query.count() for fact, _, _ in retention.facts}
+            reclaimed = retention.downsample(0, end_ts, DAY)
+            for fact, count in counts.items():
+                self.assertEqual(fact.query.count(), count - reclaimed.get(fact.__tablename__, 0))
+            self.assertEqual(retention.buckets(0, end_ts, DAY), {})
+            self.assertEqual(retention.days(end_ts, DAY), [])
+        db.session.expire_all()
+        self.assertEqual(self.daily(), before)
+
+
+class MonthlyPartitionsTestCase(unittest.TestCase):
+    def tearDown(self):
+        from .. import db
+        db.session.rollback()
+
+    def test_month_range(self):
+        from ..models import month_range
+        self.assertEqual(month_range(1483228800), (1483228800, 1485907200))
+        self.assertEqual(month_range(1485907199), (1483228800, 1485907200))
+        self.assertEqual(month_range(1513000000), (1512086400, 1514764800))
+
+    def test_ensure_commits_separately(self):
+        from .. import app, db
+        from ..models import PARTITIONS, ensure_partitions, month_range
+        importlib.import_module("unified.models." + app.config["ERSA_REPORTING_PACKAGE"])
+        partitions = [partition for partition in PARTITIONS.values() if partition.is_partitioned()]
+        if not partitions:
+            self.skipTest("Package has no partitioned tables")
+        # 2035-01-01, after any test data
+        ts = 2051222400
+        try:
+            ensure_partitions([ts])
+            # Committed apart from the transaction of the session
+            db.session.rollback()
+            for partition in partitions:
+                self.assertIn(partition.name(ts), partition._known)
+                self.assertIn(partition.name(ts), [name for name, _, _ in partition.partitions()])
+        finally:
+            db.session.rollback()
+            for partition in partitions:
+                with db.engine.begin() as connection:
+                    for start in month_range(ts):
+                        partition._known.discard(partition.name(start))
+                        connection.execute('DROP TABLE IF EXISTS "%s"' % partition.name(start))
+
+
+class BulkWriterTestCase(unittest.TestCase):
+    def tearDown(self):
+        from .. import db
+        db.session.rollback()
+
+    def test_client_side_ids(self):
+        from .. import db
+        from ..apis import BulkWriter, identifier
+        from ..models import Input
+        existing = Input(name="bulk-writer-existing")
+        db.session.add(existing)
+        db.session.flush()
+
+        writer = BulkWriter(client_side_ids=True)
+        new_id = writer.dimension(Input, name="bulk-writer-new")
+        self.assertEqual(new_id, identifier(("input", ("name", "bulk-writer-new"))))
+        self.assertIsNone(Input.query.get(new_id))
+        # Rows which exist keep their ids
+        self.assertNotEqual(writer.dimension(Input, name="bulk-writer-existing"), existing.id)
+        writer.write()
+        self.assertEqual(writer.dimension(Input, name="bulk-writer-existing"), existing.id)
+        self.assertEqual(Input.query.get(new_id).name, "bulk-writer-new")
+
+        writer = BulkWriter(client_side_ids=True)
+        self.assertEqual(writer.dimension(Input, name="bulk-writer-new"), new_id)
+        for name in ("bulk-writer-fact-1", "bulk-writer-fact-2"):
+            writer.fact(Input, name=name)
+        self.assertEqual(writer.write(), 2)
+        self.assertEqual(Input.query.filter(Input.name.like("bulk-writer-%")).count(), 4)
+
+    def test_server_side_ids(self):
+        from ..apis import BulkWriter
+        from ..models import Input
+        writer = BulkWriter(client_side_ids=False)
+        input_id = writer.dimension(Input, name="bulk-writer-new")
+        self.assertEqual(Input.query.get(input_id).name, "bulk-writer-new")
+        writer.fact(Input, name="bulk-writer-fact")
+        self.assertEqual(writer.write(copy=True), 1)
+        self.assertEqual(Input.query.filter_by(name="bulk-writer-fact").count(), 1)
+
+    def test_copy_escapes_values(self):
+        from ..apis import BulkWriter
+        from ..models import Input
+        names = ["bulk-writer\ttab", "bulk-writer\nline", "bulk-writer\\N", "bulk-writer\\"]
+        writer = BulkWriter(client_side_ids=True)
+        for name in names:
+            writer.fact(Input, name=name)
+        writer.write(copy=True)
+        self.assertEqual(sorted(name for name, in Input.query.filter(Input.name.like("bulk-writer%")).
+                                with_entities(Input.name)), sorted(names))
+
+    def test_dimension_inserted_concurrently(self):
+        from .. import db
+        from ..apis import BulkWriter
+        from ..models import Input
+        writer = BulkWriter(client_side_ids=True)
+        new_id = writer.dimension(Input, name="bulk-writer-race")
+        # Another ingest adds the row after it was looked up
+        lookup = writer._existing
+
+        def late_lookup(model, names, rows):
+            found = lookup(model, names, rows)
+            if not hasattr(self, "winner"):
+                self.winner = Input(name="bulk-writer-race")
+                db.session.add(self.winner)
+                db.session.flush()
+            return found
+
+        writer._existing = late_lookup
+        writer.write()
+        self.assertNotEqual(self.winner.id, new_id)
+        self.assertEqual(writer.dimension(Input, name="bulk-writer-race"), self.winner.id)
+
+
+class DimensionNamesTestCase(unittest.TestCase):
+    def setUp(self):
+        from ..models import DimensionNames, Input
+        self.now = [0.0]
+        self.loads = [0]
+
+        def loader():
+            self.loads[0] += 1
+            return dict(Input.query.with_entities(Input.id, Input.name))
+
+        self.names = DimensionNames(Input, loader, ttl=10, timer=lambda: self.now[0])
+
+    def tearDown(self):
+        from .. import db
+        from ..models import DIMENSION_NAMES
+        DIMENSION_NAMES.remove(self.names)
+        db.session.rollback()
+
+    def test_reload_on_change_only(self):
+        from .. import db
+        from ..models import Input, invalidate_dimension_names
+        self.assertEqual(len(self.names.refresh()), Input.query.count())
+        self.now[0] = 20
+        self.names.refresh()
+        self.assertEqual(self.loads[0], 1)
+
+        row = Input(name="dimension-names-new")
+        db.session.add(row)
+        db.session.flush()
+        self.assertNotIn(row.id, self.names.refresh())
+        invalidate_dimension_names()
+        self.assertEqual(self.names.refresh()[row.id], "dimension-names-new")
+        self.assertEqual(self.loads[0], 2)
+
+    def test_unknown_id(self):
+        from .. import db
+        from ..models import Input
+        self.names.refresh()
+        row = Input(name="dimension-names-new")
+        db.session.add(row)
+        db.session.flush()
+        self.assertEqual(self.names[row.id], "dimension-names-new")
+        with self.assertRaises(KeyError):
+            self.names["00000000-0000-0000-0000-000000000000"]
+
+
+class SummaryCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        from .. import apis
+        self.apis = apis
+        self.retention_age = apis.RETENTION_AGE
+
+    def tearDown(self):
+        self.apis.RETENTION_AGE = self.retention_age
+        self.apis.SUMMARY_CACHE.clear()
+
+    def test_ranges_subject_to_retention_are_mutable(self):
+        from .. import app
+        apis = self.apis
+        importlib.import_module("unified.apis." + app.config["ERSA_REPORTING_PACKAGE"])
+        latest = apis.latest_snapshot_ts()
+        if not latest:
+            self.skipTest("Package has no snapshots")
+        for retention_age, immutable in ((0, True), (time.time() - latest + 86400, False)):
+            apis.RETENTION_AGE = retention_age
+            apis.SUMMARY_CACHE.clear()
+            with app.test_request_context("/input?end=%d" % latest):
+                apis.cached_summary(apis.data_version(), lambda: ["result"], latest)
+            self.assertEqual([entry[1][0] for entry in apis.SUMMARY_CACHE._data.values()], [immutable])
+
+
+class SnapshotIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        from .. import apis, app
+        from ..models import SnapshotIndex
+        importlib.import_module("unified.apis." + app.config["ERSA_REPORTING_PACKAGE"])
+        if apis.SNAPSHOT_MODEL is None:
+            self.skipTest("Package has no snapshots")
+        self.model = apis.SNAPSHOT_MODEL
+        self.now = [0.0]
+        self.index = SnapshotIndex(self.model, ttl=10, timer=lambda: self.now[0])
+
+    def expected(self, start_ts, end_ts):
+        from .. import db
+        query = db.session.query(self.model.id).filter(self.model.ts >= start_ts, self.model.ts < end_ts)
+        return sorted(row[0] for row in query)
+
+    def test_ranges(self):
+        ids = self.index.ids_between()
+        self.assertEqual(len(ids), self.model.query.count())
+        if not ids:
+            return
+        tss = sorted(self.index.ts(snapshot_id) for snapshot_id in ids)
+        self.assertEqual(self.index.latest_ts(), tss[-1])
+        middle = tss[len(tss) // 2]
+        for start_ts, end_ts in ((tss[0], middle), (middle, tss[-1] + 1), (middle, middle)):
+            self.assertEqual(sorted(self.index.ids_between(start_ts, end_ts)),
+                             self.expected(start_ts, end_ts))
+
+    def test_new_snapshots_loaded_after_invalidate(self):
+        tss, ids, ts_by_id = self.index.refresh()
+        if not ids:
+            return
+        # As if the latest snapshots were ingested after the index was loaded
+        known = len([ts for ts in tss if ts < tss[-1]])
+        self.index._data = (tss[:known], ids[:known], {i: ts_by_id[i] for i in ids[:known]})
+        self.index._signature = (known, sum(tss[:known]))
+        self.assertEqual(len(self.index), known)
+        self.index.invalidate()
+        self.assertEqual(self.index.refresh()[1], ids)
+
+    def test_deleted_snapshots_dropped(self):
+        tss, ids, _ = self.index.refresh()
+        if not ids:
+            return
+        # As if an older snapshot was deleted and the latest ingested since
+        known_tss, known_ids = [tss[0] - 1] + tss[:-1], ["00000000-0000-0000-0000-000000000001"] + ids[:-1]
+        self.index._data = (known_tss, known_ids, dict(zip(known_ids, known_tss)))
+        self.index._signature = (len(known_ids), sum(known_tss))
+        self.index.invalidate()
+        self.assertEqual(self.index.refresh()[1], ids)
+
+    def test_ttl(self):
+        self.index.refresh()
+        self.index._data = ([], [], {})
+        self.index._signature = (0, 0)
+        self.now[0] = 5
+        self.assertEqual(len(self.index.ids_between()), 0)
+        self.now[0] = 10
+        self.assertEqual(len(self.index.ids_between()), self.model.query.count())
@@ -0,0 +1,61 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..spool import Spool, QUEUED, RUNNING, DONE, FAILED
+
+
+class SpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spool = Spool(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def put(self, payload=b'[]'):
+        return self.spool.put(io.BytesIO(payload), 'ingestresource', '/ingest',
+                              'name=test', 'application/json')
+
+    def test_put_and_claim(self):
+        job_id = self.put(b'[{"data": 1}]')
+        self.assertEqual(self.spool.get(job_id)['status'], QUEUED)
+        with open(self.spool.payload_path(job_id), 'rb') as payload:
+            self.assertEqual(payload.read(), b'[{"data": 1}]')
+
+        job = self.spool.claim()
+        self.assertEqual(job['id'], job_id)
+        self.assertEqual(job['query'], 'name=test')
+        self.assertEqual(self.spool.get(job_id)['status'], RUNNING)
+        self.assertIsNone(self.spool.claim())
+
+    def test_claim_oldest_first(self):
+        first = self.put()
+        second = self.put()
+        self.assertEqual(self.spool.claim()['id'], first)
+        self.assertEqual(self.spool.claim()['id'], second)
+
+    def test_finish(self):
+        done = self.put()
+        failed = self.put()
+        self.spool.claim()
+        self.spool.claim()
+        self.spool.finish(done)
+        self.spool.finish(failed, error='broken')
+        self.assertEqual(self.spool.get(done)['status'], DONE)
+        self.assertFalse(os.path.exists(self.spool.payload_path(done)))
+        self.assertEqual(self.spool.get(failed)['status'], FAILED)
+        self.assertEqual(self.spool.get(failed)['error'], 'broken')
+        self.assertTrue(os.path.exists(self.spool.payload_path(failed)))
+
+    def test_requeue(self):
+        job_id = self.put()
+        self.spool.claim()
+        self.assertEqual(self.spool.requeue(3600), 0)
+        self.assertEqual(self.spool.requeue(-1), 1)
+        self.assertEqual(self.spool.claim()['id'], job_id)
+
+    def test_unknown(self):
+        self.assertIsNone(self.spool.get('nope'))
@@ -1,8 +1,16 @@
+import io
+import csv
+import gzip
 import unittest
 from flask import json
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 from ..apis.xfs import app
-from . import client_get, now, now_minus_24hrs
+from . import client_get, now, now_minus_24hrs, HEADERS
 
 get = client_get(app)
 
@@ -16,8 +24,8 @@ class XFSTestCase(unittest.TestCase):
         for route in app.url_map.iter_rules():
             rule = route.rule
             # top objects' have pattern of /blar
-            # ingest only accept PUT and OPTIONS
-            if rule not in ('/static/<path:filename>', '/ingest') and 'summary' not in rule and 'list' not in rule:
+            # ingest and batch do not accept GET, metrics are not JSON
+            if rule not in ('/static/<path:filename>', '/ingest', '/metrics', '/batch') and 'summary' not in rule and 'list' not in rule:
                 print('Testing %s' % rule)
                 resp = get('%s?count=10' % rule)
                 data = json.loads(resp.data)
@@ -64,3 +72,160 @@ class XFSTestCase(unittest.TestCase):
                 print(data)
                 self.assertTrue(isinstance(data, list) or isinstance(data, dict))
                 self.assertGreater(len(data), 0)
+
+    def test_keyset_pages(self):
+        resp = get('/usage?count=100000')
+        expected = len(json.loads(resp.data))
+
+        items = []
+        cursor = ''
+        while cursor is not None:
+            resp = get('/usage?count=7&order=-usage&after=%s' % cursor)
+            self.assertEqual(resp.status_code, 200)
+            data = json.loads(resp.data)
+            items.extend(data['items'])
+            cursor = data['next']
+        self.assertEqual(len(items), expected)
+        self.assertEqual(sorted(items, key=lambda i: -i['usage']), items)
+
+    def test_keyset_bad_cursor(self):
+        resp = get('/usage?after=not-a-cursor')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_unknown_order(self):
+        for rule in ('/usage?order=nosuch&after=', '/usage?order=-nosuch'):
+            resp = get(rule)
+            self.assertEqual(resp.status_code, 400)
+
+    def test_fields(self):
+        resp = get('/usage?count=5&fields=owner,usage')
+        self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.data)
+        self.assertGreater(len(data), 0)
+        for item in data:
+            self.assertEqual(set(item.keys()), set(['owner', 'usage']))
+
+        resp = get('/usage?count=5&fields=no_such_field')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_usage_summary_etag(self):
+        rule = '/usage/summary?start=%s&end=%s' % (now_minus_24hrs, now)
+        resp = get(rule)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+
+        resp = get(rule, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+
+        resp = get('%s&count=1' % rule, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_usage_summary_etag_by_representation(self):
+        rule = '/usage/summary?start=%s&end=%s' % (now_minus_24hrs, now)
+        resp = get(rule)
+        etag = resp.headers['ETag']
+        self.assertIn('Accept', resp.headers['Vary'])
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+
+        resp = get(rule, headers={'If-None-Match': etag, 'Accept': 'text/csv'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+        resp = get(rule, headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.status_code, 200)
+
+        resp = get(rule, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertIn('Accept', resp.headers['Vary'])
+
+    def test_usage_summary_cache(self):
+        rule = '/usage/summary?start=%s&end=%s' % (now_minus_24hrs, now)
+        first = get(rule)
+        second = get(rule)
+        self.assertEqual(second.headers['X-Cache'], 'hit')
+        self.assertEqual(json.loads(first.data), json.loads(second.data))
+
+    def test_metrics(self):
+        resp = get('/usage?count=1')
+        self.assertIn('statements=', resp.headers['Server-Timing'])
+
+        resp = get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        text = resp.data.decode('utf-8')
+        self.assertIn('ersa_requests_total{resource="usageresource",method="GET",status="200"}', text)
+        self.assertIn('ersa_db_statements_per_request_count{resource="usageresource",method="GET"}', text)
+
+    def test_batch(self):
+        owners = json.loads(get('/owner?count=2').data)
+        batch = [{'path': '/owner/%s/summary' % owner['id'],
+                  'args': {'start': now_minus_24hrs, 'end': now}} for owner in owners]
+        batch.append({'path': '/usage', 'args': {'filter': 'nope.eq.1'}})
+        batch.append({'path': '/no/such/path'})
+        client = app.test_client()
+        resp = client.post('/batch', data=json.dumps(batch), headers=HEADERS)
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.data)
+        self.assertEqual([result['status'] for result in results], [200] * len(owners) + [400, 404])
+        for owner, result in zip(owners, results):
+            expected = get('/owner/%s/summary?start=%s&end=%s' % (owner['id'], now_minus_24hrs, now))
+            self.assertEqual(result['data'], json.loads(expected.data))
+
+        resp = client.post('/batch', data=json.dumps({'path': '/usage'}), headers=HEADERS)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_batch_after_failed_statement(self):
+        expected = json.loads(get('/usage?count=5').data)
+        self.assertTrue(expected)
+        batch = [{'path': '/usage', 'args': {'filter': 'ts.like.5'}},
+                 {'path': '/usage', 'args': {'count': 5}}]
+        resp = app.test_client().post('/batch', data=json.dumps(batch), headers=HEADERS)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data)[1], {'status': 200, 'data': expected})
+
+    def test_csv(self):
+        expected = json.loads(get('/usage?count=20').data)
+        for rule in ('/usage?count=20', '/usage?count=20&stream=json'):
+            resp = get(rule, headers={'Accept': 'text/csv'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.content_type.startswith('text/csv'))
+            rows = list(csv.DictReader(io.StringIO(resp.data.decode('utf-8'))))
+            self.assertEqual([row['owner'] for row in rows], [item['owner'] for item in expected])
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        expected = json.loads(get('/usage?count=20').data)
+        resp = get('/usage?count=20', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(msgpack.unpackb(resp.data, raw=False), expected)
+
+        resp = get('/usage?count=20&stream=json', headers={'Accept': 'application/msgpack'})
+        self.assertEqual(list(msgpack.Unpacker(io.BytesIO(resp.data), raw=False)), expected)
+
+    def test_gzip(self):
+        expected = json.loads(get('/usage?count=100').data)
+        for rule in ('/usage?count=100', '/usage?count=100&stream=json'):
+            resp = get(rule, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(json.loads(gzip.decompress(resp.data)), expected)
+
+    def test_total(self):
+        resp = get('/usage?count=5')
+        self.assertNotIn('X-Total-Count', resp.headers)
+
+        resp = get('/usage?count=5&total=exact')
+        expected = len(json.loads(get('/usage?count=100000').data))
+        self.assertEqual(int(resp.headers['X-Total-Count']), expected)
+
+        resp = get('/usage?count=5&total=estimate')
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreaterEqual(int(resp.headers['X-Total-Estimate']), 0)
+
+    def test_filter_validation(self):
+        resp = get('/usage?filter=usage.ge.0&filter=owner.ne.null')
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(len(json.loads(resp.data)), 0)
+
+        for expression in ['nope.eq.1', 'usage.nope.1', 'usage.ge.abc', 'owner.eq.abc', 'usage']:
+            resp = get('/usage?filter=%s' % expression)
+            self.assertEqual(resp.status_code, 400)
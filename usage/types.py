@@ -51,6 +51,18 @@ class Client(object):
 
         return None
 
+    def batch(self, calls):
+        """Get many paths of a reporting API in one request.
+
+           calls: a list of (path, args). Returns a list of results, None for
+           failed ones.
+        """
+        body = [{'path': path, 'args': args} for path, args in calls]
+        req = requests.post(self.end_point + '/batch', data=json.dumps(body), headers=self.headers)
+        if not self._verify(req):
+            return [None] * len(calls)
+        return [result['data'] if result['status'] < 300 else None for result in req.json()]
+
 
 class BmanClient(Client):
     """Client of Bman"""